@@ -5,16 +5,29 @@ import pyodrivecan
 import time
 import math
 
-from smbus import SMBus
 import socketio
 
+
+def default_bus():
+    """
+    The encoder's I2C bus: LSM9DS1/i2c_backends.open_bus() when it is importable (so I2C_BACKEND=sim runs without the
+    hardware, with LSM9DS1 on PYTHONPATH), otherwise smbus.SMBus(1). smbus is only imported when it is needed.
+    """
+    try:
+        from i2c_backends import open_bus
+    except ImportError:
+        from smbus import SMBus
+        return SMBus(1)
+    return open_bus()
+
+
 @dataclass
 class Encoder_as5048b:
     """
     A class to represent an AS5048B magnetic rotary encoder.
 
     Attributes:
-    - bus (SMBus): The SMBus object for I2C communication.
+    - bus: The SMBus style object for I2C communication (default_bus()).
     - address (int): The I2C address of the AS5048B encoder.
     - angle_reg (int): The register address to read the angle from.
     - angle (float): The latest read angle value after offset adjustment.
@@ -29,7 +42,7 @@ class Encoder_as5048b:
     - start_time (float): Captures the start time when the object is initialized.
     - total_rotations (int): Track total rotations of encoder.
     """
-    bus: SMBus = field(default_factory=lambda: SMBus(1))
+    bus: object = field(default_factory=default_bus)
     address: int = 0x40  # AS5048B default address
     angle_reg: int = 0xFE  # AS5048B Register
     angle: float = 0.0  # Initialized angle
@@ -0,0 +1,589 @@
+"""
+Process isolated control core.
+
+In euler_pos.main the controller shares one asyncio loop with the CAN reader, the encoder loop and the SQLite inserts,
+so every slow INSERT or garbage collection shows up as control jitter. ControlCore runs the control law in its own
+process (optionally pinned to a CPU and scheduled SCHED_FIFO, with the garbage collector disabled) on absolute
+deadlines. It talks to the I/O process through two multiprocessing.shared_memory ring buffers:
+
+    I/O process                                   control core process
+    encoder.loop() ---> sensor_pump() ---> [sensors ring] ---> control law (rate Hz)
+    odrive1.set_torque() <--- CommandSender thread <--- [commands ring] <--/
+                              command_pump() <--------------'
+                               `--> controllerData INSERTs, telemetry
+
+The torque is sent from its own thread (CommandSender), not from the asyncio loop that runs the INSERTs, so a slow
+commit or a long await does not hold back the actuation.
+
+Run `python control_core.py --benchmark` to measure the loop jitter of both designs on this machine (no rig needed).
+"""
+
+import argparse
+import asyncio
+import gc
+import math
+import multiprocessing
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+from multiprocessing import shared_memory
+
+import numpy as np
+
+import replay
+
+
+SENSOR_FIELDS = ("time", "angle", "angular_velocity")
+COMMAND_FIELDS = ("time", "sensor_seq", "angle", "angular_velocity", "lateness")
+
+
+#---------------------------------------- Shared Ring START -------------------------------------------------
+
+class SharedRing:
+    """
+    Single producer ring buffer of float64 records in shared memory.
+
+    Layout: one int64 write counter followed by `capacity` rows of [seq, *fields]. The writer invalidates a row's seq,
+    fills it, then stamps its seq and bumps the counter. A reader works like a seqlock: it checks the seq in its copy
+    and reads the row's seq again after the copy, and drops the row if either differs from the seq it expected. A
+    row the writer started overwriting during the copy is detected instead of returned torn.
+
+    Attributes:
+    - name (str): Shared memory block name, pass it to SharedRing.attach() in the other process.
+    - fields (tuple): Field names of one record.
+    - capacity (int): Number of records kept.
+    """
+    __slots__ = ("name", "fields", "capacity", "_shm", "_counter", "_rows", "_owner")
+
+    def __init__(self, fields, capacity=1024, name=None, create=True):
+        self.fields = tuple(fields)
+        self.capacity = capacity
+        width = len(self.fields) + 1
+        size = 8 + capacity * width * 8
+        self._shm = shared_memory.SharedMemory(name=name, create=create, size=size if create else 0)
+        self._owner = create
+        self.name = self._shm.name
+        self._counter = np.ndarray((1,), dtype=np.int64, buffer=self._shm.buf, offset=0)
+        self._rows = np.ndarray((capacity, width), dtype=np.float64, buffer=self._shm.buf, offset=8)
+        if create:
+            self._counter[0] = 0
+            self._rows.fill(-1.0)
+
+
+    @classmethod
+    def attach(cls, spec):
+        """Opens a ring created by another process from its spec() tuple."""
+        name, fields, capacity = spec
+        return cls(fields, capacity, name=name, create=False)
+
+
+    def spec(self):
+        """(name, fields, capacity), picklable, for SharedRing.attach()."""
+        return (self.name, self.fields, self.capacity)
+
+
+    @property
+    def written(self):
+        """Number of records pushed so far (the seq of the newest record)."""
+        return int(self._counter[0])
+
+
+    def push(self, *values):
+        """Appends one record (one value per field) and returns its seq. Only one process may push."""
+        seq = int(self._counter[0]) + 1
+        row = self._rows[seq % self.capacity]
+        row[0] = -1.0
+        row[1:] = values
+        row[0] = seq
+        self._counter[0] = seq
+        return seq
+
+
+    def latest(self, out):
+        """
+        Copies the newest record into `out` (array of len(fields) + 1, out[0] is the seq).
+
+        Returns:
+        - The seq of the record, 0 if nothing was pushed yet.
+        """
+        while True:
+            seq = int(self._counter[0])
+            if seq == 0:
+                return 0
+            row = self._rows[seq % self.capacity]
+            out[:] = row
+            if out[0] == seq and row[0] == seq:
+                return seq
+
+
+    def read_since(self, last_seq):
+        """
+        Records pushed after `last_seq`, oldest first.
+
+        Returns:
+        - (rows, dropped): (M x len(fields) + 1) array copy with the seq in column 0, and the number of records that
+          were overwritten before they could be read.
+        """
+        newest = int(self._counter[0])
+        first = max(last_seq + 1, newest - self.capacity + 1)
+        if newest < first:
+            return self._rows[:0].copy(), 0
+        expected = np.arange(first, newest + 1)
+        index = expected % self.capacity
+        rows = self._rows[index]
+        # Seqlock re-check: the oldest rows are the ones the writer may have started overwriting during the copy
+        valid = (rows[:, 0] == expected) & (self._rows[index, 0] == expected)
+        return rows[valid], (first - last_seq - 1) + int((~valid).sum())
+
+
+    def close(self):
+        self._counter = None
+        self._rows = None
+        self._shm.close()
+        if self._owner:
+            self._shm.unlink()
+
+#---------------------------------------- Shared Ring END -------------------------------------------------
+
+
+
+#---------------------------------------- Control Core START -------------------------------------------------
+
+def _set_realtime(cpu, fifo_priority):
+    """Pins this process to `cpu` and switches it to SCHED_FIFO, printing what could not be done."""
+    if cpu is not None:
+        try:
+            os.sched_setaffinity(0, {cpu})
+        except (AttributeError, OSError) as e:
+            print(f"Error pinning control core to CPU {cpu}: {e}")
+    if fifo_priority is not None:
+        try:
+            os.sched_setscheduler(0, os.SCHED_FIFO, os.sched_param(fifo_priority))
+        except (AttributeError, OSError) as e:
+            print(f"Error setting SCHED_FIFO priority {fifo_priority} (needs root or CAP_SYS_NICE): {e}")
+
+
+def _core_main(sensor_spec, command_spec, stop, step_factory, step_args, rate, cpu, fifo_priority, stale_after, spin):
+    """Body of the control core process."""
+    _set_realtime(cpu, fifo_priority)
+    sensors = SharedRing.attach(sensor_spec)
+    commands = SharedRing.attach(command_spec)
+    n_outputs = len(commands.fields) - len(COMMAND_FIELDS)
+
+    step = step_factory(*step_args)
+    sample = replay.ReplaySample()
+    sample.accumulated_angle = sample.motor_position = sample.motor_velocity = sample.torque_estimate = math.nan
+    sample.index = 0
+    reading = np.empty(len(sensors.fields) + 1)
+    zeros = (0.0,) * n_outputs
+
+    # Everything is allocated, no collections from here on (a full collection is a multi millisecond pause)
+    gc.collect()
+    gc.freeze()
+    gc.disable()
+
+    period = 1.0 / rate
+    deadline = time.perf_counter()
+    try:
+        while not stop.is_set():
+            deadline += period
+            remaining = deadline - time.perf_counter()
+            if remaining > spin:
+                time.sleep(remaining - spin)
+            while time.perf_counter() < deadline:
+                pass
+            lateness = time.perf_counter() - deadline
+            if lateness > period:
+                deadline += period * int(lateness / period)  # overran whole cycles, skip them instead of bursting
+
+            now = time.time()
+            seq = sensors.latest(reading)
+            if seq == 0 or now - reading[1] > stale_after:
+                # No or stale sensor data: command zero torque rather than act on an old angle
+                commands.push(now, seq, reading[2] if seq else math.nan, reading[3] if seq else math.nan, lateness, *zeros)
+                continue
+
+            sample.time = now
+            sample.angle = reading[2]
+            sample.angular_velocity = reading[3]
+            outputs = step(sample)
+            commands.push(now, seq, sample.angle, sample.angular_velocity, lateness, *outputs)
+            sample.index += 1
+    finally:
+        commands.push(time.time(), -1, math.nan, math.nan, 0.0, *zeros)
+        sensors.close()
+        commands.close()
+
+
+
+class ControlCore:
+    """
+    Runs a controller function in its own process, fed from and feeding shared memory rings.
+
+    The controller function is built inside the core process by `step_factory(*step_args)` (both must be picklable,
+    e.g. replay.euler_pos_step and its gains). It is called every cycle with a replay.ReplaySample holding the newest
+    sensor record and must return one number per entry of `outputs`; the last output is the torque command.
+
+    Attributes:
+    - sensors (SharedRing): Written by the I/O process, fields SENSOR_FIELDS.
+    - commands (SharedRing): Written by the core, fields COMMAND_FIELDS + outputs.
+    - process (multiprocessing.Process): The core process once started.
+    """
+    __slots__ = ("sensors", "commands", "outputs", "process", "_stop", "_args")
+
+    def __init__(self, step_factory, step_args=(), outputs=("omega_desired", "u_raw", "u_clamped"), rate=100.0,
+                 cpu=None, fifo_priority=None, stale_after=0.05, capacity=4096, spin=0.0005):
+        """
+        Parameters:
+        - step_factory, step_args: Builds the controller function in the core process.
+        - outputs: Names of the controller outputs, the last one is sent to the motor.
+        - rate: Control rate in Hz.
+        - cpu: CPU to pin the core to (e.g. 3 on a Raspberry Pi, ideally isolated with isolcpus=3), None to not pin.
+        - fifo_priority: SCHED_FIFO priority 1-99, None to keep the normal scheduler.
+        - stale_after: Seconds after which a sensor record is too old to act on (zero torque is commanded).
+        - capacity: Records per ring.
+        - spin: Seconds before each deadline spent busy waiting instead of sleeping.
+        """
+        self.outputs = tuple(outputs)
+        self.sensors = SharedRing(SENSOR_FIELDS, capacity)
+        self.commands = SharedRing(COMMAND_FIELDS + self.outputs, capacity)
+        self.process = None
+        self._stop = multiprocessing.Event()
+        self._args = (self.sensors.spec(), self.commands.spec(), self._stop, step_factory, tuple(step_args), rate, cpu,
+                      fifo_priority, stale_after, spin)
+
+
+    def start(self):
+        self.process = multiprocessing.Process(target=_core_main, args=self._args, name="control_core", daemon=True)
+        self.process.start()
+
+
+    def stop(self, timeout=1.0):
+        self._stop.set()
+        if self.process is not None:
+            self.process.join(timeout)
+            if self.process.is_alive():
+                self.process.terminate()
+                self.process.join()
+
+
+    def close(self):
+        """Stops the core and frees the shared memory."""
+        self.stop()
+        self.sensors.close()
+        self.commands.close()
+
+#---------------------------------------- Control Core END -------------------------------------------------
+
+
+
+#---------------------------------------- I/O Process START -------------------------------------------------
+
+class CommandSender:
+    """
+    Sends every new torque command of the core to the ODrive from a dedicated thread.
+
+    The thread only watches the newest record of the commands ring and calls odrive.set_torque() as soon as it
+    changes, so database INSERTs and telemetry on the asyncio loop do not delay the send.
+
+    Attributes:
+    - sent (int): Commands sent.
+    - send_times (np.ndarray): time.perf_counter() right after each set_torque() call, a ring indexed by sent % len.
+    """
+    __slots__ = ("odrive", "core", "poll", "sent", "send_times", "_thread", "_running")
+
+    def __init__(self, odrive, core, poll=0.0002, history=65536):
+        """
+        Parameters:
+        - odrive: pyodrivecan.ODriveCAN (anything with set_torque()).
+        - core: The ControlCore whose commands are sent.
+        - poll: Seconds between checks of the commands ring.
+        - history: Number of send times kept.
+        """
+        self.odrive = odrive
+        self.core = core
+        self.poll = poll
+        self.sent = 0
+        self.send_times = np.zeros(history)
+        self._thread = None
+        self._running = False
+
+
+    def start(self):
+        self._running = True
+        self._thread = threading.Thread(target=self._run, name="command_sender", daemon=True)
+        self._thread.start()
+        return self
+
+
+    def stop(self):
+        self._running = False
+        if self._thread is not None:
+            self._thread.join()
+
+
+    def ordered_send_times(self):
+        """The kept send times, oldest first."""
+        n = len(self.send_times)
+        if self.sent <= n:
+            return self.send_times[:self.sent].copy()
+        k = self.sent % n
+        return np.concatenate((self.send_times[k:], self.send_times[:k]))
+
+
+    def _run(self):
+        commands = self.core.commands
+        newest = np.empty(len(commands.fields) + 1)
+        torque = len(commands.fields)
+        send_times = self.send_times
+        history = len(send_times)
+        last_seq = 0
+        while self._running:
+            seq = commands.latest(newest)
+            if seq == last_seq:
+                time.sleep(self.poll)
+                continue
+            last_seq = seq
+            try:
+                self.odrive.set_torque(float(newest[torque]))
+            except Exception as e:
+                print(f"Error sending torque command: {e}")
+            send_times[self.sent % history] = time.perf_counter()
+            self.sent += 1
+
+
+async def sensor_pump(encoder, core):
+    """Copies every new encoder reading into the sensor ring until encoder.running is False."""
+    last = None
+    while encoder.running:
+        await asyncio.sleep(0)
+        reading = (encoder.angle, encoder.angular_velocity)
+        if reading != last:
+            core.sensors.push(time.time(), *reading)
+            last = reading
+
+
+async def command_pump(odrive, core, database=None, controller_data_table_name=None, trial_id=None, telemetry=None,
+                       desired_attitude_deg=0.0, poll=0.001, sender=None):
+    """
+    Sends the newest torque command to the ODrive and logs every command record, until odrive.running is False.
+
+    The commands are sent by a CommandSender thread (`sender`, default a new one started here and stopped on return),
+    so only the logging runs on the asyncio loop. Pass sender=False to send from this loop instead, ahead of the
+    logging of each batch.
+
+    Records are logged to controllerData in the euler_pos format
+    (trial_id, current_time, current_angle, angle_error, current_omega, omega_desired, u_raw, u_clamped) when
+    `database` is given, and the newest one to `telemetry` with the euler_pos telemetry fields. Both need the core to
+    use the euler_pos outputs (omega_desired, u_raw, u_clamped).
+    """
+    columns = ["trial_id", "current_time", "current_angle", "angle_error", "current_omega", "omega_desired", "u_raw", "u_clamped"]
+    index = {name: k + 1 for k, name in enumerate(core.commands.fields)}
+    torque = len(core.commands.fields)
+    own_sender = sender is None
+    if own_sender:
+        sender = CommandSender(odrive, core).start()
+    last_seq = 0
+    dropped = 0
+    try:
+        while odrive.running:
+            await asyncio.sleep(poll)
+            rows, missed = core.commands.read_since(last_seq)
+            dropped += missed
+            if not len(rows):
+                continue
+            last_seq = int(rows[-1, 0])
+            newest = rows[-1]
+            if sender is False:
+                odrive.set_torque(float(newest[torque]))
+
+            if telemetry is not None and newest[index["sensor_seq"]] > 0:
+                angle = newest[index["angle"]]
+                telemetry.log(angle, angle - desired_attitude_deg, newest[index["omega_desired"]], newest[index["angular_velocity"]],
+                              newest[index["u_clamped"]])
+            if database is not None:
+                for row in rows.tolist():
+                    if row[index["sensor_seq"]] <= 0:
+                        continue
+                    angle = row[index["angle"]]
+                    values = [trial_id, row[index["time"]], angle, angle - desired_attitude_deg, row[index["angular_velocity"]],
+                              row[index["omega_desired"]], row[index["u_raw"]], row[index["u_clamped"]]]
+                    database.insert_into_user_defined_table(controller_data_table_name, columns, values)
+    finally:
+        if own_sender:
+            sender.stop()
+    if dropped:
+        print(f"command_pump: {dropped} command records were overwritten before they were logged")
+
+
+async def supervise(core, odrive, encoder, telemetry=None, duration=100000.0, poll=0.1):
+    """
+    Time limit and shutdown for a run on the control core, the counterpart of the stop_at check in euler_pos.controller.
+
+    Waits until `duration` seconds have passed or the core process has died. Then it stops the core, commands zero
+    torque, stops sensor_pump / command_pump / encoder.loop() / odrive.loop() / telemetry.loop() through their running
+    flags and estops the ODrive.
+
+    Parameters:
+    - core: The started ControlCore.
+    - odrive: pyodrivecan.ODriveCAN driven by command_pump.
+    - encoder: Encoder read by sensor_pump.
+    - telemetry: TelemetryLogger passed to command_pump, optional.
+    - duration: Seconds to run for.
+    - poll: Seconds between checks of the time limit and the core process.
+    """
+    stop_at = time.monotonic() + duration
+    try:
+        while time.monotonic() < stop_at:
+            await asyncio.sleep(min(poll, max(stop_at - time.monotonic(), 0.0)))
+            if core.process is not None and not core.process.is_alive():
+                print(f"Error: control core exited with code {core.process.exitcode}, stopping")
+                break
+    finally:
+        core.stop()
+        odrive.set_torque(0)
+        odrive.running = False
+        encoder.running = False
+        if telemetry is not None:
+            telemetry.running = False
+        odrive.estop()
+
+#---------------------------------------- I/O Process END -------------------------------------------------
+
+
+
+#---------------------------------------- Benchmark START -------------------------------------------------
+
+def _jitter(times, period):
+    """Period error statistics of a series of cycle start times, in microseconds."""
+    error = np.abs(np.diff(times) - period) * 1e6
+    return f"p50 {np.percentile(error, 50):8.1f} us   p99 {np.percentile(error, 99):8.1f} us   max {error.max():8.1f} us"
+
+
+async def _load(path, stop_at):
+    """The I/O side work of euler_pos: one committed SQLite INSERT per cycle plus garbage for the collector."""
+    with sqlite3.connect(path) as conn:
+        conn.execute("CREATE TABLE IF NOT EXISTS controllerData (trial_id INTEGER, current_time REAL, u REAL)")
+        garbage = []
+        while time.perf_counter() < stop_at:
+            conn.execute("INSERT INTO controllerData VALUES (?, ?, ?)", (1, time.time(), 0.0))
+            conn.commit()
+            garbage.append([{"a": k} for k in range(200)])  # cyclic-GC tracked containers, like the telemetry dicts
+            if len(garbage) > 50:
+                garbage.clear()
+            await asyncio.sleep(0)
+
+
+async def _fake_sensor(core, stop_at):
+    """Encoder stand-in: a new angle every millisecond."""
+    while time.perf_counter() < stop_at:
+        t = time.time()
+        if core is not None:
+            core.sensors.push(t, 30.0 * math.sin(t), 30.0 * math.cos(t))
+        await asyncio.sleep(0.001)
+
+
+class _BenchmarkODrive:
+    """ODrive stand-in that records when each torque command is sent."""
+    __slots__ = ("send_times",)
+
+    def __init__(self):
+        self.send_times = []
+
+    def set_torque(self, torque):
+        self.send_times.append(time.perf_counter())
+
+
+async def _single_loop_controller(step, stop_at, odrive):
+    """The euler_pos loop: await asyncio.sleep(0.01), then run the law and send, in the same loop as the I/O."""
+    sample = replay.ReplaySample()
+    while time.perf_counter() < stop_at:
+        await asyncio.sleep(0.01)
+        sample.time = time.time()
+        sample.angle = 30.0 * math.sin(sample.time)
+        sample.angular_velocity = 30.0 * math.cos(sample.time)
+        odrive.set_torque(step(sample)[-1])
+
+
+async def _benchmark_single(duration, path):
+    odrive = _BenchmarkODrive()
+    stop_at = time.perf_counter() + duration
+    step = replay.euler_pos_step(0.0026433333333333335, 2, 0.1, 0.0000001, 30)
+    await asyncio.gather(_single_loop_controller(step, stop_at, odrive), _fake_sensor(None, stop_at), _load(path, stop_at))
+    return np.array(odrive.send_times)
+
+
+async def _benchmark_isolated(duration, path, core):
+    stop_at = time.perf_counter() + duration
+    await asyncio.gather(_fake_sensor(core, stop_at), _load(path, stop_at))
+
+
+def benchmark(duration=10.0, cpu=None, fifo_priority=None):
+    """
+    Runs the single loop design and the isolated core for `duration` seconds each under the same I/O load, and reports
+    the period jitter where it matters: at the set_torque() call. For the core the jitter of its own cycle starts is
+    printed too.
+    """
+    path = os.path.join(tempfile.mkdtemp(), "jitter.db")
+
+    single = asyncio.run(_benchmark_single(duration, path))
+    print(f"single asyncio loop, at send      ({len(single)} cycles): {_jitter(single, 0.01)}")
+
+    core = ControlCore(replay.euler_pos_step, (0.0026433333333333335, 2, 0.1, 0.0000001, 30), rate=100.0, cpu=cpu,
+                       fifo_priority=fifo_priority, capacity=int(duration * 100) + 1024)
+    odrive = _BenchmarkODrive()
+    core.start()
+    sender = CommandSender(odrive, core).start()
+    try:
+        asyncio.run(_benchmark_isolated(duration, path, core))
+    finally:
+        core.stop()
+        sender.stop()
+        rows, _ = core.commands.read_since(0)
+        core.close()
+    sent = np.array(odrive.send_times[1:-1])  # leave out the first send and the shutdown record
+    print(f"isolated control core, at send    ({len(sent)} cycles): {_jitter(sent, 0.01)}")
+    times = rows[rows[:, 2] > 0, 1]  # leave out the startup (no sensor yet) and shutdown records
+    print(f"isolated control core, core cycle ({len(times)} cycles): {_jitter(times, 0.01)}")
+
+#---------------------------------------- Benchmark END -------------------------------------------------
+
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Control core jitter benchmark (single asyncio loop vs isolated process).')
+    parser.add_argument('--benchmark', action='store_true', help='Run the jitter benchmark.')
+    parser.add_argument('--duration', type=float, default=10.0, help='Seconds per design.')
+    parser.add_argument('--cpu', type=int, help='CPU to pin the control core to.')
+    parser.add_argument('--fifo', type=int, help='SCHED_FIFO priority for the control core.')
+    args = parser.parse_args()
+    if args.benchmark:
+        benchmark(args.duration, args.cpu, args.fifo)
+    else:
+        parser.print_help()
+
+
+
+"""
+Example
+
+import control_core
+import replay
+
+core = control_core.ControlCore(replay.euler_pos_step, (J_zz, K, Kp, Kd, desired_attitude_deg), rate=100, cpu=3, fifo_priority=80)
+core.start()
+try:
+    await asyncio.gather(
+        odrive1.loop(),
+        encoder.loop(),
+        control_core.sensor_pump(encoder, core),
+        control_core.command_pump(odrive1, core, database, 'controllerData', next_trial_id, telemetry, desired_attitude_deg),
+        control_core.supervise(core, odrive1, encoder, telemetry, duration=600),
+        telemetry.loop(),
+    )
+finally:
+    core.close()
+    odrive1.estop()
+"""
@@ -3,6 +3,11 @@ import asyncio
 from datetime import datetime, timedelta
 import aysnc_as5048b
 import time
+import pid
+import control_core
+import replay
+from telemetry_logger import TelemetryLogger
+from loop_timing import LoopTimer
 
 
 #------------------------ Controller Parameters from each Trial --------------------------------------------
@@ -139,37 +144,29 @@ def control_law_single_axis(J_zz, K, omega_z):
 
 
 
-def calculate_w_angle_desired(angle_error, angle_error_prev, dt, Kp, Kd, current_angular_velocity):
+def angle_pd_controller(Kp, Kd, desired_attitude_deg):
     """
-    Calculates the desired angular velocity based on angle error using a PD control strategy.
+    Creates the PD controller that turns the angle into the desired angular velocity.
+
+    omega_desired = Kp * theta_bar + Kd * d(theta_bar)/dt with theta_bar = current - desired. pid.PD works on
+    desired - current, so it gets the negated gains. The derivative is taken on the measured angle with the real
+    time between cycles.
 
     Parameters:
-    - angle_error: Current angle error.
-    - angle_error_prev: Previous angle error.
-    - dt: Time step between the current and previous error.
     - Kp: Proportional gain.
-    - Kd: Derivative gain on the current angular velocity.
+    - Kd: Derivative gain.
+    - desired_attitude_deg: Desired attitude in degrees.
 
     Returns:
-    - omega_desired: Desired angular velocity.
+    - pid.PD instance, call .update(current_angle, t=current_time) once per cycle.
     """
-    # angle errror
-    e = angle_error  
-    
-    # Calculate the derivative of the error
-    e_prev = angle_error_prev  
-    de_dt = (e - e_prev) / dt
-    
-    # Apply PD control law
-    omega_desired = (Kp * e) + (Kd * de_dt)
-  
-    return omega_desired
+    return pid.PD(-Kp, -Kd, setpoint=desired_attitude_deg)
 
 
 
 
 #Example of how you can create a controller to get data from the O-Drives and then send motor comands based on that data.
-async def controller(odrive1, encoder, database, controller_data_table_name, next_trial_id, J_zz, K, Kp, Kd, desired_attitude_deg):
+async def controller(odrive1, encoder, database, controller_data_table_name, next_trial_id, J_zz, K, Kp, Kd, desired_attitude_deg, telemetry, timer):
     """
     Controls the motor based on encoder data, calculates control inputs, and sends commands to the motor.
 
@@ -185,6 +182,8 @@ async def controller(odrive1, encoder, database, controller_data_table_name, nex
     - Kd: Derivative gain for PD control.
     - desired_attitude_deg: Desired attitude in degrees.
     - omega_desired: Desired angular velocity in radians per second.
+    - telemetry: TelemetryLogger the cycle values are recorded in (printed by telemetry.loop()).
+    - timer: LoopTimer with the phases ("sensor", "compute", "send", "db").
     """
     odrive1.clear_errors(identify=False)
     await asyncio.sleep(0.2)
@@ -192,9 +191,8 @@ async def controller(odrive1, encoder, database, controller_data_table_name, nex
     await asyncio.sleep(0.2)
     odrive1.set_torque(0)
 
-    last_time = time.time()  # Capture the current time
     last_angle = 0 
-    angle_error_prev = 0
+    angle_pd = angle_pd_controller(Kp, Kd, desired_attitude_deg)
 
     fixed_duration = 0.01 # Fixed sleep duration to control loop frequency
     
@@ -203,12 +201,10 @@ async def controller(odrive1, encoder, database, controller_data_table_name, nex
     while datetime.now() < stop_at:
         # Sleep for a fixed duration to maintain loop frequency
         await asyncio.sleep(fixed_duration)
+        timer.start()
 
 
         current_time = time.time()  # Capture the current time
-        dt = current_time - last_time  # Calculate dt as the difference between current time and last time
-        #print(f"dt: {dt}")
-        #dt = fixed_duration
 
         #Get the current angle of the encoder
         current_angle = encoder.angle
@@ -219,9 +215,10 @@ async def controller(odrive1, encoder, database, controller_data_table_name, nex
 
         # Get the current angluar velocity of the encoder
         current_angular_velocity = encoder.angular_velocity
+        timer.mark(0)  # sensor
 
         # Calulating the omega desired based on current error using PD controller
-        omega_desired = calculate_w_angle_desired(angle_error, angle_error_prev, dt, Kp, Kd, current_angular_velocity)
+        omega_desired = angle_pd.update(current_angle, t=current_time)
 
         # Use the desired omega to compute the control torque
         controller_torque_output = control_law_single_axis(J_zz, K, omega_desired)
@@ -229,15 +226,15 @@ async def controller(odrive1, encoder, database, controller_data_table_name, nex
         # Clamping the output torque to be withing the min and max of the O-Drive Controller (Max Torque limit of motor for 1DOF is 0.6 NM)
         controller_torque_output_clamped= clamp(controller_torque_output, -0.1, 0.1)
         
-        print(f"Current: {current_angle}; Error: {angle_error};  Desired Angular Velocity: {omega_desired:.10f};  Current Angular Velocity: {current_angular_velocity:.10f};  Controller Clampped Output: {controller_torque_output_clamped:.10f}")
+        telemetry.log(current_angle, angle_error, omega_desired, current_angular_velocity, controller_torque_output_clamped)
+        timer.mark(1)  # compute
 
         #Send controller output torque to motor
         odrive1.set_torque(controller_torque_output_clamped)
+        timer.mark(2)  # send
 
 
         last_angle = current_angle
-        angle_error_prev = angle_error
-        last_time = current_time  # Update last_time for the next iteration
 
         """
         #Prepare data for websocket
@@ -259,9 +256,12 @@ async def controller(odrive1, encoder, database, controller_data_table_name, nex
         data = [next_trial_id, current_time, current_angle, angle_error, current_angular_velocity, omega_desired, controller_torque_output, controller_torque_output_clamped]
         #Add to database
         upload_controller_data(database, controller_data_table_name, data)
+        timer.mark(3)  # db
+        timer.end_cycle()
         
 
     odrive1.running = False
+    telemetry.running = False
     odrive1.estop()
 
 
@@ -314,17 +314,59 @@ async def main():
     controller_data_table_init(database, controller_data_table_name)
 
 
+    #Console output at 5 lines per second instead of every cycle
+    telemetry = TelemetryLogger(
+        ("Current", "Error", "Desired Angular Velocity", "Current Angular Velocity", "Controller Clampped Output"),
+        display_rate=5,
+        formats={"Desired Angular Velocity": ".10f", "Current Angular Velocity": ".10f", "Controller Clampped Output": ".10f"},
+    )
+
+    #Time spent per phase of each controller cycle, printed on shutdown
+    timer = LoopTimer(("sensor", "compute", "send", "db"))
+
+    #Run the control law in its own process (control_core.py) so database inserts and GC pauses in this loop do not
+    #delay it. Pin it to a free CPU and give it a SCHED_FIFO priority when running as root.
+    isolated_control_core = False
+    control_core_cpu = 3
+    control_core_fifo_priority = 80
+
+    if isolated_control_core:
+        core = control_core.ControlCore(replay.euler_pos_step, (J_zz, K, Kp, Kd, desired_attitude_deg), rate=100,
+                                        cpu=control_core_cpu, fifo_priority=control_core_fifo_priority)
+        core.start()
+        odrive1.clear_errors(identify=False)
+        await asyncio.sleep(0.2)
+        odrive1.setAxisState("closed_loop_control")
+        await asyncio.sleep(0.2)
+        control_tasks = (
+            control_core.sensor_pump(encoder, core),
+            control_core.command_pump(odrive1, core, database, controller_data_table_name, next_trial_id, telemetry, desired_attitude_deg),
+            #Same time limit as controller(), then zero torque, stop every loop and estop
+            control_core.supervise(core, odrive1, encoder, telemetry, duration=100000),
+        )
+    else:
+        core = None
+        control_tasks = (
+            controller(odrive1, encoder, database, controller_data_table_name, next_trial_id, J_zz, K, Kp, Kd, desired_attitude_deg, telemetry, timer),
+        )
+
     try:
         #add each odrive to the async loop so they will run.
         await asyncio.gather(
             odrive1.loop(),
-            controller(odrive1, encoder, database, controller_data_table_name, next_trial_id, J_zz, K, Kp, Kd, desired_attitude_deg), 
+            *control_tasks,
             encoder.loop(), #This runs the external encoder code
+            telemetry.loop(), #This prints the controller telemetry
         )
     except KeyboardInterrupt:
         odrive1.estop()
     finally:
+        if core is not None:
+            core.close()
         odrive1.estop()
+        print(telemetry.summary())
+        if not isolated_control_core:
+            print(timer.report("Controller loop timing"))
 
 
 
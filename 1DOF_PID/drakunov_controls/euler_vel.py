@@ -3,6 +3,7 @@ import asyncio
 from datetime import datetime, timedelta
 import aysnc_as5048b
 import time
+import pid
 
 
 
@@ -115,33 +116,30 @@ def control_law_single_axis(J_zz, K, omega_z, calculated_omega_desired):
     return u_z
 
 
-def calculate_w_angle_desired(angle_error, angle_error_prev, dt, Kp, Kd, current_angular_velocity):
+def angle_velocity_cascade(J_zz, K, Kp, Kd, desired_attitude_deg, dt):
     """
-    Calculates the desired angular velocity based on the proportional-derivative (PD) control of the angle error.
+    Creates the cascaded angle -> desired angular velocity -> torque controller.
+
+    Outer loop: omega_desired = Kp * theta_bar + Kd * omega with theta_bar = current - desired (pid.PD works on
+    desired - current, so it gets the negated gains, and the measured angular velocity is its derivative input).
+    Inner loop: u_z = -J_zz * K * (omega - omega_desired), the same as control_law_single_axis, clamped to the
+    O-Drive torque limits.
 
     Parameters:
-    - angle_error: Current angle error.
-    - angle_error_prev: Previous angle error.
-    - dt: Time step between current and previous error measurements.
+    - J_zz: Moment of inertia about the z-axis.
+    - K: Control gain for the z-axis.
     - Kp: Proportional gain.
     - Kd: Derivative gain.
-    - current_angular_velocity: Current angular velocity.
+    - desired_attitude_deg: Desired angular position in degrees.
+    - dt: Fixed control loop period in seconds.
 
     Returns:
-    - omega_desired: Desired angular velocity.
+    - pid.CascadePID instance, call .update(current_angle, current_angular_velocity) once per cycle.
     """
-    # angle errror
-    e = angle_error  
-    
-    # Calculate the derivative of the error
-    e_prev = angle_error_prev  
-    de_dt = (e - e_prev) / dt
-    
-
-    # Apply PD control law
-    omega_desired = Kp * e + Kd * current_angular_velocity
-    
-    return omega_desired
+    return pid.CascadePID(
+        pid.PD(-Kp, -Kd, setpoint=desired_attitude_deg, dt=dt),
+        pid.PID(J_zz * K, 0.0, 0.0, lower_limit=-0.1, upper_limit=0.1, dt=dt),
+    )
 
 
 
@@ -169,10 +167,9 @@ async def controller(odrive1, encoder, database, controller_data_table_name, nex
     await asyncio.sleep(0.2)
     odrive1.set_torque(0)
 
-    last_time = time.time()  # Capture the current time
     last_angle = 0 
-    angle_error_prev = 0
     fixed_duration = 0.005  # Fixed sleep duration to control loop frequency
+    cascade = angle_velocity_cascade(J_zz, K, Kp, Kd, desired_attitude_deg, fixed_duration)
     
     #Run for set time delay example runs for 15 seconds.
     stop_at = datetime.now() + timedelta(seconds=100000)
@@ -182,8 +179,6 @@ async def controller(odrive1, encoder, database, controller_data_table_name, nex
 
 
         current_time = time.time()  # Capture the current time
-        #dt = current_time - last_time  # Calculate dt as the difference between current time and last time
-        dt = fixed_duration
 
         #Get the current angle of the encoder
         current_angle = encoder.total_accumulated_angle
@@ -194,15 +189,10 @@ async def controller(odrive1, encoder, database, controller_data_table_name, nex
         # Get the current angluar velocity of the encoder
         current_angular_velocity = encoder.angular_velocity
 
-        calculated_omega_desired = calculate_w_angle_desired(angle_error, angle_error_prev, dt, Kp, Kd, current_angular_velocity)
-    
-        # Use the desired angular velocity to compute the control torque
-        # Assuming omega_z is the component of omega_desired along the z-axis
-        controller_torque_output = control_law_single_axis(J_zz, K, current_angular_velocity, calculated_omega_desired)
-        
-        
-        # Clamping the output torque to be withing the min and max of the O-Drive Controller
-        controller_torque_output_clamped= clamp(controller_torque_output, -0.1, 0.1)
+        # Desired angular velocity from the angle, then the control torque from the angular velocity error
+        # (clamped to the min and max of the O-Drive Controller by the inner loop)
+        controller_torque_output_clamped = cascade.update(current_angle, current_angular_velocity)
+        controller_torque_output = cascade.velocity_loop.unclamped
         #print(f"Controller Raw Output: {controller_torque_output}, Controller Clampped Output: {controller_torque_output_clamped}, Current Angular Velocity: {current_angular_velocity}")
 
         print(f"Current Angle: {current_angle} deg;    Desired Angular Velocity: {omega_desired} rad/s;   Controller Clampped Output: {controller_torque_output_clamped:.15f} Nm;   Current Angular Velocity: {current_angular_velocity:.15f} rad/s")
@@ -212,8 +202,6 @@ async def controller(odrive1, encoder, database, controller_data_table_name, nex
 
 
         last_angle = current_angle
-        angle_error_prev = angle_error
-        last_time = current_time  # Update last_time for the next iteration
 
         # Example print to debug dt values
         #print(f"dt: {dt:.3f} seconds")
@@ -0,0 +1,321 @@
+"""
+Gain sweep / auto-tuner for the euler_pos controller on a simulated 1-DOF plant.
+
+Thousands of closed loop simulations run side by side as NumPy arrays (one element per gain set, the angle PD is a
+pid.PIDBatch), optionally split over a process pool. Every run is scored on settling time, overshoot and torque usage,
+and the best gain sets can be written to the database in the controllerParameters format
+(trial_id, J_zz, K, Kp, Kd, target_deg, notes).
+
+Example:
+    python gain_sweep.py --Kp 0.01 2 --Kd 0.0001 0.5 --points 60             # 60 x 60 log spaced grid
+    python gain_sweep.py --random 20000 --Kp 0.01 2 --Kd 0.0001 0.5 --K 0.5 20 --processes 4
+    python gain_sweep.py --plant pendulum --target_deg 45 --save odrive_data.db   # with gravity feedforward
+
+Only runs that settled are ranked and saved; the sweep fails if none of them did.
+"""
+
+import argparse
+import math
+import os
+import sqlite3
+import time
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import closing
+
+import numpy as np
+
+import pid
+
+
+#Starting points for the two rigs, override with --inertia / --gravity_torque / --damping
+PLANTS = {
+    # Reaction wheel body on a vertical axis: no gravity torque
+    "reaction_wheel": {"inertia": 0.0026433333333333335, "gravity_torque": 0.0, "damping": 0.0005},
+    # Pendulum arm driven about a horizontal axis, m * g * l of the arm in N*m
+    "pendulum": {"inertia": 0.0026433333333333335, "gravity_torque": 0.049, "damping": 0.001},
+}
+
+ENCODER_RESOLUTION_DEG = 360.0 / 16384  # AS5048B, 14 bit
+
+METRICS = ("settling_time", "overshoot", "effort", "final_error", "score")
+
+
+#---------------------------------------- Simulation START -------------------------------------------------
+
+def simulate(J_zz, K, Kp, Kd, target_deg, plant="reaction_wheel", duration=5.0, dt=0.01, torque_limit=0.1,
+             initial_deg=0.0, settle_band_deg=1.0, hold_time=0.5, noise_deg=0.0, quantize=True, overshoot_weight=0.05,
+             effort_weight=5.0, gravity_feedforward=None, seed=None, **plant_overrides):
+    """
+    Runs one closed loop simulation per gain set, all at once.
+
+    The controller is the euler_pos loop: omega_desired from the angle PD (degrees, derivative on the measured angle),
+    u = -J_zz * K * omega_desired clamped to +-torque_limit. The plant is
+    inertia * theta'' = u - gravity_torque * sin(theta) - damping * theta', with the sign convention the rig's
+    controllers assume and replay.py's demo plant uses (a positive torque command increases the measured angle).
+
+    The PD law has no integral term, so on a plant with gravity torque it holds a steady state error that never fits
+    in the settling band. With gravity_feedforward the controller adds gravity_torque * sin(measured angle) before the
+    clamp, like the pendulum arm's GravityCompensationTable in ACTIV/pendulum_arm_testing.
+
+    Parameters:
+    - J_zz, K, Kp, Kd: Controller constants, scalars or (N,) arrays.
+    - target_deg: Desired attitude in degrees.
+    - plant: Name of a PLANTS preset.
+    - duration: Simulated seconds.
+    - dt: Controller period in seconds (euler_pos sleeps 0.01 s per cycle).
+    - torque_limit: Output clamp in N*m.
+    - initial_deg: Starting angle in degrees.
+    - settle_band_deg: The run counts as settled once the error stays inside this band.
+    - hold_time: The error has to stay inside the band for at least the last hold_time seconds of the run, so a run
+      that is only passing through the band at the end (or still oscillating) does not count as settled.
+    - noise_deg: Standard deviation of Gaussian encoder noise in degrees.
+    - quantize: Round the measured angle to the AS5048B resolution.
+    - overshoot_weight: Seconds of score per percent of overshoot.
+    - effort_weight: Seconds of score per N*m*s of torque usage.
+    - gravity_feedforward: Add the gravity torque feedforward, default is on when the plant has a gravity torque.
+    - seed: Seed of the noise generator.
+    - plant_overrides: inertia / gravity_torque / damping replacing the preset values.
+
+    Returns:
+    - Dict of metric name -> (N,) array: settling_time [s] (inf if it never settles), overshoot [% of the step],
+      effort [integral of |u| in N*m*s], final_error [deg], score [lower is better].
+    """
+    params = dict(PLANTS[plant])
+    params.update({key: value for key, value in plant_overrides.items() if value is not None})
+    inertia, gravity_torque, damping = params["inertia"], params["gravity_torque"], params["damping"]
+    if gravity_feedforward is None:
+        gravity_feedforward = gravity_torque != 0.0
+
+    J_zz, K, Kp, Kd = (np.array(g, dtype=np.float64) for g in np.broadcast_arrays(J_zz, K, Kp, Kd))
+    n = J_zz.shape[0] if J_zz.ndim else 1
+    J_zz, K, Kp, Kd = (g.reshape(n) for g in (J_zz, K, Kp, Kd))
+
+    angle_pd = pid.PIDBatch(-Kp, 0.0, -Kd, dt, setpoint=target_deg)
+    torque_gain = -J_zz * K
+    rng = np.random.default_rng(seed)
+
+    theta = np.full(n, math.radians(initial_deg))
+    omega = np.zeros(n)
+    measured = np.empty(n)
+    u = np.empty(n)
+    alpha = np.empty(n)
+
+    step = target_deg - initial_deg
+    direction = 1.0 if step >= 0 else -1.0
+    peak = np.full(n, -np.inf)
+    effort = np.zeros(n)
+    last_outside = np.zeros(n)
+
+    steps = int(round(duration / dt))
+    for k in range(steps):
+        np.degrees(theta, out=measured)
+        if noise_deg:
+            measured += rng.normal(0.0, noise_deg, n)
+        if quantize:
+            np.round(measured / ENCODER_RESOLUTION_DEG, out=measured)
+            measured *= ENCODER_RESOLUTION_DEG
+
+        omega_desired = angle_pd.update(measured)
+        np.multiply(torque_gain, omega_desired, out=u)
+        if gravity_feedforward:
+            u += gravity_torque * np.sin(np.radians(measured))
+        np.clip(u, -torque_limit, torque_limit, out=u)
+
+        # Semi implicit Euler, the torque is held for one controller period
+        np.sin(theta, out=alpha)
+        alpha *= -gravity_torque
+        alpha += u
+        alpha -= damping * omega
+        alpha /= inertia
+        omega += alpha * dt
+        theta += omega * dt
+
+        error = np.degrees(theta) - target_deg
+        np.maximum(peak, error * direction, out=peak)
+        effort += np.abs(u) * dt
+        last_outside[np.abs(error) > settle_band_deg] = (k + 1) * dt
+
+    final_error = np.degrees(theta) - target_deg
+    settled = last_outside <= steps * dt - hold_time
+    settling_time = np.where(settled, last_outside, np.inf)
+    overshoot = np.maximum(peak, 0.0) / abs(step) * 100.0 if step else np.maximum(peak, 0.0)
+    score = settling_time + overshoot_weight * overshoot + effort_weight * effort
+
+    return {
+        "settling_time": settling_time,
+        "overshoot": overshoot,
+        "effort": effort,
+        "final_error": final_error,
+        "score": score,
+    }
+
+
+def _simulate_chunk(args):
+    gains, kwargs = args
+    return simulate(*gains, **kwargs)
+
+
+def sweep(J_zz, K, Kp, Kd, target_deg, processes=1, **kwargs):
+    """
+    simulate() split into one chunk per process.
+
+    Parameters:
+    - J_zz, K, Kp, Kd: (N,) gain arrays (or scalars).
+    - target_deg: Desired attitude in degrees.
+    - processes: Number of worker processes, 1 runs everything in this process as one batch.
+    - kwargs: Passed on to simulate().
+
+    Returns:
+    - Same dict as simulate().
+    """
+    gains = [np.array(g, dtype=np.float64) for g in np.broadcast_arrays(J_zz, K, Kp, Kd)]
+    kwargs["target_deg"] = target_deg
+    if processes <= 1 or gains[0].size < 2 * processes:
+        return simulate(*gains, **kwargs)
+
+    chunks = [list(chunk) for chunk in zip(*(np.array_split(g.ravel(), processes) for g in gains))]
+    with ProcessPoolExecutor(max_workers=processes) as pool:
+        results = list(pool.map(_simulate_chunk, [(chunk, kwargs) for chunk in chunks]))
+    return {name: np.concatenate([r[name] for r in results]) for name in METRICS}
+
+
+def grid(*ranges, points=20):
+    """
+    Log spaced grid over every (min, max) range, a range with one value stays fixed.
+
+    Returns:
+    - List of (N,) arrays, one per range, covering every combination.
+    """
+    axes = [np.geomspace(r[0], r[-1], points) if len(r) > 1 and r[0] != r[-1] else np.array([r[0]], dtype=np.float64)
+            for r in ranges]
+    return [axis.ravel() for axis in np.meshgrid(*axes, indexing="ij")]
+
+
+def random_search(*ranges, samples=1000, seed=None):
+    """
+    Log uniform random samples inside every (min, max) range, a range with one value stays fixed.
+
+    Returns:
+    - List of (N,) arrays, one per range.
+    """
+    rng = np.random.default_rng(seed)
+    return [np.exp(rng.uniform(math.log(r[0]), math.log(r[-1]), samples)) if len(r) > 1 else np.full(samples, float(r[0]))
+            for r in ranges]
+
+#---------------------------------------- Simulation END -------------------------------------------------
+
+
+
+#---------------------------------------- Database START -------------------------------------------------
+
+PARAMETER_COLUMNS = [("J_zz", "REAL"), ("K", "REAL"), ("Kp", "REAL"), ("Kd", "REAL"), ("target_deg", "REAL"), ("notes", "TEXT")]
+
+
+def save_winners(database, table_name, rows):
+    """
+    Writes gain sets in the controllerParameters format.
+
+    Parameters:
+    - database: pyodrivecan.OdriveDatabase or the path of the database file.
+    - table_name: Table to write, created with the controllerParameters columns if it does not exist.
+    - rows: List of (J_zz, K, Kp, Kd, target_deg, notes).
+
+    Returns:
+    - The trial_id the rows were written under (one past the highest trial_id already in the table).
+    """
+    columns = ["trial_id"] + [name for name, _ in PARAMETER_COLUMNS]
+    if isinstance(database, str):
+        with closing(sqlite3.connect(database)) as conn:
+            columns_sql = ", ".join(f"{name} {data_type}" for name, data_type in PARAMETER_COLUMNS)
+            conn.execute(f"CREATE TABLE IF NOT EXISTS {table_name} (UniqueID INTEGER PRIMARY KEY AUTOINCREMENT, "
+                         f"trial_id INTEGER NOT NULL, {columns_sql}, FOREIGN KEY (trial_id) REFERENCES ODriveData(trial_id))")
+            trial_id = (conn.execute(f"SELECT MAX(trial_id) FROM {table_name}").fetchone()[0] or 0) + 1
+            conn.executemany(f"INSERT INTO {table_name} ({', '.join(columns)}) VALUES ({', '.join('?' * len(columns))})",
+                             [(trial_id,) + tuple(row) for row in rows])
+            conn.commit()
+        return trial_id
+
+    database.create_user_defined_table(table_name, PARAMETER_COLUMNS)
+    trial_id = ((database.fetch(f"SELECT MAX(trial_id) FROM {table_name}") or [(None,)])[0][0] or 0) + 1
+    for row in rows:
+        database.insert_into_user_defined_table(table_name, columns, (trial_id,) + tuple(row))
+    return trial_id
+
+#---------------------------------------- Database END -------------------------------------------------
+
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Sweep euler_pos gains on a simulated 1-DOF plant and rank them.')
+    parser.add_argument('--plant', choices=sorted(PLANTS), default='reaction_wheel', help='Plant preset.')
+    parser.add_argument('--inertia', type=float, help='Plant inertia in kg*m^2 (default from the preset).')
+    parser.add_argument('--gravity_torque', type=float, help='Plant m*g*l in N*m (default from the preset).')
+    parser.add_argument('--damping', type=float, help='Plant viscous damping in N*m*s/rad (default from the preset).')
+    parser.add_argument('--J_zz', type=float, nargs='+', default=[0.0026433333333333335], help='J_zz value or min max.')
+    parser.add_argument('--K', type=float, nargs='+', default=[2.0], help='K value or min max.')
+    parser.add_argument('--Kp', type=float, nargs='+', default=[0.01, 2.0], help='Kp value or min max.')
+    parser.add_argument('--Kd', type=float, nargs='+', default=[1e-4, 0.5], help='Kd value or min max.')
+    parser.add_argument('--points', type=int, default=40, help='Grid points per swept range.')
+    parser.add_argument('--random', type=int, help='Random search with this many samples instead of the grid.')
+    parser.add_argument('--target_deg', type=float, default=30.0, help='Step target in degrees.')
+    parser.add_argument('--initial_deg', type=float, default=0.0, help='Starting angle in degrees.')
+    parser.add_argument('--duration', type=float, default=5.0, help='Simulated seconds per run.')
+    parser.add_argument('--dt', type=float, default=0.01, help='Controller period in seconds.')
+    parser.add_argument('--settle_band_deg', type=float, default=1.0, help='Settling band in degrees.')
+    parser.add_argument('--hold_time', type=float, default=0.5, help='Seconds the error has to stay in the band at the end.')
+    parser.add_argument('--torque_limit', type=float, default=0.1, help='Torque clamp in N*m.')
+    parser.add_argument('--gravity_feedforward', action=argparse.BooleanOptionalAction,
+                        help='Add the gravity torque feedforward (default on when the plant has a gravity torque).')
+    parser.add_argument('--noise_deg', type=float, default=0.0, help='Encoder noise standard deviation in degrees.')
+    parser.add_argument('--processes', type=int, default=1, help='Worker processes (0 = one per CPU).')
+    parser.add_argument('--top', type=int, default=10, help='Number of gain sets to print / save.')
+    parser.add_argument('--save', type=str, help='Database file to write the winners to.')
+    parser.add_argument('--table', type=str, default='tunedParameters', help='Table the winners are written to.')
+    parser.add_argument('--seed', type=int, default=0, help='Random seed.')
+    args = parser.parse_args()
+
+    ranges = (args.J_zz, args.K, args.Kp, args.Kd)
+    if args.random:
+        J_zz, K, Kp, Kd = random_search(*ranges, samples=args.random, seed=args.seed)
+    else:
+        J_zz, K, Kp, Kd = grid(*ranges, points=args.points)
+
+    gravity_torque = args.gravity_torque if args.gravity_torque is not None else PLANTS[args.plant]["gravity_torque"]
+    feedforward = args.gravity_feedforward if args.gravity_feedforward is not None else gravity_torque != 0.0
+
+    processes = args.processes or os.cpu_count()
+    start = time.perf_counter()
+    results = sweep(J_zz, K, Kp, Kd, args.target_deg, processes=processes, plant=args.plant, duration=args.duration,
+                    dt=args.dt, torque_limit=args.torque_limit, initial_deg=args.initial_deg,
+                    settle_band_deg=args.settle_band_deg, hold_time=args.hold_time, noise_deg=args.noise_deg,
+                    gravity_feedforward=feedforward, seed=args.seed, inertia=args.inertia, gravity_torque=args.gravity_torque, damping=args.damping)
+    elapsed = time.perf_counter() - start
+    n = len(Kp)
+    settled = np.flatnonzero(np.isfinite(results["score"]))
+    print(f"{n} simulations x {args.duration:g} s in {elapsed:.2f} s ({n * args.duration / elapsed:.0f}x real time), "
+          f"{len(settled)} settled")
+    if not len(settled):
+        closest = np.nanmin(np.abs(results["final_error"]))
+        raise SystemExit(f"Error: no gain set settled within {args.settle_band_deg:g} deg (closest final error "
+                         f"{closest:.3f} deg), nothing ranked or saved. Widen the gain ranges, --duration or "
+                         f"--settle_band_deg" + ("" if feedforward or gravity_torque == 0.0 else ", or use --gravity_feedforward"))
+
+    # Runs that never settled score inf, they are left out instead of being ranked behind the rest
+    order = settled[np.argsort(results["score"][settled], kind="stable")[:args.top]]
+    winners = []
+    print(f"{'rank':>4} {'J_zz':>10} {'K':>8} {'Kp':>10} {'Kd':>10} {'settle [s]':>10} {'overshoot [%]':>13} {'effort [Nms]':>12} {'score':>8}")
+    for rank, i in enumerate(order, start=1):
+        settling, overshoot, effort, score = (results[m][i] for m in ("settling_time", "overshoot", "effort", "score"))
+        print(f"{rank:>4} {J_zz[i]:>10.6g} {K[i]:>8.4g} {Kp[i]:>10.4g} {Kd[i]:>10.4g} {settling:>10.3f} {overshoot:>13.2f} {effort:>12.4f} {score:>8.3f}")
+        notes = (f"gain_sweep rank {rank} on {args.plant}: settling {settling:.3f} s, overshoot {overshoot:.2f} %, "
+                 f"effort {effort:.4f} N*m*s" + (", with gravity feedforward" if feedforward else ""))
+        winners.append((float(J_zz[i]), float(K[i]), float(Kp[i]), float(Kd[i]), args.target_deg, notes))
+
+    if args.save:
+        trial_id = save_winners(args.save, args.table, winners)
+        print(f"Saved {len(winners)} gain sets to {args.table} in {args.save} as trial_id {trial_id}")
+
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,369 @@
+import math
+import time
+
+import numpy as np
+
+
+class PID:
+    """
+    PID controller with a fixed or externally supplied time step, derivative on measurement and back-calculation
+    anti-windup.
+
+    - Time step: `dt` fixed at construction, or the `t` timestamp passed to update(), or the clock (time.monotonic)
+      when neither is given. A zero or negative time step keeps the previous output instead of dividing by ~0.
+    - Derivative on measurement: the D term uses the change of the measurement, not of the error, so setpoint steps do
+      not kick the output. If the caller already has the rate (e.g. encoder.angular_velocity) it can pass it as `rate`
+      instead. The D term can be low-pass filtered with time constant `derivative_filter`.
+    - Anti-windup: while the output is clamped the integral is pulled back by tracking_gain * (clamped - unclamped),
+      so the integral stops growing as soon as the output saturates.
+
+    Negative gains are allowed, e.g. for a reaction wheel where the body turns the opposite way to the motor torque.
+
+    Attributes:
+    - kp, ki, kd (float): Gains.
+    - setpoint: Desired value, or a (lower, upper) range with zero error inside the range.
+    - lower_limit, upper_limit (float): Output limits.
+    - integral (float): Integral term (already multiplied by ki, so gains can be changed on the fly).
+    - derivative (float): Filtered derivative term.
+    - output (float): Last (clamped) output.
+    - unclamped (float): Last output before clamping.
+    """
+    __slots__ = (
+        "kp", "ki", "kd", "setpoint", "lower_limit", "upper_limit", "dt", "derivative_filter", "tracking_gain", "clock",
+        "integral", "derivative", "output", "unclamped", "last_error", "last_measurement", "last_time",
+    )
+
+    def __init__(self, kp, ki, kd, setpoint=0.0, lower_limit=-math.inf, upper_limit=math.inf, dt=None,
+                 derivative_filter=None, tracking_gain=None, clock=time.monotonic):
+        """
+        Parameters:
+        - kp, ki, kd: Proportional, integral and derivative gains.
+        - setpoint: Desired value, or a (lower, upper) tuple/list for a range.
+        - lower_limit, upper_limit: Output limits, default is unlimited.
+        - dt: Fixed time step in seconds, None to measure it from the timestamps.
+        - derivative_filter: Time constant in seconds of the low-pass filter on the D term, None for no filter.
+        - tracking_gain: Anti-windup back-calculation gain in 1/s, default is ki / kp (or 1 if kp is 0).
+        - clock: Function returning the current time in seconds, used when update() gets no timestamp.
+        """
+        self.kp = kp  # Proportional gain
+        self.ki = ki  # Integral gain
+        self.kd = kd  # Derivative gain
+        self.setpoint = setpoint  # Desired value or range (tuple for range, single value otherwise)
+        self.lower_limit = lower_limit  # Minimum output limit
+        self.upper_limit = upper_limit  # Maximum output limit
+        self.dt = dt
+        self.derivative_filter = derivative_filter
+        if tracking_gain is None:
+            tracking_gain = abs(ki / kp) if kp else 1.0
+        self.tracking_gain = tracking_gain
+        self.clock = clock
+        self.reset()
+
+
+    def reset(self):
+        """Clears the integral, derivative and timing state."""
+        self.integral = 0.0
+        self.derivative = 0.0
+        self.output = 0.0
+        self.unclamped = 0.0
+        self.last_error = 0.0
+        self.last_measurement = None
+        self.last_time = None
+
+
+    def calculate_error(self, current_value):
+        """
+        Calculate error based on whether the setpoint is a single value or a range.
+        """
+        if isinstance(self.setpoint, tuple) or isinstance(self.setpoint, list):
+            # Setpoint is a range
+            lower_sp, upper_sp = self.setpoint
+            if current_value < lower_sp:
+                return lower_sp - current_value
+            elif current_value > upper_sp:
+                return upper_sp - current_value
+            else:
+                return 0  # Current value is within the setpoint range
+        else:
+            # Setpoint is a single value
+            return self.setpoint - current_value
+
+
+    def update(self, current_value, t=None, rate=None):
+        """
+        Runs one controller step.
+
+        Parameters:
+        - current_value: Measurement.
+        - t: Timestamp of the measurement in seconds, ignored when a fixed dt is set. Default reads the clock.
+        - rate: Measured rate of change of current_value, used for the D term instead of differencing.
+
+        Returns:
+        - The clamped controller output.
+
+        Example:
+            >>> pid = PID(kp=3.3, ki=0.069, kd=0.31, setpoint=0, lower_limit=-0.4, upper_limit=0.4, dt=0.005)
+            >>> torque = pid.update(encoder.angle, rate=encoder.angular_velocity)
+        """
+        dt = self.dt
+        if dt is None:
+            if t is None:
+                t = self.clock()
+            dt = 0.0 if self.last_time is None else t - self.last_time
+            if self.last_time is not None and dt <= 0.0:
+                return self.output
+            self.last_time = t
+
+        error = self.calculate_error(current_value)
+        proportional = self.kp * error
+
+        # Derivative on measurement (first step has no previous measurement, D stays 0). Inside a range setpoint the
+        # error is 0 and the loop is meant to rest, so D is off there as it was with the derivative on the error.
+        in_band = error == 0 and isinstance(self.setpoint, (tuple, list))
+        if in_band:
+            raw_derivative = 0.0
+        elif rate is not None:
+            raw_derivative = -self.kd * rate
+        elif self.last_measurement is not None and dt > 0.0:
+            raw_derivative = -self.kd * (current_value - self.last_measurement) / dt
+        else:
+            raw_derivative = self.derivative
+        if self.derivative_filter and dt > 0.0 and not in_band:
+            self.derivative += dt / (self.derivative_filter + dt) * (raw_derivative - self.derivative)
+        else:
+            self.derivative = raw_derivative
+
+        unclamped = proportional + self.integral + self.derivative
+        output = self.lower_limit if unclamped < self.lower_limit else self.upper_limit if unclamped > self.upper_limit else unclamped
+
+        # Integrate with back-calculation: bleed the integral off while the output is saturated
+        self.integral += (self.ki * error + self.tracking_gain * (output - unclamped)) * dt
+
+        self.last_error = error
+        self.last_measurement = current_value
+        self.unclamped = unclamped
+        self.output = output
+        return output
+
+
+
+class PD(PID):
+    """PID without the integral term, e.g. the angle -> desired angular velocity loop of euler_pos.py."""
+    __slots__ = ()
+
+    def __init__(self, kp, kd, setpoint=0.0, lower_limit=-math.inf, upper_limit=math.inf, dt=None,
+                 derivative_filter=None, clock=time.monotonic):
+        super().__init__(kp, 0.0, kd, setpoint, lower_limit, upper_limit, dt, derivative_filter, 0.0, clock)
+
+
+
+class CascadePID:
+    """
+    Cascaded position -> velocity -> torque loops.
+
+    The position loop turns the position error into a velocity setpoint, the velocity loop turns the velocity error
+    into the torque. Both loops share the same timestamp (or fixed dt) each step.
+
+    Attributes:
+    - position_loop (PID): Outer loop, its output is the velocity setpoint.
+    - velocity_loop (PID): Inner loop, its output is the torque.
+    """
+    __slots__ = ("position_loop", "velocity_loop")
+
+    def __init__(self, position_loop, velocity_loop):
+        """
+        Parameters:
+        - position_loop: PID / PD on position, output limits are the velocity limits.
+        - velocity_loop: PID on velocity, output limits are the torque limits.
+        """
+        self.position_loop = position_loop
+        self.velocity_loop = velocity_loop
+
+
+    @property
+    def velocity_setpoint(self):
+        return self.position_loop.output
+
+
+    def reset(self):
+        self.position_loop.reset()
+        self.velocity_loop.reset()
+
+
+    def update(self, position, velocity, t=None):
+        """
+        Runs both loops.
+
+        Parameters:
+        - position: Measured position.
+        - velocity: Measured velocity, also used as the position loop's D term rate.
+        - t: Timestamp in seconds (ignored by loops with a fixed dt).
+
+        Returns:
+        - Torque command (clamped to the velocity loop limits).
+
+        Example:
+            >>> cascade = CascadePID(PD(kp=-0.02, kd=-15, setpoint=30), PID(kp=J_zz * K, ki=0, kd=0, lower_limit=-0.1, upper_limit=0.1))
+            >>> torque = cascade.update(encoder.total_accumulated_angle, encoder.angular_velocity, time.time())
+        """
+        if t is None and (self.position_loop.dt is None or self.velocity_loop.dt is None):
+            t = self.position_loop.clock()
+        self.velocity_loop.setpoint = self.position_loop.update(position, t, rate=velocity)
+        return self.velocity_loop.update(velocity, t)
+
+
+
+class PIDBatch:
+    """
+    Many PID controllers with different gains stepped at once with NumPy, for tuning sweeps.
+
+    Same control law as PID (fixed dt, derivative on measurement, optional D filter, back-calculation anti-windup),
+    every gain / limit / setpoint can be a scalar or an (N,) array.
+
+    Attributes:
+    - integral, derivative, output, unclamped (np.ndarray): Per controller state, shape (N,).
+    """
+    __slots__ = (
+        "kp", "ki", "kd", "setpoint", "lower_limit", "upper_limit", "dt", "derivative_filter", "tracking_gain",
+        "integral", "derivative", "output", "unclamped", "last_measurement", "_alpha",
+    )
+
+    def __init__(self, kp, ki, kd, dt, setpoint=0.0, lower_limit=-np.inf, upper_limit=np.inf, derivative_filter=None,
+                 tracking_gain=None):
+        """
+        Parameters:
+        - kp, ki, kd: Gains, scalars or (N,) arrays.
+        - dt: Fixed time step in seconds.
+        - setpoint: Scalar or (N,) array.
+        - lower_limit, upper_limit: Output limits, scalars or (N,) arrays.
+        - derivative_filter: Time constant(s) of the D term filter, None for no filter.
+        - tracking_gain: Anti-windup gain(s) in 1/s, default is |ki / kp| (or 1 where kp is 0).
+        """
+        self.kp, self.ki, self.kd = (np.array(g, dtype=np.float64) for g in np.broadcast_arrays(kp, ki, kd))
+        self.dt = dt
+        self.setpoint = setpoint
+        self.lower_limit = lower_limit
+        self.upper_limit = upper_limit
+        self.derivative_filter = derivative_filter
+        if tracking_gain is None:
+            with np.errstate(divide="ignore", invalid="ignore"):
+                tracking_gain = np.where(self.kp != 0.0, np.abs(self.ki / self.kp), 1.0)
+        self.tracking_gain = tracking_gain
+        self._alpha = 1.0 if derivative_filter is None else dt / (np.asarray(derivative_filter) + dt)
+        self.reset()
+
+
+    def reset(self):
+        shape = self.kp.shape
+        self.integral = np.zeros(shape)
+        self.derivative = np.zeros(shape)
+        self.output = np.zeros(shape)
+        self.unclamped = np.zeros(shape)
+        self.last_measurement = None
+
+
+    def update(self, current_value, rate=None):
+        """
+        Steps every controller once.
+
+        Parameters:
+        - current_value: Measurements, scalar or (N,) array.
+        - rate: Measured rates of change, used for the D term instead of differencing.
+
+        Returns:
+        - (N,) array of clamped outputs (the same array object every call, copy it to keep it).
+        """
+        current_value = np.asarray(current_value, dtype=np.float64)
+        error = self.setpoint - current_value
+
+        if rate is not None:
+            raw_derivative = -self.kd * rate
+        elif self.last_measurement is not None:
+            raw_derivative = -self.kd * (current_value - self.last_measurement) / self.dt
+        else:
+            raw_derivative = self.derivative
+        self.derivative += self._alpha * (raw_derivative - self.derivative)
+
+        np.add(self.kp * error, self.integral, out=self.unclamped)
+        self.unclamped += self.derivative
+        np.clip(self.unclamped, self.lower_limit, self.upper_limit, out=self.output)
+
+        self.integral += (self.ki * error + self.tracking_gain * (self.output - self.unclamped)) * self.dt
+        self.last_measurement = current_value.copy()
+        return self.output
+
+
+
+if __name__ == "__main__":
+    # Scalar against batch on an integrating plant (x' = u) with a saturated actuator, a 2 unit step needs 4 s at the
+    # limit so the integrator winds up without the back-calculation
+    dt = 0.01
+    gains = [(2.0, 1.0, 0.05), (4.0, 3.0, 0.1), (1.0, 0.5, 0.0)]
+    scalars = [PID(kp, ki, kd, setpoint=2.0, lower_limit=-0.5, upper_limit=0.5, dt=dt, derivative_filter=0.02)
+               for kp, ki, kd in gains]
+    batch = PIDBatch([g[0] for g in gains], [g[1] for g in gains], [g[2] for g in gains], dt, setpoint=2.0,
+                     lower_limit=-0.5, upper_limit=0.5, derivative_filter=0.02)
+
+    x_scalar = [0.0] * len(gains)
+    x_batch = np.zeros(len(gains))
+    worst = 0.0
+    overshoot = [0.0] * len(gains)
+    for step in range(2000):
+        u_batch = batch.update(x_batch)
+        for k, pid in enumerate(scalars):
+            u = pid.update(x_scalar[k])
+            worst = max(worst, abs(u - u_batch[k]))
+            x_scalar[k] += dt * u
+            overshoot[k] = max(overshoot[k], x_scalar[k] - 2.0)
+        x_batch += dt * u_batch
+    print(f"Scalar vs batch max output difference: {worst:.2e}")
+    print(f"Final values: {[round(x, 4) for x in x_scalar]}, overshoot: {[round(o, 4) for o in overshoot]}")
+
+    # The same loop without anti-windup
+    no_aw = PID(4.0, 3.0, 0.1, setpoint=2.0, lower_limit=-0.5, upper_limit=0.5, dt=dt, derivative_filter=0.02, tracking_gain=0.0)
+    x = 0.0
+    peak = 0.0
+    for step in range(2000):
+        x += dt * no_aw.update(x)
+        peak = max(peak, x - 2.0)
+    print(f"Overshoot with anti-windup {overshoot[1]:.4f}, without {peak:.4f}")
+
+    # A repeated timestamp holds the output instead of blowing up the D term
+    pid = PID(1.0, 0.0, 1.0, setpoint=1.0)
+    first = pid.update(0.0, t=1.0)
+    print(f"Repeated timestamp output: {pid.update(5.0, t=1.0)} (previous {first})")
+
+    # Inside a range setpoint the output stays 0 however fast the measurement moves (invertedPendulum/main.py)
+    pid = PID(3.3, 0.069, 0.31, setpoint=(-2, 2), lower_limit=-0.4, upper_limit=0.4, dt=0.005)
+    band_outputs = [pid.update(1.9 * math.sin(step * 0.05)) for step in range(400)]
+    assert max(abs(u) for u in band_outputs) == 0.0, max(abs(u) for u in band_outputs)
+    outside = pid.update(3.0)
+    print(f"Range setpoint: max |output| inside the band {max(abs(u) for u in band_outputs)}, just outside {outside:.3f}")
+
+
+
+"""
+Example
+
+# Single value setpoint
+pid_single = PID(kp=1.0, ki=0.1, kd=0.01, setpoint=100, lower_limit=-50, upper_limit=50)
+
+# OR
+
+# Range setpoint
+pid_range = PID(kp=1.0, ki=0.1, kd=0.01, setpoint=(-4, 4), lower_limit=-50, upper_limit=50)
+
+# OR
+
+# Fixed time step with a filtered D term
+pid_fixed = PID(kp=1.0, ki=0.1, kd=0.01, setpoint=100, lower_limit=-50, upper_limit=50, dt=0.01, derivative_filter=0.02)
+
+
+current_value = 0
+for _ in range(100):  # Simulate 100 time steps
+    control = pid_single.update(current_value=current_value)
+    current_value += control  # Update system with control output (simple simulation)
+    print(f"Control: {control}, Current Value: {current_value}")
+    time.sleep(1)  # Simulate some delay, e.g., waiting for sensor reading or actuator response
+
+"""
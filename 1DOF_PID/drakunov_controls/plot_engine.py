@@ -0,0 +1,432 @@
+import argparse
+import os
+import tempfile
+import time
+
+import numpy as np
+
+import replay
+
+
+"""
+Decimating plot backend for long trials and live streams.
+
+Matplotlib draws every point it is given, so a 10 minute trial at 1 kHz (or a live plot that keeps appending) gets
+slower the longer it runs, although the screen only has ~1000 pixel columns. Everything here hands matplotlib at most
+a few points per pixel column of the axes:
+
+    - minmax_decimate(): per pixel column the min and the max of the samples in it (NumPy reduceat, no Python loop),
+      so spikes stay visible and the drawn line looks identical to the full one. Default.
+    - lttb(): Largest Triangle Three Buckets, a fixed number of representative points (nicer for smooth signals).
+    - DecimatedPlot: lines over full arrays that re-decimate the visible range when the axes are zoomed / panned.
+    - LivePlot: preallocated ring buffer + blitting, redraws only the line artists every update.
+    - plot_trial(): plots controllerData / encoderData columns of a trial straight from the database (cached).
+
+Run `python plot_engine.py` for timings on 10M points (rendering is skipped if matplotlib is not installed).
+"""
+
+
+#---------------------------------------- Decimation START -------------------------------------------------
+
+def visible_range(x, x_min=None, x_max=None):
+    """Index slice of the samples of sorted `x` within [x_min, x_max] (plus one neighbour each side, for line ends)."""
+    lo = 0 if x_min is None else max(int(np.searchsorted(x, x_min, side='left')) - 1, 0)
+    hi = len(x) if x_max is None else min(int(np.searchsorted(x, x_max, side='right')) + 1, len(x))
+    return slice(lo, hi)
+
+
+def minmax_decimate(x, y, pixels, x_min=None, x_max=None):
+    """
+    Min / max per pixel column.
+
+    Parameters:
+    - x: (N,) sorted sample times.
+    - y: (N,) samples (NaN gaps are ignored).
+    - pixels: Width of the axes in pixels.
+    - x_min, x_max: Visible x range, default everything.
+
+    Returns:
+    - (x, y) with at most 2 * pixels points (the input slice itself if it is already that small).
+
+    Example:
+        >>> xd, yd = minmax_decimate(t, angle, pixels=int(ax.bbox.width))
+    """
+    view = visible_range(x, x_min, x_max)
+    xs = x[view]
+    ys = y[view]
+    n = len(xs)
+    if n <= 2 * pixels or pixels < 1:
+        return xs, ys
+
+    edges = np.linspace(xs[0], xs[-1], pixels + 1)[:-1]
+    starts = np.unique(np.searchsorted(xs, edges, side='left'))  # empty columns share their start with the next
+    y_min = np.fmin.reduceat(ys, starts)
+    y_max = np.fmax.reduceat(ys, starts)
+    ends = np.append(starts[1:], n) - 1
+
+    out_x = np.empty(2 * len(starts))
+    out_y = np.empty(2 * len(starts))
+    out_x[0::2] = xs[starts]
+    out_x[1::2] = xs[ends]
+    out_y[0::2] = y_min
+    out_y[1::2] = y_max
+    return out_x, out_y
+
+
+def lttb(x, y, points, x_min=None, x_max=None):
+    """
+    Largest Triangle Three Buckets down sampling to `points` samples (keeps the first and last one).
+
+    Returns:
+    - (x, y), the selected samples.
+    """
+    view = visible_range(x, x_min, x_max)
+    xs = x[view]
+    ys = y[view]
+    n = len(xs)
+    if n <= points or points < 3:
+        return xs, ys
+
+    bounds = np.linspace(1, n - 1, points - 1).astype(np.intp)  # points - 2 buckets between the fixed end points
+    selected = np.empty(points, dtype=np.intp)
+    selected[0] = 0
+    selected[-1] = n - 1
+    previous = 0
+    for k in range(points - 2):
+        start, end = bounds[k], bounds[k + 1]
+        next_end = bounds[k + 2] if k + 2 < len(bounds) else n
+        # Average of the next bucket is the third triangle corner
+        next_x = xs[end:next_end].mean() if next_end > end else xs[-1]
+        next_y = np.nanmean(ys[end:next_end]) if next_end > end else ys[-1]
+        bucket_x = xs[start:end]
+        bucket_y = ys[start:end]
+        area = np.abs((xs[previous] - next_x) * (bucket_y - ys[previous]) - (xs[previous] - bucket_x) * (next_y - ys[previous]))
+        previous = start + int(np.nanargmax(area)) if len(area) else start
+        selected[k + 1] = previous
+    return xs[selected], ys[selected]
+
+
+DECIMATORS = {
+    "minmax": lambda x, y, pixels, x_min, x_max: minmax_decimate(x, y, pixels, x_min, x_max),
+    "lttb": lambda x, y, pixels, x_min, x_max: lttb(x, y, 2 * pixels, x_min, x_max),
+}
+
+#---------------------------------------- Decimation END -------------------------------------------------
+
+
+
+#---------------------------------------- Plots START -------------------------------------------------
+
+class DecimatedPlot:
+    """
+    Lines over full arrays, re-decimated to the axes width whenever the visible x range changes.
+
+    Attributes:
+    - lines (dict): label -> matplotlib Line2D.
+
+    Example:
+        >>> fig, ax = plt.subplots()
+        >>> DecimatedPlot(ax, t, {"angle": angle, "u_clamped": u})
+        >>> plt.show()
+    """
+
+    def __init__(self, ax, x, series, method="minmax", **line_kwargs):
+        """
+        Parameters:
+        - ax: matplotlib Axes.
+        - x: (N,) sorted x values shared by every series.
+        - series: {label: (N,) array}.
+        - method: "minmax" or "lttb".
+        - line_kwargs: Passed to ax.plot().
+        """
+        self.ax = ax
+        self.x = np.asarray(x, dtype=np.float64)
+        self.series = {label: np.asarray(y, dtype=np.float64) for label, y in series.items()}
+        self.decimate = DECIMATORS[method]
+        self.lines = {label: ax.plot([], [], label=label, **line_kwargs)[0] for label in self.series}
+        self._busy = False
+        if len(self.x):
+            ax.set_xlim(self.x[0], self.x[-1])
+            finite = [y[np.isfinite(y)] for y in self.series.values()]
+            low = min((f.min() for f in finite if len(f)), default=0.0)
+            high = max((f.max() for f in finite if len(f)), default=1.0)
+            pad = (high - low) * 0.05 or 1.0
+            ax.set_ylim(low - pad, high + pad)
+        self.update()
+        ax.callbacks.connect('xlim_changed', lambda _: self.update())
+
+
+    def update(self):
+        """Re-decimates every line for the current x limits and axes width."""
+        if self._busy:
+            return
+        self._busy = True
+        try:
+            x_min, x_max = self.ax.get_xlim()
+            pixels = max(int(self.ax.bbox.width), 1)
+            for label, y in self.series.items():
+                self.lines[label].set_data(*self.decimate(self.x, y, pixels, x_min, x_max))
+        finally:
+            self._busy = False
+
+
+
+class LivePlot:
+    """
+    Scrolling live plot of the last `window` seconds, redrawn with blitting. The x axis is seconds before the newest
+    sample (-window .. 0), so it stays fixed and the cached background stays valid while the data scrolls.
+
+    Samples go into a preallocated ring buffer (append() is an array write, extend() at most two slice writes per
+    array), update() decimates just the window, straight from the one or two contiguous parts of the ring that hold it,
+    to the axes width and redraws only the lines; the full figure (axes, ticks, labels) is redrawn only when the y range
+    grows.
+
+    Example:
+        >>> live = LivePlot(ax, ("angle", "u_clamped"), window=10.0)
+        >>> live.append(t, (angle, u))      # every sample
+        >>> live.update()                   # at 20-30 Hz
+    """
+
+    def __init__(self, ax, labels, window=10.0, capacity=1_000_000, method="minmax"):
+        self.ax = ax
+        self.labels = tuple(labels)
+        self.window = window
+        self.capacity = capacity
+        self.decimate = DECIMATORS[method]
+        self._t = np.zeros(capacity)
+        self._y = np.full((capacity, len(self.labels)), np.nan)
+        self._count = 0
+        self.lines = [ax.plot([], [], label=label, animated=True)[0] for label in self.labels]
+        ax.set_xlim(-window, 0.0)
+        ax.set_xlabel("Time (seconds)")
+        self._background = None
+        self._y_range = (np.inf, -np.inf)
+        ax.figure.canvas.mpl_connect('draw_event', self._on_draw)
+        ax.figure.canvas.draw()
+
+
+    def _on_draw(self, _):
+        self._background = self.ax.figure.canvas.copy_from_bbox(self.ax.bbox)
+
+
+    def append(self, t, values):
+        k = self._count % self.capacity
+        self._t[k] = t
+        self._y[k] = values
+        self._count += 1
+
+
+    def extend(self, t, values):
+        """Appends a batch: (M,) times and (M x labels) values, e.g. a telemetry_bus Subscription.poll()."""
+        t = np.asarray(t, dtype=np.float64)
+        m = len(t)
+        values = np.asarray(values, dtype=np.float64).reshape(m, len(self.labels))
+        if m > self.capacity:
+            # Only the newest `capacity` rows survive anyway
+            t, values = t[-self.capacity:], values[-self.capacity:]
+            self._count += m - self.capacity
+            m = self.capacity
+        k = self._count % self.capacity
+        first = min(m, self.capacity - k)
+        self._t[k:k + first] = t[:first]
+        self._y[k:k + first] = values[:first]
+        if first < m:
+            # Wrapped around the end of the ring
+            self._t[:m - first] = t[first:]
+            self._y[:m - first] = values[first:]
+        self._count += m
+
+
+    def _segments(self):
+        """The buffered part as one or two contiguous (t, y) views of the ring, oldest first (no copy)."""
+        if self._count <= self.capacity:
+            return [(self._t[:self._count], self._y[:self._count])]
+        k = self._count % self.capacity
+        if k == 0:
+            return [(self._t, self._y)]
+        return [(self._t[k:], self._y[k:]), (self._t[:k], self._y[:k])]
+
+
+    def update(self):
+        if self._count == 0:
+            return
+        segments = self._segments()
+        t_max = segments[-1][0][-1]
+        t_min = t_max - self.window
+        pixels = max(int(self.ax.bbox.width), 1)
+
+        # Only the parts of the ring reaching into the window, each decimated to its share of the pixel columns
+        visible = []
+        for t, y in segments:
+            if t[-1] >= t_min:
+                share = (t[-1] - max(t[0], t_min)) / self.window if self.window else 1.0
+                visible.append((t, y, max(int(round(pixels * share)), 1)))
+
+        low, high = self._y_range
+        decimated = []
+        for column in range(len(self.labels)):
+            parts = [self.decimate(t, y[:, column], columns, t_min, t_max) for t, y, columns in visible]
+            xd = np.concatenate([part[0] for part in parts]) if len(parts) > 1 else parts[0][0]
+            yd = np.concatenate([part[1] for part in parts]) if len(parts) > 1 else parts[0][1]
+            decimated.append((xd - t_max, yd))
+            if len(yd) and np.isfinite(yd).any():
+                low, high = min(low, np.nanmin(yd)), max(high, np.nanmax(yd))
+
+        canvas = self.ax.figure.canvas
+        if (low, high) != self._y_range or self._background is None:
+            # y range grew (or first frame): full redraw refreshes ticks and the blit background
+            self._y_range = (low, high)
+            pad = (high - low) * 0.05 or 1.0
+            self.ax.set_ylim(low - pad, high + pad)
+            canvas.draw()
+        else:
+            canvas.restore_region(self._background)
+        for line, (xd, yd) in zip(self.lines, decimated):
+            line.set_data(xd, yd)
+            self.ax.draw_artist(line)
+        canvas.blit(self.ax.bbox)
+        canvas.flush_events()
+
+#---------------------------------------- Plots END -------------------------------------------------
+
+
+
+#---------------------------------------- Trial Plots START -------------------------------------------------
+
+_trial_cache = {}
+
+
+def load_trial(database, trial_id):
+    """replay.TrialRecording.load() with a per process cache, so re-plotting a trial does not hit SQLite again."""
+    key = (database if isinstance(database, str) else id(database), trial_id)
+    recording = _trial_cache.get(key)
+    if recording is None:
+        recording = _trial_cache[key] = replay.TrialRecording.load(database, trial_id)
+    return recording
+
+
+def plot_trial(database, trial_id, columns=("current_angle", "current_omega", "u_clamped"), source="controller", method="minmax"):
+    """
+    One subplot per column of a trial against time since the start of the trial, decimated.
+
+    Parameters:
+    - database: pyodrivecan.OdriveDatabase or the path of the database file.
+    - trial_id: Trial to plot.
+    - columns: Columns of the source table.
+    - source: "controller" (controllerData, time column current_time) or "encoder" (encoderData, time column time).
+
+    Returns:
+    - (figure, [DecimatedPlot])
+    """
+    import matplotlib.pyplot as plt
+
+    recording = load_trial(database, trial_id)
+    table = recording.controller if source == "controller" else recording.encoder
+    if table is None:
+        raise Exception(f"trial {trial_id} has no {source} data")
+    t = table["current_time" if source == "controller" else "time"]
+    t = t - t[0]
+
+    fig, axes = plt.subplots(len(columns), 1, sharex=True, figsize=(10, 2.5 * len(columns)), squeeze=False)
+    plots = []
+    for ax, column in zip(axes[:, 0], columns):
+        plots.append(DecimatedPlot(ax, t, {column: table[column]}, method=method))
+        ax.set_ylabel(column)
+        ax.grid(True)
+    axes[-1, 0].set_xlabel("Time (seconds)")
+    fig.suptitle(f"Trial {trial_id} ({len(t)} samples)")
+    return fig, plots
+
+#---------------------------------------- Trial Plots END -------------------------------------------------
+
+
+
+def benchmark(points=10_000_000, pixels=1000):
+    rng = np.random.default_rng(0)
+    t = np.arange(points) / 1000.0
+    y = np.sin(t / 10.0) + rng.normal(0, 0.05, points)
+    y[points // 3] = 5.0  # a spike min/max must keep
+
+    start = time.perf_counter()
+    xd, yd = minmax_decimate(t, y, pixels)
+    full_ms = (time.perf_counter() - start) * 1e3
+    assert yd.max() == 5.0
+    start = time.perf_counter()
+    minmax_decimate(t, y, pixels, t[points // 2], t[points // 2 + points // 100])
+    zoom_ms = (time.perf_counter() - start) * 1e3
+    start = time.perf_counter()
+    lttb(t, y, 2 * pixels)
+    lttb_ms = (time.perf_counter() - start) * 1e3
+    print(f"{points} points -> {len(xd)}: minmax {full_ms:.1f} ms (1 % zoom {zoom_ms:.2f} ms), lttb {lttb_ms:.1f} ms")
+
+    try:
+        import matplotlib
+        matplotlib.use("Agg")
+        import matplotlib.pyplot as plt
+    except ImportError:
+        print("matplotlib not installed, skipping render timing")
+        return
+    fig, ax = plt.subplots(figsize=(10, 4), dpi=100)
+    start = time.perf_counter()
+    DecimatedPlot(ax, t, {"y": y})
+    fig.canvas.draw()
+    print(f"decimate + render {points} points: {(time.perf_counter() - start) * 1e3:.1f} ms")
+    plt.close(fig)
+
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Decimated trial plots.')
+    parser.add_argument('--db', type=str, help='Database file to plot a trial from.')
+    parser.add_argument('--trial', type=int, help='Trial id.')
+    parser.add_argument('--columns', type=str, nargs='+', default=["current_angle", "current_omega", "u_clamped"])
+    parser.add_argument('--method', choices=sorted(DECIMATORS), default="minmax")
+    parser.add_argument('--points', type=int, default=10_000_000, help='Benchmark size when no --db is given.')
+    args = parser.parse_args()
+
+    if args.db is None:
+        benchmark(args.points)
+        # And a trial plot end to end from a synthetic database
+        path = os.path.join(tempfile.mkdtemp(), "plot_demo.db")
+        replay._write_demo_database(path, trial_id=1, seconds=600.0)
+        try:
+            import matplotlib
+            matplotlib.use("Agg")
+            start = time.perf_counter()
+            fig, _ = plot_trial(path, 1)
+            fig.savefig(os.path.join(os.path.dirname(path), "trial_1.png"))
+            print(f"plot_trial of a 10 minute trial: {(time.perf_counter() - start) * 1e3:.0f} ms")
+        except ImportError:
+            recording = load_trial(path, 1)
+            t = recording.controller["current_time"]
+            xd, _ = minmax_decimate(t, recording.controller["current_angle"], 1000)
+            print(f"trial 1: {len(t)} samples -> {len(xd)} plotted points")
+    else:
+        import matplotlib.pyplot as plt
+        plot_trial(args.db, args.trial, args.columns, method=args.method)
+        plt.show()
+
+
+
+"""
+Example
+
+import matplotlib.pyplot as plt
+import plot_engine
+import telemetry_bus
+
+# Trial from the database
+fig, plots = plot_engine.plot_trial('odrive_data.db', 12, columns=("current_angle", "u_clamped"))
+plt.show()
+
+# Live, fed from the telemetry bus
+plt.ion()
+fig, ax = plt.subplots()
+live = plot_engine.LivePlot(ax, ("angle", "angular_velocity"), window=10.0)
+encoder = telemetry_bus.TelemetryBus("rig").subscribe("encoder")
+while True:
+    rows = encoder.poll()
+    live.extend(rows[:, 0], rows[:, 1:])
+    live.update()
+    plt.pause(0.03)
+"""
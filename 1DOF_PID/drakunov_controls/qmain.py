@@ -3,53 +3,18 @@ import asyncio
 from datetime import datetime, timedelta
 import aysnc_as5048b
 import time
-
-import numpy as np
-import math
+import quaternion_kernel
+from loop_timing import LoopTimer
 
 #---------------------------------------- Quaternion START -------------------------------------------------
 
 
-def angle_to_quaternion(angle_deg):
-    """Convert an angle in degrees about the Z-axis to a quaternion."""
-    angle_rad = np.radians(angle_deg)
-    return np.array([math.cos(angle_rad / 2), 0, 0, math.sin(angle_rad / 2)])
-
-
-def quaternion_conjugate(quat):
-    """Calculate the conjugate of a quaternion."""
-    w, x, y, z = quat
-    return np.array([w, -x, -y, -z])
-
-
-def quaternion_multiply(quat1, quat2):
-    """Multiply two quaternions."""
-    w1, x1, y1, z1 = quat1
-    w2, x2, y2, z2 = quat2
-    w = w1*w2 - x1*x2 - y1*y2 - z1*z2
-    x = w1*x2 + x1*w2 + y1*z2 - z1*y2
-    y = w1*y2 + y1*w2 + z1*x2 - x1*z2
-    z = w1*z2 + z1*w2 + x1*y2 - y1*x2
-    return np.array([w, x, y, z])
-
-
-def quaternion_rotate(point, quat):
-    """Rotate a 3D point by a quaternion."""
-    quat = quat / np.linalg.norm(quat)
-    w, x, y, z = quat
-    qx, qy, qz = point
-    
-    rotated_x = qx * (1 - 2*y*y - 2*z*z) + qy * (2*x*y - 2*z*w) + qz * (2*x*z + 2*y*w)
-    rotated_y = qx * (2*x*y + 2*z*w) + qy * (1 - 2*x*x - 2*z*z) + qz * (2*y*z - 2*x*w)
-    rotated_z = qx * (2*x*z - 2*y*w) + qy * (2*y*z + 2*x*w) + qz * (1 - 2*x*x - 2*y*y)
-    
-    return np.array([rotated_x, rotated_y, rotated_z])
-
-
-def quaternion_to_euler_z(q):
-    """Convert a quaternion to an Euler angle about the Z-axis."""
-    # For a single rotation about the Z-axis, the Euler angle is simply the argument of the quaternion
-    return np.degrees(2 * np.arctan2(q[3], q[0]))
+# Scalar quaternion math from quaternion_kernel.py: plain floats / preallocated buffers, no np.array per call
+angle_to_quaternion = quaternion_kernel.from_angle_z
+quaternion_conjugate = quaternion_kernel.conjugate
+quaternion_multiply = quaternion_kernel.multiply
+quaternion_rotate = quaternion_kernel.rotate
+quaternion_to_euler_z = quaternion_kernel.to_angle_z
 
 
 def calculate_w_desired(q_error, q_error_prev, dt, Kp, Kd):
@@ -63,17 +28,10 @@ def calculate_w_desired(q_error, q_error_prev, dt, Kp, Kd):
     :param Kd: Derivative gain.
     :return: Desired angular velocity.
     """
-    # Extract the vector part of the quaternion error
-    e = q_error[1:]  # Assuming q_error = [q_w, q_x, q_y, q_z]
-    
-    # Calculate the derivative of the error
-    e_prev = q_error_prev[1:]  # Extract vector part of previous quaternion error
-    de_dt = (e - e_prev) / dt
-    
-    # Apply PD control law
-    omega_desired = Kp * e + Kd * de_dt
-    
-    return omega_desired
+    # PD control law on the vector part of the quaternion error (q_error = [q_w, q_x, q_y, q_z])
+    return (Kp * q_error[1] + Kd * (q_error[1] - q_error_prev[1]) / dt,
+            Kp * q_error[2] + Kd * (q_error[2] - q_error_prev[2]) / dt,
+            Kp * q_error[3] + Kd * (q_error[3] - q_error_prev[3]) / dt)
 
 #---------------------------------------- Quaternion END -------------------------------------------------
 
@@ -190,7 +148,7 @@ def calculate_w_angle_desired(angle_error, angle_error_prev, dt, Kp, Kd, current
 
 
 #Example of how you can create a controller to get data from the O-Drives and then send motor comands based on that data.
-async def controller(odrive1, encoder, database, controller_data_table_name, next_trial_id, J_zz, K, Kp, Kd, desired_attitude_deg, omega_desired):
+async def controller(odrive1, encoder, database, controller_data_table_name, next_trial_id, J_zz, K, Kp, Kd, desired_attitude_deg, omega_desired, timer):
         odrive1.clear_errors(identify=False)
         await asyncio.sleep(0.2)
         odrive1.setAxisState("closed_loop_control")
@@ -201,7 +159,7 @@ async def controller(odrive1, encoder, database, controller_data_table_name, nex
         last_angle = 0 
         angle_error_prev = 0
         #q_desired = angle_to_quaternion(desired_attitude_deg)
-        #q_error_prev = np.array([1, 0, 0, 0])  # Assume starting with no error
+        #q_error_prev = quaternion_kernel.IDENTITY  # Assume starting with no error
         fixed_duration = 0.005  # Fixed sleep duration to control loop frequency
         
 
@@ -211,6 +169,7 @@ async def controller(odrive1, encoder, database, controller_data_table_name, nex
         while datetime.now() < stop_at:
             # Sleep for a fixed duration to maintain loop frequency
             await asyncio.sleep(fixed_duration)
+            timer.start()
 
 
             current_time = time.time()  # Capture the current time
@@ -227,7 +186,7 @@ async def controller(odrive1, encoder, database, controller_data_table_name, nex
             #q_current = angle_to_quaternion(current_angle)
             
             # Calculate quaternion error
-            #q_error = quaternion_multiply(quaternion_conjugate(q_desired), q_current)
+            #q_error = quaternion_kernel.conjugate_multiply(q_desired, q_current)
             
             # Calculate desired angular velocity using the PD control law
             #omega_desired = calculate_w_desired(q_error, q_error_prev, dt, Kp, Kd)
@@ -236,6 +195,7 @@ async def controller(odrive1, encoder, database, controller_data_table_name, nex
               
             # Get the current angluar velocity of the encoder
             current_angular_velocity = encoder.angular_velocity
+            timer.mark(0)  # sensor
 
 
             #omega_desired = calculate_w_angle_desired(angle_error, angle_error_prev, dt, Kp, Kd, current_angular_velocity)
@@ -245,7 +205,7 @@ async def controller(odrive1, encoder, database, controller_data_table_name, nex
             
             # Convert omega_desired to a scalar value for single-axis control
             # This step would be different if controlling for multiple axes
-            #omega_desired_scalar = np.linalg.norm(omega_desired)  # Assuming single-axis, simplification
+            #omega_desired_scalar = math.sqrt(sum(w * w for w in omega_desired))  # Assuming single-axis, simplification
 
 
             
@@ -256,12 +216,15 @@ async def controller(odrive1, encoder, database, controller_data_table_name, nex
           
             # Clamping the output torque to be withing the min and max of the O-Drive Controller
             controller_torque_output_clamped= clamp(controller_torque_output, -0.1, 0.1)
+            timer.mark(1)  # compute
             #print(f"Controller Raw Output: {controller_torque_output}, Controller Clampped Output: {controller_torque_output_clamped}, Current Angular Velocity: {current_angular_velocity}")
 
             print(f"Current Angle: {current_angle} deg;    Desired Angular Velocity: {omega_desired} rad/s;   Controller Clampped Output: {controller_torque_output_clamped:.15f} Nm;   Current Angular Velocity: {current_angular_velocity:.15f} rad/s")
+            timer.mark(2)  # print
 
             #Send controller output torque to motor
             odrive1.set_torque(controller_torque_output_clamped)
+            timer.mark(3)  # send
 
 
             last_angle = current_angle
@@ -275,6 +238,8 @@ async def controller(odrive1, encoder, database, controller_data_table_name, nex
             data = [next_trial_id, encoder.previous_time, current_angular_velocity, controller_torque_output]
             #Add to database
             upload_controller_data(database, controller_data_table_name, data)
+            timer.mark(4)  # db
+            timer.end_cycle()
           
    
         odrive1.running = False
@@ -331,17 +296,21 @@ async def main():
 
     # odrive1, encoder, database, controller_data_table_name, next_trial_id, J_zz, K, Kp, Kd, desired_attitude_deg
 
+    #Time spent per phase of each controller cycle, printed on shutdown
+    timer = LoopTimer(("sensor", "compute", "print", "send", "db"))
+
     try:
         #add each odrive to the async loop so they will run.
         await asyncio.gather(
             odrive1.loop(),
-            controller(odrive1, encoder, database, controller_data_table_name, next_trial_id, J_zz, K, Kp, Kd, desired_attitude_deg, omega_desired), 
+            controller(odrive1, encoder, database, controller_data_table_name, next_trial_id, J_zz, K, Kp, Kd, desired_attitude_deg, omega_desired, timer), 
             encoder.loop(), #This runs the external encoder code
         )
     except KeyboardInterrupt:
          odrive1.estop()
     finally:
         odrive1.estop()
+        print(timer.report("Controller loop timing"))
 
 
 
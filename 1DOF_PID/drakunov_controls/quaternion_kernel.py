@@ -0,0 +1,335 @@
+import math
+
+import numpy as np
+
+
+# Quaternions are (w, x, y, z) everywhere, the same order as qmain.py.
+#
+# Scalar path: for the control loop. Plain float arithmetic, no NumPy calls. Every function returns a tuple, or writes
+# into `out` (any preallocated list / array with 4 (or 3) slots) and returns it when out is given.
+#
+# Batch path: for offline replay. The same operations on (N x 4) / (N x 3) NumPy arrays in a handful of vectorised
+# calls, optionally into preallocated `out` arrays.
+
+
+#---------------------------------------- Scalar Path START -------------------------------------------------
+
+IDENTITY = (1.0, 0.0, 0.0, 0.0)
+
+
+def from_angle_z(angle_deg, out=None):
+    """
+    Quaternion of a rotation of angle_deg degrees about the Z-axis.
+
+    Example:
+        >>> q_desired = from_angle_z(30.0)
+    """
+    half = math.radians(angle_deg) * 0.5
+    w = math.cos(half)
+    z = math.sin(half)
+    if out is None:
+        return (w, 0.0, 0.0, z)
+    out[0] = w
+    out[1] = 0.0
+    out[2] = 0.0
+    out[3] = z
+    return out
+
+
+def conjugate(q, out=None):
+    """Conjugate (inverse of a unit quaternion)."""
+    w, x, y, z = q
+    if out is None:
+        return (w, -x, -y, -z)
+    out[0] = w
+    out[1] = -x
+    out[2] = -y
+    out[3] = -z
+    return out
+
+
+def multiply(q1, q2, out=None):
+    """
+    Hamilton product q1 * q2. `out` may be q1 or q2 itself.
+
+    Example:
+        >>> q_error = multiply(conjugate(q_desired), q_current)
+    """
+    w1, x1, y1, z1 = q1
+    w2, x2, y2, z2 = q2
+    w = w1 * w2 - x1 * x2 - y1 * y2 - z1 * z2
+    x = w1 * x2 + x1 * w2 + y1 * z2 - z1 * y2
+    y = w1 * y2 + y1 * w2 + z1 * x2 - x1 * z2
+    z = w1 * z2 + z1 * w2 + x1 * y2 - y1 * x2
+    if out is None:
+        return (w, x, y, z)
+    out[0] = w
+    out[1] = x
+    out[2] = y
+    out[3] = z
+    return out
+
+
+def conjugate_multiply(q1, q2, out=None):
+    """conj(q1) * q2 in one step, the error quaternion between a desired attitude q1 and the current attitude q2."""
+    w1, x1, y1, z1 = q1
+    w2, x2, y2, z2 = q2
+    w = w1 * w2 + x1 * x2 + y1 * y2 + z1 * z2
+    x = w1 * x2 - x1 * w2 - y1 * z2 + z1 * y2
+    y = w1 * y2 - y1 * w2 - z1 * x2 + x1 * z2
+    z = w1 * z2 - z1 * w2 - x1 * y2 + y1 * x2
+    if out is None:
+        return (w, x, y, z)
+    out[0] = w
+    out[1] = x
+    out[2] = y
+    out[3] = z
+    return out
+
+
+def normalize(q, out=None):
+    """Scales q to unit length."""
+    w, x, y, z = q
+    scale = 1.0 / math.sqrt(w * w + x * x + y * y + z * z)
+    if out is None:
+        return (w * scale, x * scale, y * scale, z * scale)
+    out[0] = w * scale
+    out[1] = x * scale
+    out[2] = y * scale
+    out[3] = z * scale
+    return out
+
+
+def rotate(point, q, out=None):
+    """
+    Rotates a 3D point by q. q does not have to be unit length.
+
+    The normalisation is folded into the rotation matrix (2 / |q|^2 instead of 2), so there is no square root.
+
+    Example:
+        >>> x, y, z = rotate((1.0, 0.0, 0.0), from_angle_z(90.0))
+    """
+    w, x, y, z = q
+    px, py, pz = point
+    s = 2.0 / (w * w + x * x + y * y + z * z)
+    xs = x * s
+    ys = y * s
+    zs = z * s
+    wx = w * xs
+    wy = w * ys
+    wz = w * zs
+    xx = x * xs
+    xy = x * ys
+    xz = x * zs
+    yy = y * ys
+    yz = y * zs
+    zz = z * zs
+
+    rx = px * (1.0 - yy - zz) + py * (xy - wz) + pz * (xz + wy)
+    ry = px * (xy + wz) + py * (1.0 - xx - zz) + pz * (yz - wx)
+    rz = px * (xz - wy) + py * (yz + wx) + pz * (1.0 - xx - yy)
+    if out is None:
+        return (rx, ry, rz)
+    out[0] = rx
+    out[1] = ry
+    out[2] = rz
+    return out
+
+
+def to_angle_z(q):
+    """Angle in degrees of a rotation about the Z-axis."""
+    return math.degrees(2.0 * math.atan2(q[3], q[0]))
+
+#---------------------------------------- Scalar Path END -------------------------------------------------
+
+
+
+#---------------------------------------- Batch Path START -------------------------------------------------
+
+def _result(out, shape):
+    return np.empty(shape, dtype=np.float64) if out is None else out
+
+
+def from_angle_z_batch(angles_deg, out=None):
+    """(N,) angles in degrees about Z -> (N x 4) quaternions."""
+    half = np.radians(np.asarray(angles_deg, dtype=np.float64)) * 0.5
+    out = _result(out, (half.shape[0], 4))
+    np.cos(half, out=out[:, 0])
+    out[:, 1] = 0.0
+    out[:, 2] = 0.0
+    np.sin(half, out=out[:, 3])
+    return out
+
+
+def conjugate_batch(q, out=None):
+    """(N x 4) -> (N x 4) conjugates."""
+    q = np.asarray(q, dtype=np.float64)
+    out = _result(out, q.shape)
+    out[:, 0] = q[:, 0]
+    np.negative(q[:, 1:], out=out[:, 1:])
+    return out
+
+
+def multiply_batch(q1, q2, out=None):
+    """
+    Row by row Hamilton product of two (N x 4) arrays (either can also be a single quaternion, broadcast to N rows).
+
+    `out` must not be q1 or q2.
+    """
+    q1 = np.asarray(q1, dtype=np.float64)
+    q2 = np.asarray(q2, dtype=np.float64)
+    w1, x1, y1, z1 = q1[..., 0], q1[..., 1], q1[..., 2], q1[..., 3]
+    w2, x2, y2, z2 = q2[..., 0], q2[..., 1], q2[..., 2], q2[..., 3]
+    out = _result(out, np.broadcast_shapes(q1.shape, q2.shape))
+    out[..., 0] = w1 * w2 - x1 * x2 - y1 * y2 - z1 * z2
+    out[..., 1] = w1 * x2 + x1 * w2 + y1 * z2 - z1 * y2
+    out[..., 2] = w1 * y2 + y1 * w2 + z1 * x2 - x1 * z2
+    out[..., 3] = w1 * z2 + z1 * w2 + x1 * y2 - y1 * x2
+    return out
+
+
+def normalize_batch(q, out=None):
+    """(N x 4) -> (N x 4) unit quaternions."""
+    q = np.asarray(q, dtype=np.float64)
+    out = _result(out, q.shape)
+    np.divide(q, np.sqrt(np.einsum("ij,ij->i", q, q))[:, np.newaxis], out=out)
+    return out
+
+
+def rotate_batch(points, q, out=None):
+    """
+    Rotates (N x 3) points by (N x 4) quaternions (either can be a single row, broadcast to N).
+
+    Same folded normalisation as rotate(), q does not have to be unit length.
+    """
+    points = np.asarray(points, dtype=np.float64)
+    q = np.atleast_2d(np.asarray(q, dtype=np.float64))
+    points_2d = np.atleast_2d(points)
+    w, x, y, z = q[:, 0], q[:, 1], q[:, 2], q[:, 3]
+    px, py, pz = points_2d[:, 0], points_2d[:, 1], points_2d[:, 2]
+    s = 2.0 / np.einsum("ij,ij->i", q, q)
+    xs = x * s
+    ys = y * s
+    zs = z * s
+    wx, wy, wz = w * xs, w * ys, w * zs
+    xx, xy, xz = x * xs, x * ys, x * zs
+    yy, yz, zz = y * ys, y * zs, z * zs
+
+    n = max(q.shape[0], points_2d.shape[0])
+    out = _result(out, (n, 3))
+    out[:, 0] = px * (1.0 - yy - zz) + py * (xy - wz) + pz * (xz + wy)
+    out[:, 1] = px * (xy + wz) + py * (1.0 - xx - zz) + pz * (yz - wx)
+    out[:, 2] = px * (xz - wy) + py * (yz + wx) + pz * (1.0 - xx - yy)
+    return out
+
+
+def to_angle_z_batch(q):
+    """(N x 4) -> (N,) angles in degrees about Z."""
+    q = np.asarray(q, dtype=np.float64)
+    return np.degrees(2.0 * np.arctan2(q[:, 3], q[:, 0]))
+
+#---------------------------------------- Batch Path END -------------------------------------------------
+
+
+
+if __name__ == "__main__":
+    import timeit
+
+    # The per call np.array versions from qmain.py, as the reference
+    def np_angle_to_quaternion(angle_deg):
+        angle_rad = np.radians(angle_deg)
+        return np.array([math.cos(angle_rad / 2), 0, 0, math.sin(angle_rad / 2)])
+
+    def np_quaternion_conjugate(quat):
+        w, x, y, z = quat
+        return np.array([w, -x, -y, -z])
+
+    def np_quaternion_multiply(quat1, quat2):
+        w1, x1, y1, z1 = quat1
+        w2, x2, y2, z2 = quat2
+        return np.array([w1*w2 - x1*x2 - y1*y2 - z1*z2, w1*x2 + x1*w2 + y1*z2 - z1*y2,
+                         w1*y2 + y1*w2 + z1*x2 - x1*z2, w1*z2 + z1*w2 + x1*y2 - y1*x2])
+
+    def np_quaternion_rotate(point, quat):
+        quat = quat / np.linalg.norm(quat)
+        w, x, y, z = quat
+        qx, qy, qz = point
+        return np.array([qx * (1 - 2*y*y - 2*z*z) + qy * (2*x*y - 2*z*w) + qz * (2*x*z + 2*y*w),
+                         qx * (2*x*y + 2*z*w) + qy * (1 - 2*x*x - 2*z*z) + qz * (2*y*z - 2*x*w),
+                         qx * (2*x*z - 2*y*w) + qy * (2*y*z + 2*x*w) + qz * (1 - 2*x*x - 2*y*y)])
+
+    # Agreement: scalar path vs. the reference vs. the batch path on random quaternions and points
+    rng = np.random.default_rng(0)
+    n = 2000
+    qa = rng.normal(size=(n, 4)) * rng.uniform(0.5, 2.0, size=(n, 1))  # not unit length on purpose
+    qb = rng.normal(size=(n, 4))
+    points = rng.normal(size=(n, 3))
+    angles = rng.uniform(-720, 720, size=n)
+
+    batch_multiply = multiply_batch(qa, qb)
+    batch_conj_multiply = multiply_batch(conjugate_batch(qa), qb)
+    batch_rotate = rotate_batch(points, qa)
+    batch_angle = from_angle_z_batch(angles)
+    buffer = [0.0] * 4
+    worst = {"multiply": 0.0, "conjugate_multiply": 0.0, "rotate": 0.0, "from_angle_z": 0.0, "to_angle_z": 0.0,
+             "out= buffer": 0.0}
+    for k in range(n):
+        ref = np_quaternion_multiply(qa[k], qb[k])
+        worst["multiply"] = max(worst["multiply"], np.abs(np.subtract(multiply(qa[k], qb[k]), ref)).max(),
+                                np.abs(batch_multiply[k] - ref).max())
+        ref = np_quaternion_multiply(np_quaternion_conjugate(qa[k]), qb[k])
+        worst["conjugate_multiply"] = max(worst["conjugate_multiply"],
+                                          np.abs(np.subtract(conjugate_multiply(qa[k], qb[k]), ref)).max(),
+                                          np.abs(batch_conj_multiply[k] - ref).max())
+        ref = np_quaternion_rotate(points[k], qa[k])
+        worst["rotate"] = max(worst["rotate"], np.abs(np.subtract(rotate(points[k], qa[k]), ref)).max(),
+                              np.abs(batch_rotate[k] - ref).max())
+        ref = np_angle_to_quaternion(angles[k])
+        worst["from_angle_z"] = max(worst["from_angle_z"], np.abs(np.subtract(from_angle_z(angles[k]), ref)).max(),
+                                    np.abs(batch_angle[k] - ref).max())
+        wrapped = (angles[k] + 180.0) % 360.0 - 180.0
+        worst["to_angle_z"] = max(worst["to_angle_z"], abs((to_angle_z(from_angle_z(wrapped)) - wrapped + 180.0) % 360.0 - 180.0))
+        multiply(qa[k], qb[k], out=buffer)
+        worst["out= buffer"] = max(worst["out= buffer"], np.abs(np.subtract(buffer, batch_multiply[k])).max())
+
+    tolerance = 1e-12
+    for name, error in worst.items():
+        print(f"{name:20s} max abs difference {error:.2e}  {'OK' if error < tolerance else 'FAILED'}")
+    if any(error >= tolerance for error in worst.values()):
+        raise SystemExit(1)
+
+    # Per call cost of one control cycle's worth of quaternion math: q_current, error quaternion, rotate a point
+    q_desired_np = np_angle_to_quaternion(30.0)
+    q_desired = from_angle_z(30.0)
+    q_error = [0.0] * 4
+    rotated = [0.0] * 3
+    point = (1.0, 0.0, 0.0)
+    calls = 100000
+
+    def reference_cycle():
+        q_current = np_angle_to_quaternion(12.3)
+        q_err = np_quaternion_multiply(np_quaternion_conjugate(q_desired_np), q_current)
+        np_quaternion_rotate(point, q_err)
+
+    def scalar_cycle():
+        q_current = from_angle_z(12.3)
+        conjugate_multiply(q_desired, q_current, out=q_error)
+        rotate(point, q_error, out=rotated)
+
+    reference_cost = timeit.timeit(reference_cycle, number=calls) / calls
+    scalar_cost = timeit.timeit(scalar_cycle, number=calls) / calls
+    print(f"Control cycle: np.array per call {reference_cost * 1e6:.2f} us, scalar kernel {scalar_cost * 1e6:.2f} us "
+          f"({reference_cost / scalar_cost:.1f}x)")
+
+    for name, reference, kernel in (
+            ("multiply", lambda: np_quaternion_multiply(qa[0], qb[0]), lambda: multiply(q_desired, q_desired, out=q_error)),
+            ("rotate", lambda: np_quaternion_rotate(point, q_desired_np), lambda: rotate(point, q_desired, out=rotated))):
+        reference_cost = timeit.timeit(reference, number=calls) / calls
+        kernel_cost = timeit.timeit(kernel, number=calls) / calls
+        print(f"{name:20s} np.array {reference_cost * 1e6:.2f} us, scalar kernel {kernel_cost * 1e6:.2f} us")
+
+    replay = 100000
+    q_replay = rng.normal(size=(replay, 4))
+    out = np.empty((replay, 4))
+    batch_cost = timeit.timeit(lambda: multiply_batch(q_replay, q_desired, out=out), number=20) / 20
+    print(f"multiply_batch: {batch_cost / replay * 1e9:.1f} ns per quaternion over {replay} rows")
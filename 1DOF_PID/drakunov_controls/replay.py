@@ -0,0 +1,440 @@
+"""
+Offline replay of logged trials through controller functions, faster than real time and without the rig.
+
+A trial is loaded from the OdriveDatabase tables (controllerData, encoderData, ODriveData, controllerParameters) into
+NumPy arrays. replay() then steps a controller function through the recorded inputs in a plain loop (no sleeps, no
+CAN, no I2C), collects its outputs into an array, and can compare them with the u_raw / u_clamped that were logged.
+
+Example:
+    python replay.py --trial 12                          # replay trial 12 with its logged gains, compare to the log
+    python replay.py --trial 12 --Kp 0.2 --Kd 0.001      # what would these gains have commanded?
+    python replay.py --all                               # re-evaluate every trial with controllerData
+"""
+
+import argparse
+import math
+import sqlite3
+import time
+from contextlib import closing
+
+import numpy as np
+
+import pid
+
+
+CONTROLLER_DATA_COLUMNS = ("current_time", "current_angle", "angle_error", "current_omega", "omega_desired", "u_raw", "u_clamped")
+ENCODER_DATA_COLUMNS = ("time", "angle", "accumulated_angle", "total_rotations", "velocity", "omega_dt")
+ODRIVE_DATA_COLUMNS = ("time", "position", "velocity", "torque_target", "torque_estimate")
+
+
+#---------------------------------------- Loading START -------------------------------------------------
+
+def _fetch(database, sql, params=()):
+    """Runs a query on a pyodrivecan.OdriveDatabase or a database file path, returns [] if the table does not exist."""
+    if isinstance(database, str):
+        with closing(sqlite3.connect(database)) as conn:
+            try:
+                return conn.execute(sql, params).fetchall()
+            except sqlite3.OperationalError:
+                return []
+    return database.fetch(sql, params)
+
+
+def _load_table(database, table, columns, trial_id):
+    """Returns a dict of column -> float64 array for one trial (None values become NaN), or None if there are no rows."""
+    # Quoted: an unquoted current_time is SQLite's CURRENT_TIME keyword, not the column
+    names = ", ".join(f'"{name}"' for name in columns)
+    rows = _fetch(database, f"SELECT {names} FROM {table} WHERE trial_id = ? ORDER BY UniqueID", (trial_id,))
+    if not rows:
+        return None
+    data = np.array(rows, dtype=np.float64)  # None -> nan
+    return {name: data[:, k] for k, name in enumerate(columns)}
+
+
+def trial_ids(database, table="controllerData"):
+    """Returns the sorted list of trial ids that have rows in `table`."""
+    return [row[0] for row in _fetch(database, f"SELECT DISTINCT trial_id FROM {table} ORDER BY trial_id")]
+
+
+
+class TrialRecording:
+    """
+    One logged trial as NumPy arrays.
+
+    Attributes:
+    - trial_id (int): Trial id.
+    - controller (dict or None): controllerData columns -> arrays.
+    - encoder (dict or None): encoderData columns -> arrays.
+    - odrive (dict or None): ODriveData columns -> arrays.
+    - parameters (dict): controllerParameters row of the trial (J_zz, K, Kp, Kd, target_deg, notes, ...), may be empty.
+    """
+    __slots__ = ("trial_id", "controller", "encoder", "odrive", "parameters")
+
+    def __init__(self, trial_id, controller=None, encoder=None, odrive=None, parameters=None):
+        self.trial_id = trial_id
+        self.controller = controller
+        self.encoder = encoder
+        self.odrive = odrive
+        self.parameters = parameters or {}
+
+
+    @classmethod
+    def load(cls, database, trial_id, controller_data_table="controllerData", encoder_table="encoderData",
+             controller_param_table="controllerParameters", node_id=None):
+        """
+        Loads one trial.
+
+        Parameters:
+        - database: pyodrivecan.OdriveDatabase or the path of the database file.
+        - trial_id: Trial to load.
+        - controller_data_table: Name of the controller data table, default 'controllerData'.
+        - encoder_table: Name of the encoder table, default 'encoderData'.
+        - controller_param_table: Name of the controller parameters table, default 'controllerParameters'.
+        - node_id: Only load ODriveData rows from this node, default all rows of the trial.
+
+        Example:
+            >>> recording = TrialRecording.load('odrive_data.db', 12)
+        """
+        controller = _load_table(database, controller_data_table, CONTROLLER_DATA_COLUMNS, trial_id)
+        encoder = _load_table(database, encoder_table, ENCODER_DATA_COLUMNS, trial_id)
+
+        sql = f"SELECT {', '.join(ODRIVE_DATA_COLUMNS)} FROM ODriveData WHERE trial_id = ?"
+        params = (trial_id,)
+        if node_id is not None:
+            sql += " AND node_ID = ?"
+            params = (trial_id, str(node_id))
+        rows = _fetch(database, sql + " ORDER BY UniqueID", params)
+        odrive = None
+        if rows:
+            data = np.array(rows, dtype=np.float64)
+            odrive = {name: data[:, k] for k, name in enumerate(ODRIVE_DATA_COLUMNS)}
+
+        parameters = {}
+        names = [row[1] for row in _fetch(database, f"PRAGMA table_info({controller_param_table})")]
+        if names:
+            rows = _fetch(database, f"SELECT * FROM {controller_param_table} WHERE trial_id = ? ORDER BY UniqueID DESC", (trial_id,))
+            if rows:
+                parameters = {name: value for name, value in zip(names, rows[0]) if name not in ("UniqueID", "trial_id")}
+
+        return cls(trial_id, controller, encoder, odrive, parameters)
+
+
+    @property
+    def duration(self):
+        """Length of the recording in seconds."""
+        if self.controller is not None and len(self.controller["current_time"]) > 1:
+            t = self.controller["current_time"]
+        elif self.encoder is not None and len(self.encoder["time"]) > 1:
+            t = self.encoder["time"]
+        else:
+            return 0.0
+        return float(t[-1] - t[0])
+
+#---------------------------------------- Loading END -------------------------------------------------
+
+
+
+#---------------------------------------- Replay START -------------------------------------------------
+
+class ReplaySample:
+    """
+    The inputs a controller function sees each step. One object is reused for the whole replay.
+
+    Attributes:
+    - time (float): Timestamp of the step [s] (the logged current_time, or the encoder time when replaying encoderData).
+    - angle (float): Encoder angle [deg].
+    - accumulated_angle (float): Unwrapped encoder angle [deg] (NaN when replaying controllerData, it is not logged).
+    - angular_velocity (float): Encoder angular velocity [rad/s].
+    - motor_position, motor_velocity, torque_estimate (float): Latest ODriveData row at that time, NaN if none.
+    - index (int): Step number.
+    """
+    __slots__ = ("time", "angle", "accumulated_angle", "angular_velocity", "motor_position", "motor_velocity",
+                 "torque_estimate", "index")
+
+
+
+class ReplayResult:
+    """
+    Outputs of one replay.
+
+    Attributes:
+    - time (np.ndarray): (N,) step timestamps.
+    - outputs (np.ndarray): (N x k) controller outputs, one column per entry of `columns`.
+    - columns (tuple): Names of the output columns.
+    - elapsed (float): Wall clock seconds the replay took.
+    """
+    __slots__ = ("time", "outputs", "columns", "elapsed")
+
+    def __init__(self, time, outputs, columns, elapsed):
+        self.time = time
+        self.outputs = outputs
+        self.columns = tuple(columns)
+        self.elapsed = elapsed
+
+
+    def __getitem__(self, column):
+        return self.outputs[:, self.columns.index(column)]
+
+
+    @property
+    def speedup(self):
+        """How many times faster than real time the replay ran."""
+        span = float(self.time[-1] - self.time[0]) if len(self.time) > 1 else 0.0
+        return span / self.elapsed if self.elapsed > 0 else math.inf
+
+
+    def compare(self, logged, columns=("u_raw", "u_clamped"), skip=1):
+        """
+        Compares output columns against the logged columns of the same name.
+
+        Parameters:
+        - logged: Dict of column -> array with the same length, e.g. recording.controller.
+        - columns: Columns to compare, default u_raw and u_clamped.
+        - skip: Number of leading steps to leave out (the first step has no derivative history), default 1.
+
+        Returns:
+        - Dict of column -> {"rmse": ..., "max_abs": ...}.
+        """
+        report = {}
+        for column in columns:
+            if column not in self.columns or column not in logged:
+                continue
+            diff = self[column][skip:] - logged[column][skip:]
+            diff = diff[np.isfinite(diff)]
+            report[column] = {
+                "rmse": float(np.sqrt(np.mean(diff * diff))) if len(diff) else math.nan,
+                "max_abs": float(np.max(np.abs(diff))) if len(diff) else math.nan,
+            }
+        return report
+
+
+
+def _hold(source_time, target_time):
+    """Index of the latest source sample at or before each target time (zero order hold), -1 where there is none."""
+    return np.searchsorted(source_time, target_time, side="right") - 1
+
+
+def replay(recording, controller, columns=("omega_desired", "u_raw", "u_clamped"), source="controller", rate=None):
+    """
+    Steps a controller function through a recorded trial as fast as possible.
+
+    Parameters:
+    - recording: TrialRecording.
+    - controller: Callable taking a ReplaySample and returning a tuple with one number per entry of `columns`.
+    - columns: Names of the controller outputs.
+    - source: "controller" replays the exact inputs the live controller logged in controllerData (one step per logged
+      cycle, so the outputs can be compared with u_raw / u_clamped). "encoder" replays encoderData, every row or
+      resampled at `rate` Hz.
+    - rate: Step rate in Hz for source="encoder", default is one step per encoder row.
+
+    Returns:
+    - ReplayResult.
+
+    Example:
+        >>> result = replay(recording, euler_pos_step(J_zz, K, Kp, Kd, target_deg))
+        >>> print(result.compare(recording.controller))
+    """
+    if source == "controller":
+        if recording.controller is None:
+            raise ValueError(f"Trial {recording.trial_id} has no controllerData rows")
+        logged = recording.controller
+        times = logged["current_time"]
+        angles = logged["current_angle"]
+        omegas = logged["current_omega"]
+        accumulated = np.full(len(times), np.nan)
+        # controllerData uses time.time(), encoderData / ODriveData the seconds since start: align the first rows
+        relative = times - times[0]
+    elif source == "encoder":
+        if recording.encoder is None:
+            raise ValueError(f"Trial {recording.trial_id} has no encoderData rows")
+        encoder = recording.encoder
+        if rate is None:
+            times = encoder["time"]
+            index = np.arange(len(times))
+        else:
+            times = np.arange(encoder["time"][0], encoder["time"][-1], 1.0 / rate)
+            index = _hold(encoder["time"], times)
+        angles = encoder["angle"][index]
+        accumulated = encoder["accumulated_angle"][index]
+        omegas = encoder["velocity"][index]
+        relative = times - times[0]
+    else:
+        raise ValueError(f"Unknown source '{source}', use 'controller' or 'encoder'")
+
+    n = len(times)
+    motor = np.full((n, 3), np.nan)
+    if recording.odrive is not None:
+        odrive = recording.odrive
+        index = _hold(odrive["time"] - odrive["time"][0], relative)
+        valid = index >= 0
+        motor[valid, 0] = odrive["position"][index[valid]]
+        motor[valid, 1] = odrive["velocity"][index[valid]]
+        motor[valid, 2] = odrive["torque_estimate"][index[valid]]
+
+    # Plain Python lists are much faster to index in the loop than NumPy arrays
+    times_list = times.tolist()
+    angles_list = angles.tolist()
+    accumulated_list = accumulated.tolist()
+    omegas_list = omegas.tolist()
+    motor_list = motor.tolist()
+
+    outputs = [None] * n
+    sample = ReplaySample()
+    start = time.perf_counter()
+    for k in range(n):
+        sample.index = k
+        sample.time = times_list[k]
+        sample.angle = angles_list[k]
+        sample.accumulated_angle = accumulated_list[k]
+        sample.angular_velocity = omegas_list[k]
+        sample.motor_position, sample.motor_velocity, sample.torque_estimate = motor_list[k]
+        outputs[k] = controller(sample)
+    elapsed = time.perf_counter() - start
+
+    return ReplayResult(times, np.array(outputs, dtype=np.float64).reshape(n, len(columns)), columns, elapsed)
+
+#---------------------------------------- Replay END -------------------------------------------------
+
+
+
+#---------------------------------------- Controllers START -------------------------------------------------
+
+def euler_pos_step(J_zz, K, Kp, Kd, desired_attitude_deg, torque_limit=0.1):
+    """
+    The euler_pos.py control law as a replay controller function.
+
+    Same steps as euler_pos.controller(): PD on the angle (pid.PD with negated gains, derivative on the measured angle
+    with the logged timestamps) -> omega_desired, u_raw = -J_zz * K * omega_desired, clamped to +-torque_limit.
+
+    Returns:
+    - Callable(sample) -> (omega_desired, u_raw, u_clamped).
+    """
+    angle_pd = pid.PD(-Kp, -Kd, setpoint=desired_attitude_deg)
+    gain = -J_zz * K
+
+    def step(sample):
+        omega_desired = angle_pd.update(sample.angle, t=sample.time)
+        u_raw = gain * omega_desired
+        u_clamped = -torque_limit if u_raw < -torque_limit else torque_limit if u_raw > torque_limit else u_raw
+        return omega_desired, u_raw, u_clamped
+
+    return step
+
+#---------------------------------------- Controllers END -------------------------------------------------
+
+
+
+def _write_demo_database(path, trial_id=1, seconds=60.0, damping=0.0005, substeps=10):
+    """
+    Writes a synthetic euler_pos trial (as the live controller would have logged it) for --demo.
+
+    The trial does not go through euler_pos_step(), so the replay is checked against an independent implementation:
+    the control law is written out inline from euler_pos.controller() and the plant, J_zz * omega' = u - damping *
+    omega (gain_sweep.py's reaction wheel, a positive torque increases the angle), is integrated with RK4 over
+    `substeps` steps per controller period while the torque is held.
+    """
+    J_zz, K, Kp, Kd, target = 0.0026433333333333335, 2.0, 0.1, 0.0000001, 30.0
+    torque_limit = 0.1
+    rng = np.random.default_rng(0)
+    angle = 0.0  # degrees
+    omega = 0.0  # rad/s
+    t = 1_700_000_000.0
+    previous_angle = previous_time = None
+    rows = []
+
+    def acceleration(omega, u):
+        return (u - damping * omega) / J_zz
+
+    for k in range(int(seconds / 0.01)):
+        period = 0.01 + rng.normal(0, 0.0005)  # asyncio.sleep(0.01) jitter
+        t += period
+
+        # omega_desired = Kp * (angle - target) - Kd * d(angle)/dt, u = -J_zz * K * omega_desired
+        rate = 0.0 if previous_angle is None else (angle - previous_angle) / (t - previous_time)
+        omega_desired = Kp * (angle - target) + Kd * rate
+        u_raw = -J_zz * K * omega_desired
+        u_clamped = max(-torque_limit, min(torque_limit, u_raw))
+        rows.append((trial_id, t, angle, angle - target, omega, omega_desired, u_raw, u_clamped))
+        previous_angle, previous_time = angle, t
+
+        h = period / substeps
+        for _ in range(substeps):
+            k1 = acceleration(omega, u_clamped)
+            k2 = acceleration(omega + 0.5 * h * k1, u_clamped)
+            k3 = acceleration(omega + 0.5 * h * k2, u_clamped)
+            k4 = acceleration(omega + h * k3, u_clamped)
+            angle += math.degrees(h * (omega + h * (k1 + k2 + k3) / 6.0))
+            omega += h * (k1 + 2.0 * k2 + 2.0 * k3 + k4) / 6.0
+
+    with closing(sqlite3.connect(path)) as conn:
+        conn.execute("CREATE TABLE controllerData (UniqueID INTEGER PRIMARY KEY AUTOINCREMENT, trial_id INTEGER NOT NULL, "
+                     + ", ".join(f'"{c}" REAL' for c in CONTROLLER_DATA_COLUMNS) + ")")
+        conn.execute("CREATE TABLE controllerParameters (UniqueID INTEGER PRIMARY KEY AUTOINCREMENT, trial_id INTEGER NOT NULL, "
+                     "J_zz REAL, K REAL, Kp REAL, Kd REAL, target_deg REAL, notes TEXT)")
+        conn.executemany("INSERT INTO controllerData (trial_id, " + ", ".join(f'"{c}"' for c in CONTROLLER_DATA_COLUMNS) + ") VALUES (?, ?, ?, ?, ?, ?, ?, ?)", rows)
+        conn.execute("INSERT INTO controllerParameters (trial_id, J_zz, K, Kp, Kd, target_deg, notes) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                     (trial_id, J_zz, K, Kp, Kd, target, "synthetic demo trial"))
+        conn.commit()
+
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Replay logged trials through the euler_pos controller offline.')
+    parser.add_argument('--db', type=str, default='odrive_data.db', help='Database file.')
+    parser.add_argument('--trial', type=int, nargs='+', help='Trial id(s) to replay.')
+    parser.add_argument('--all', action='store_true', help='Replay every trial with controllerData.')
+    parser.add_argument('--J_zz', type=float, help='Override the logged J_zz.')
+    parser.add_argument('--K', type=float, help='Override the logged K.')
+    parser.add_argument('--Kp', type=float, help='Override the logged Kp.')
+    parser.add_argument('--Kd', type=float, help='Override the logged Kd.')
+    parser.add_argument('--target_deg', type=float, help='Override the logged target angle.')
+    parser.add_argument('--save', type=str, help='Save the replay outputs of the last trial to this .npz file.')
+    parser.add_argument('--demo', action='store_true', help='Replay a synthetic trial written to a temporary database.')
+    args = parser.parse_args()
+
+    if args.demo:
+        import os
+        import tempfile
+        args.db = os.path.join(tempfile.mkdtemp(), 'demo.db')
+        _write_demo_database(args.db)
+        args.trial = [1]
+
+    trials = trial_ids(args.db) if args.all else (args.trial or [])
+    if not trials:
+        parser.error("Give --trial, --all or --demo")
+
+    total_steps = 0
+    total_elapsed = 0.0
+    result = None
+    for trial_id in trials:
+        recording = TrialRecording.load(args.db, trial_id)
+        if recording.controller is None:
+            print(f"Trial {trial_id}: no controllerData rows, skipped")
+            continue
+        params = recording.parameters
+        gains = {}
+        for name in ("J_zz", "K", "Kp", "Kd", "target_deg"):
+            value = getattr(args, name)
+            gains[name] = value if value is not None else params.get(name)
+        if any(value is None for value in gains.values()):
+            print(f"Trial {trial_id}: controllerParameters has no {', '.join(k for k, v in gains.items() if v is None)}, "
+                  "give them on the command line")
+            continue
+
+        result = replay(recording, euler_pos_step(gains["J_zz"], gains["K"], gains["Kp"], gains["Kd"], gains["target_deg"]))
+        total_steps += len(result.time)
+        total_elapsed += result.elapsed
+        report = result.compare(recording.controller)
+        summary = ", ".join(f"{column} rmse {r['rmse']:.3e} max {r['max_abs']:.3e}" for column, r in report.items())
+        print(f"Trial {trial_id}: {len(result.time)} steps, {recording.duration:.1f} s replayed in {result.elapsed * 1e3:.1f} ms "
+              f"({result.speedup:.0f}x real time); vs log: {summary}")
+
+    if total_elapsed > 0:
+        print(f"{total_steps} steps in {total_elapsed:.3f} s ({total_steps / total_elapsed:.0f} steps/s)")
+    if args.save and result is not None:
+        np.savez(args.save, time=result.time, outputs=result.outputs, columns=np.array(result.columns))
+
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,389 @@
+"""
+In host publish / subscribe telemetry bus.
+
+Today every signal has its own transport: the encoder publishes over MQTT, the IMU over socket.io and the O-Drive data
+only reaches SQLite, so every consumer needs its own client and serialisation. TelemetryBus gives each signal a topic
+backed by a control_core.SharedRing in shared memory:
+
+    publisher process                      subscriber processes (plotter, logger, control core, ...)
+    bus.publish("encoder", angle, omega) -> [encoder ring] -> sub.latest() / sub.poll()   one array copy out of shared
+                                                                                          memory, no socket, no
+                                                                                          serialisation
+                                            `-> bridge() -> MQTT / websocket gateway      for remote consumers
+
+Topics are found by name through a small JSON manifest in the temp directory (updated under an fcntl lock, so
+publishers advertising at the same time do not lose each other's topics), so subscribers can start before or after
+the publisher. Every record is float64 [time, *fields]; a slow subscriber never blocks the publisher, it just
+sees `dropped` records when it falls a whole ring behind.
+"""
+
+import argparse
+import asyncio
+import fcntl
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from contextlib import contextmanager
+from multiprocessing import resource_tracker
+
+import numpy as np
+
+from control_core import SharedRing
+
+
+def _manifest_path(name):
+    return os.path.join(tempfile.gettempdir(), f"telemetry_bus_{name}.json")
+
+
+@contextmanager
+def _manifest_lock(name):
+    """Exclusive lock across processes for a read-modify-write of the manifest of bus `name`."""
+    with open(os.path.join(tempfile.gettempdir(), f"telemetry_bus_{name}.lock"), "a") as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+
+
+class Subscription:
+    """
+    Reader of one topic.
+
+    Attributes:
+    - topic (str): Topic name.
+    - fields (tuple): Field names of a record, after "time".
+    - last_seq (int): Seq of the last record returned by poll().
+    - dropped (int): Records overwritten before poll() got to them.
+    """
+    __slots__ = ("topic", "fields", "last_seq", "dropped", "_ring", "_latest")
+
+    def __init__(self, topic, ring):
+        self.topic = topic
+        self._ring = ring
+        self.fields = ring.fields[1:]
+        self.last_seq = ring.written
+        self.dropped = 0
+        self._latest = np.empty(len(ring.fields) + 1)
+
+
+    def latest(self):
+        """
+        Newest record as a (time, *fields) array view (valid until the next latest() call), None if nothing yet.
+        Cheapest way to follow a signal at its current value, e.g. in a controller.
+        """
+        return self._latest[1:] if self._ring.latest(self._latest) else None
+
+
+    def poll(self):
+        """
+        Every record published since the previous poll(), oldest first.
+
+        Returns:
+        - (M x 1 + len(fields)) array of [time, *fields], a copy (the ring keeps being overwritten).
+        """
+        rows, dropped = self._ring.read_since(self.last_seq)
+        self.dropped += dropped
+        if len(rows):
+            self.last_seq = int(rows[-1, 0])
+        return rows[:, 1:]
+
+
+    def close(self):
+        self._ring.close()
+
+
+
+class TelemetryBus:
+    """
+    Topics of one named bus (e.g. "rig"), shared by every process on the host.
+
+    Example:
+        >>> bus = TelemetryBus("rig")                               # publisher
+        >>> bus.advertise("encoder", ("angle", "angular_velocity"))
+        >>> bus.publish("encoder", angle, omega)
+
+        >>> bus = TelemetryBus("rig")                               # subscriber, any other process
+        >>> encoder = bus.subscribe("encoder")
+        >>> rows = encoder.poll()
+    """
+
+    def __init__(self, name="rig"):
+        self.name = name
+        self._rings = {}          # topics this process publishes
+        self._subscriptions = []
+
+
+    #---------------------------------------- Publish START -------------------------------------------------
+
+    def advertise(self, topic, fields, capacity=4096):
+        """
+        Creates a topic this process publishes (one publisher per topic).
+
+        Parameters:
+        - topic: Topic name, e.g. "encoder", "odrive0", "imu", "controller".
+        - fields: Field names of a record (a "time" field is prepended).
+        - capacity: Records kept in the ring; a subscriber that falls further behind loses the oldest.
+        """
+        ring = SharedRing(("time",) + tuple(fields), capacity)
+        self._rings[topic] = ring
+        self._update_manifest({topic: list(ring.spec())})
+        return ring
+
+
+    def publish(self, topic, *values, t=None):
+        """Appends one record to a topic advertised by this process. `t` defaults to time.time()."""
+        return self._rings[topic].push(time.time() if t is None else t, *values)
+
+
+    def _update_manifest(self, topics, remove=()):
+        path = _manifest_path(self.name)
+        # Locked, so another publisher cannot read the old manifest between our read and our rename
+        with _manifest_lock(self.name):
+            manifest = self._read_manifest()
+            manifest.update(topics)
+            for topic in remove:
+                manifest.pop(topic, None)
+            if not manifest:
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+                return
+            # Write then rename, so a reader (which does not lock) never sees a half written file
+            fd, temporary = tempfile.mkstemp(dir=os.path.dirname(path), prefix=".telemetry_bus_")
+            with os.fdopen(fd, "w") as f:
+                json.dump(manifest, f)
+            os.replace(temporary, path)
+
+
+    def _read_manifest(self):
+        try:
+            with open(_manifest_path(self.name)) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    #---------------------------------------- Publish END -------------------------------------------------
+
+
+    def topics(self):
+        """{topic: field names} of every advertised topic of this bus."""
+        return {topic: tuple(spec[1][1:]) for topic, spec in self._read_manifest().items()}
+
+
+    def subscribe(self, topic, timeout=5.0, untrack=True):
+        """
+        Opens a topic, waiting up to `timeout` seconds for its publisher to advertise it.
+
+        Parameters:
+        - topic: Topic name.
+        - timeout: Seconds to wait for the topic.
+        - untrack: Stop this process' multiprocessing resource tracker from unlinking the publisher's shared memory
+          when this process exits (Python < 3.13 tracks attached blocks too). Pass False in a multiprocessing child
+          of the publisher, which shares the publisher's tracker.
+        """
+        deadline = time.monotonic() + timeout
+        while True:
+            subscription = self._try_subscribe(topic, untrack)
+            if subscription is not None:
+                return subscription
+            if time.monotonic() > deadline:
+                raise TimeoutError(f"topic {topic!r} was not advertised on telemetry bus {self.name!r}")
+            time.sleep(0.05)
+
+
+    async def subscribe_async(self, topic, timeout=5.0, untrack=True):
+        """subscribe() for coroutines: waits for the topic with asyncio.sleep, so the event loop keeps running."""
+        deadline = time.monotonic() + timeout
+        while True:
+            subscription = self._try_subscribe(topic, untrack)
+            if subscription is not None:
+                return subscription
+            if time.monotonic() > deadline:
+                raise TimeoutError(f"topic {topic!r} was not advertised on telemetry bus {self.name!r}")
+            await asyncio.sleep(0.05)
+
+
+    def _try_subscribe(self, topic, untrack):
+        """Opens a topic if it is advertised, None otherwise."""
+        spec = self._read_manifest().get(topic)
+        if spec is None:
+            return None
+        try:
+            ring = SharedRing.attach((spec[0], tuple(spec[1]), spec[2]))
+        except FileNotFoundError:
+            return None  # stale manifest entry of a publisher that exited, wait for the new one
+        if untrack:
+            resource_tracker.unregister("/" + spec[0] if not spec[0].startswith("/") else spec[0], "shared_memory")
+        subscription = Subscription(topic, ring)
+        self._subscriptions.append(subscription)
+        return subscription
+
+
+    async def bridge(self, forward, topics, interval=0.05, stop=None):
+        """
+        Forwards topics to a remote transport: every `interval` seconds, forward(topic, fields, rows) is called with
+        the records published since the last call (rows as in Subscription.poll()).
+
+        Parameters:
+        - forward: Callable, e.g. mqtt_forwarder(client) or gateway_forwarder(gateway).
+        - topics: Topic names to forward.
+        - interval: Seconds between batches.
+        - stop: Optional asyncio.Event ending the bridge.
+        """
+        subscriptions = [await self.subscribe_async(topic) for topic in topics]
+        while stop is None or not stop.is_set():
+            await asyncio.sleep(interval)
+            for subscription in subscriptions:
+                rows = subscription.poll()
+                if len(rows):
+                    try:
+                        forward(subscription.topic, subscription.fields, rows)
+                    except Exception as e:
+                        print(f"Error bridging {subscription.topic}: {e}")
+
+
+    def close(self):
+        for subscription in self._subscriptions:
+            subscription.close()
+        if self._rings:
+            self._update_manifest({}, remove=list(self._rings))
+        for ring in self._rings.values():
+            ring.close()
+        self._rings.clear()
+
+
+
+#---------------------------------------- Bridges START -------------------------------------------------
+
+def mqtt_forwarder(client, prefix="telemetry", decimate=1):
+    """
+    Bridge target publishing each batch as one JSON message {"fields": [...], "rows": [[t, ...], ...]} to
+    `prefix/topic` with a paho.mqtt client (see encoder/mqtt_aysnc_as5048b.py for the client setup).
+    """
+    def forward(topic, fields, rows):
+        payload = json.dumps({"fields": ["time", *fields], "rows": rows[::decimate].tolist()})
+        client.publish(f"{prefix}/{topic}", payload)
+    return forward
+
+
+def gateway_forwarder(gateway):
+    """Bridge target feeding websocket/telemetry_gateway.TelemetryGateway streams named like the topics."""
+    def forward(topic, fields, rows):
+        for row in rows.tolist():
+            gateway.publish(topic, row[0], row[1:])
+    return forward
+
+#---------------------------------------- Bridges END -------------------------------------------------
+
+
+
+def _publisher(name, rate, duration):
+    """Demo publisher: an encoder topic at `rate` Hz and an O-Drive topic at rate / 10."""
+    bus = TelemetryBus(name)
+    bus.advertise("encoder", ("angle", "angular_velocity"))
+    bus.advertise("odrive0", ("position", "velocity", "torque_estimate"))
+    period = 1.0 / rate
+    start = time.perf_counter()
+    k = 0
+    try:
+        while time.perf_counter() - start < duration:
+            t = time.time()
+            bus.publish("encoder", np.sin(t), np.cos(t), t=t)
+            if k % 10 == 0:
+                bus.publish("odrive0", t, 1.0, 0.01, t=t)
+            k += 1
+            remaining = start + k * period - time.perf_counter()
+            if remaining > 0:
+                time.sleep(remaining)
+    finally:
+        time.sleep(0.5)
+        bus.close()
+
+
+class _PrintingMqttClient:
+    """Stand-in for paho.mqtt.client.Client in the demo."""
+    def __init__(self):
+        self.messages = 0
+        self.bytes = 0
+
+    def publish(self, topic, payload):
+        self.messages += 1
+        self.bytes += len(payload)
+
+
+async def _subscriber(name, duration):
+    bus = TelemetryBus(name)
+    encoder = bus.subscribe("encoder")
+    odrive = bus.subscribe("odrive0")
+    mqtt = _PrintingMqttClient()
+    stop = asyncio.Event()
+    bridge = asyncio.create_task(bus.bridge(mqtt_forwarder(mqtt, decimate=10), ["odrive0"], stop=stop))
+
+    received = 0
+    latencies = []
+    stop_at = time.monotonic() + duration
+    while time.monotonic() < stop_at:
+        await asyncio.sleep(0.01)
+        rows = encoder.poll()
+        now = time.time()
+        received += len(rows)
+        if len(rows):
+            latencies.append(now - rows[-1, 0])
+        odrive.poll()
+    stop.set()
+    await bridge
+    print(f"encoder: {received} records, {encoder.dropped} dropped, newest record age at poll "
+          f"p50 {np.percentile(latencies, 50) * 1e3:.2f} ms (polling every 10 ms)")
+    print(f"odrive0: {odrive.last_seq} records, bridged as {mqtt.messages} MQTT messages ({mqtt.bytes / 1e3:.1f} kB)")
+    print(f"topics: {bus.topics()}")
+    bus.close()
+
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Telemetry bus demo: a publisher process and a subscriber process.')
+    parser.add_argument('--name', type=str, default='demo')
+    parser.add_argument('--rate', type=float, default=1000.0)
+    parser.add_argument('--duration', type=float, default=3.0)
+    parser.add_argument('--publish', action='store_true', help='Run only the publisher (started by the demo).')
+    args = parser.parse_args()
+
+    if args.publish:
+        _publisher(args.name, args.rate, args.duration)
+    else:
+        # Separate interpreter, like a real publisher would be
+        publisher = subprocess.Popen([sys.executable, os.path.abspath(__file__), '--publish', '--name', args.name,
+                                      '--rate', str(args.rate), '--duration', str(args.duration + 0.5)])
+        try:
+            asyncio.run(_subscriber(args.name, args.duration))
+        finally:
+            publisher.wait()
+
+
+
+"""
+Example
+
+# encoder process
+bus = telemetry_bus.TelemetryBus("rig")
+bus.advertise("encoder", ("angle", "angular_velocity"))
+while encoder.running:
+    ...
+    bus.publish("encoder", encoder.angle, encoder.angular_velocity)
+
+# plotter / logger process
+bus = telemetry_bus.TelemetryBus("rig")
+encoder = bus.subscribe("encoder")
+rows = encoder.poll()          # [[time, angle, angular_velocity], ...] since the last poll
+
+# remote consumers
+mqtt_client = paho.mqtt.client.Client()
+mqtt_client.connect("test.mosquitto.org", 1883, 60)
+await bus.bridge(telemetry_bus.mqtt_forwarder(mqtt_client), ["encoder", "odrive0"])
+"""
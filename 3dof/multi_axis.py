@@ -0,0 +1,307 @@
+import argparse
+import asyncio
+import struct
+import time
+
+import can
+import numpy as np
+
+
+"""
+Synchronised multi axis controller runtime.
+
+Instead of one coroutine per O-Drive (each sampling and commanding at its own phase), MultiAxisRuntime runs one tick
+at a fixed rate for all axes:
+
+    1. snapshot: position / velocity / torque_estimate of every axis copied into one (fields x axes) array in a single
+       pass with no await in between, so no ODriveCAN.loop() update can land half way through the snapshot
+    2. control law: one vector function of the whole state (NumPy state vector, gain matrix)
+    3. burst: every axis' Set_Input_Torque frame sent back to back on one bus from prebuilt messages
+
+Works with pyodrivecan.ODriveCAN objects (their loop() keeps the telemetry fresh) or anything with the same
+attributes. Run `python multi_axis.py` for a 6 axis dry run on a simulated rig over python-can's virtual bus.
+"""
+
+
+SET_INPUT_TORQUE = 0x0E
+STATE_FIELDS = ("position", "velocity", "torque_estimate")
+
+
+#---------------------------------------- Control Laws START -------------------------------------------------
+
+def state_feedback(gain, reference, torque_limit):
+    """
+    u = clip(-gain @ (x - reference)) with x = [positions, velocities] of all axes.
+
+    Parameters:
+    - gain: (axes x 2*axes) gain matrix in Nm/turn and Nm/(turn/s). Off diagonal terms couple the axes.
+    - reference: (2*axes,) desired [positions, velocities], or a callable t -> (2*axes,) array.
+    - torque_limit: Scalar or (axes,) torque clamp in Nm.
+
+    Returns:
+    - Control law callable for MultiAxisRuntime.
+
+    Example:
+        >>> law = state_feedback(diagonal_pd(kp=[2, 2, 2], kd=[0.1, 0.1, 0.1]), np.zeros(6), 0.5)
+    """
+    gain = np.asarray(gain, dtype=np.float64)
+    axes = gain.shape[0]
+    error = np.empty(2 * axes)
+    fixed = None if callable(reference) else np.asarray(reference, dtype=np.float64)
+    limit = np.asarray(torque_limit, dtype=np.float64)
+
+    def law(t, state, out):
+        np.subtract(state[:2].reshape(-1), fixed if fixed is not None else reference(t), out=error)
+        # Axes without telemetry (NaN) contribute nothing instead of turning every coupled command into NaN
+        np.nan_to_num(error, copy=False)
+        np.dot(gain, error, out=out)
+        np.negative(out, out=out)
+        np.clip(out, -limit, limit, out=out)
+
+    return law
+
+
+def diagonal_pd(kp, kd):
+    """(axes x 2*axes) gain matrix of independent PD loops per axis."""
+    kp = np.atleast_1d(np.asarray(kp, dtype=np.float64))
+    kd = np.broadcast_to(np.asarray(kd, dtype=np.float64), kp.shape)
+    return np.hstack((np.diag(kp), np.diag(kd)))
+
+#---------------------------------------- Control Laws END -------------------------------------------------
+
+
+
+#---------------------------------------- Runtime START -------------------------------------------------
+
+class MultiAxisRuntime:
+    """
+    Fixed rate snapshot -> vector control law -> command burst loop for several O-Drives.
+
+    Attributes:
+    - state (np.ndarray): (3 x axes) latest snapshot, rows STATE_FIELDS (missing values are NaN).
+    - command (np.ndarray): (axes,) latest torque commands.
+    - active (np.ndarray): (axes,) bool, False for axes whose node left the bus (one zero frame, then none, see on_node_event).
+    - running (bool): Set to False to stop loop().
+    - ticks, late (int): Ticks run, ticks that started more than one period late.
+    - max_lateness, max_compute (float): Worst tick start lateness / worst snapshot-to-last-frame time in seconds.
+    """
+    __slots__ = ("odrives", "law", "rate", "bus", "state", "command", "active", "running", "ticks", "late", "max_lateness",
+                 "max_compute", "_messages", "_pack", "_axis_of")
+
+    def __init__(self, odrives, law, rate=200.0, bus=None):
+        """
+        Parameters:
+        - odrives: ODriveCAN objects, one per axis, in state vector order.
+        - law: Callable(t, state, out) writing the (axes,) torques into `out`, e.g. state_feedback(...).
+        - rate: Tick rate in Hz.
+        - bus: python-can bus the burst is sent on, default the first O-Drive's canBus (all nodes share can0).
+        """
+        self.odrives = list(odrives)
+        self.law = law
+        self.rate = rate
+        self.bus = bus if bus is not None else self.odrives[0].canBus
+        axes = len(self.odrives)
+        self.state = np.full((len(STATE_FIELDS), axes), np.nan)
+        self.command = np.zeros(axes)
+        self.active = np.ones(axes, dtype=bool)
+        self._axis_of = {odrive.nodeID: axis for axis, odrive in enumerate(self.odrives)}
+        self._messages = [can.Message(arbitration_id=(odrive.nodeID << 5 | SET_INPUT_TORQUE), data=bytearray(4),
+                                      is_extended_id=False) for odrive in self.odrives]
+        self._pack = struct.Struct('<f').pack_into
+        self.running = True
+        self.ticks = 0
+        self.late = 0
+        self.max_lateness = 0.0
+        self.max_compute = 0.0
+
+
+    def snapshot(self):
+        """Copies every active axis' telemetry into self.state in one pass (no await, so it is consistent)."""
+        state = self.state
+        for axis, (odrive, active) in enumerate(zip(self.odrives, self.active.tolist())):
+            if not active:
+                continue  # left the bus, keep its state NaN
+            position, velocity, torque = odrive.position, odrive.velocity, odrive.torque_estimate
+            state[0, axis] = np.nan if position is None else position
+            state[1, axis] = np.nan if velocity is None else velocity
+            state[2, axis] = np.nan if torque is None else torque
+        return state
+
+
+    def send(self, torques):
+        """Sends one Set_Input_Torque frame per axis, back to back."""
+        pack = self._pack
+        send = self.bus.send
+        for message, torque, active in zip(self._messages, torques.tolist(), self.active.tolist()):
+            if active:
+                pack(message.data, 0, torque)
+                send(message)
+
+
+    def on_node_event(self, kind, node):
+        """
+        node_discovery.NodeDiscovery callback: an axis whose node leaves gets one zero torque frame (in case it is
+        still listening, e.g. only its heartbeats were lost) and is then skipped, and resumes when it joins again. Its
+        state is NaN in between, so the control law must tolerate missing axes.
+
+        Example:
+            >>> discovery.subscribe(runtime.on_node_event)
+        """
+        axis = self._axis_of.get(node.node_id)
+        if axis is None or kind not in ("join", "leave"):
+            return
+        self.active[axis] = kind == "join"
+        if kind == "leave":
+            self.state[:, axis] = np.nan
+            self.command[axis] = 0.0
+            message = self._messages[axis]
+            self._pack(message.data, 0, 0.0)
+            try:
+                self.bus.send(message)
+            except can.CanError as e:
+                print(f"Error sending zero torque to node {node.node_id}: {e}")
+
+
+    def tick(self, t):
+        self.snapshot()
+        self.law(t, self.state, self.command)
+        # Axes without telemetry yet (NaN state) and axes that left get zero torque, not NaN
+        self.command[~np.isfinite(self.command) | ~np.isfinite(self.state[0]) | ~self.active] = 0.0
+        self.send(self.command)
+
+
+    async def loop(self, duration=None):
+        """
+        Runs ticks on absolute deadlines until running is False (or `duration` seconds), then commands zero torque.
+        """
+        period = 1.0 / self.rate
+        start = time.perf_counter()
+        k = 0
+        try:
+            while self.running:
+                deadline = start + k * period
+                if duration is not None and deadline - start > duration:
+                    break
+                remaining = deadline - time.perf_counter()
+                await asyncio.sleep(remaining if remaining > 0 else 0)
+
+                begin = time.perf_counter()
+                lateness = begin - deadline
+                if lateness > period:
+                    self.late += 1
+                    k += int(lateness / period)  # skip missed ticks instead of bursting to catch up
+                self.max_lateness = max(self.max_lateness, lateness)
+
+                self.tick(begin - start)
+                self.max_compute = max(self.max_compute, time.perf_counter() - begin)
+                self.ticks += 1
+                k += 1
+        finally:
+            self.command[:] = 0.0
+            self.send(self.command)
+
+
+    def summary(self):
+        return (f"{self.ticks} ticks x {len(self.odrives)} axes at {self.rate:g} Hz, {self.late} late, "
+                f"max lateness {self.max_lateness * 1e3:.2f} ms, max snapshot->burst {self.max_compute * 1e6:.0f} us")
+
+#---------------------------------------- Runtime END -------------------------------------------------
+
+
+
+#---------------------------------------- Simulated Rig START -------------------------------------------------
+
+class _SimulatedAxis:
+    """Just the ODriveCAN attributes the runtime uses."""
+    __slots__ = ("nodeID", "canBus", "position", "velocity", "torque_estimate")
+
+    def __init__(self, node_id, bus):
+        self.nodeID = node_id
+        self.canBus = bus
+        self.position = None
+        self.velocity = None
+        self.torque_estimate = None
+
+
+async def _simulate_rig(bus, axes, inertia, duration, step=0.001):
+    """Receives the torque frames from the virtual bus and integrates inertia * a = torque per axis at 1 kHz."""
+    index = {axis.nodeID: k for k, axis in enumerate(axes)}
+    position = np.zeros(len(axes))
+    velocity = np.zeros(len(axes))
+    torque = np.zeros(len(axes))
+    stop_at = time.perf_counter() + duration
+    last = time.perf_counter()
+    while time.perf_counter() < stop_at:
+        await asyncio.sleep(step)
+        message = bus.recv(timeout=0)
+        while message is not None:
+            if message.arbitration_id & 0x1F == SET_INPUT_TORQUE:
+                torque[index[message.arbitration_id >> 5]] = struct.unpack('<f', message.data)[0]
+            message = bus.recv(timeout=0)
+        now = time.perf_counter()
+        velocity += torque / inertia * (now - last)
+        position += velocity * (now - last)
+        last = now
+        for k, axis in enumerate(axes):
+            axis.position, axis.velocity, axis.torque_estimate = position[k], velocity[k], torque[k]
+
+#---------------------------------------- Simulated Rig END -------------------------------------------------
+
+
+
+async def main(axes_count, rate, duration):
+    controller_bus = can.interface.Bus("multi_axis_sim", interface="virtual")
+    rig_bus = can.interface.Bus("multi_axis_sim", interface="virtual")
+    axes = [_SimulatedAxis(node_id, controller_bus) for node_id in range(axes_count)]
+
+    # Move every axis to a different position, PD per axis in turns
+    target = np.concatenate((np.linspace(1.0, 2.0, axes_count), np.zeros(axes_count)))
+    law = state_feedback(diagonal_pd(kp=np.full(axes_count, 0.05), kd=np.full(axes_count, 0.01)), target, 0.5)
+    runtime = MultiAxisRuntime(axes, law, rate=rate)
+
+    await asyncio.gather(
+        runtime.loop(duration=duration),
+        _simulate_rig(rig_bus, axes, inertia=0.001, duration=duration),
+    )
+    print(runtime.summary())
+    print(f"final positions {np.round(runtime.state[0], 3)} turns, targets {np.round(target[:axes_count], 3)}")
+    controller_bus.shutdown()
+    rig_bus.shutdown()
+
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Multi axis runtime dry run on a simulated rig.')
+    parser.add_argument('--axes', type=int, default=6)
+    parser.add_argument('--rate', type=float, default=200.0)
+    parser.add_argument('--duration', type=float, default=5.0)
+    args = parser.parse_args()
+    asyncio.run(main(args.axes, args.rate, args.duration))
+
+
+
+"""
+Example
+
+import pyodrivecan
+import multi_axis
+import node_discovery
+
+odrives = [pyodrivecan.ODriveCAN(node_id) for node_id in (0, 1, 2)]
+for odrive in odrives:
+    odrive.initCanBus()
+
+law = multi_axis.state_feedback(multi_axis.diagonal_pd(kp=[0.5, 0.5, 0.5], kd=[0.02, 0.02, 0.02]), np.zeros(6), 0.1)
+runtime = multi_axis.MultiAxisRuntime(odrives, law, rate=200)
+
+try:
+    # Optional: zero and skip axes whose O-Drive stops sending heartbeats (see node_discovery.py). It gets its own
+    # socket on can0, reading from the O-Drives' bus object would take frames away from their loop()
+    async with node_discovery.NodeDiscovery(can.interface.Bus("can0", interface="socketcan")) as discovery:
+        discovery.subscribe(runtime.on_node_event)
+        await asyncio.gather(*(odrive.loop() for odrive in odrives), runtime.loop())
+finally:
+    print(runtime.summary())
+    for odrive in odrives:
+        odrive.estop()
+"""
@@ -0,0 +1,324 @@
+import argparse
+import asyncio
+import struct
+import time
+
+import can
+
+
+"""
+Background O-Drive discovery and liveness tracking.
+
+find_nodeids.py scans three times and exits, and the other scripts assume their node IDs exist. NodeDiscovery instead
+runs for the whole session as one more listener on the bus reader (an existing can.Notifier, or its own one; with
+socketcan give it its own Bus on the channel when something else, like ODriveCAN.loop(), calls recv() on the first):
+
+    - liveness is passive: every O-Drive already sends a Heartbeat (0x01) every 100 ms by default, so a node is alive
+      while its heartbeats keep coming and leaves after `heartbeat_timeout` without one. No extra frames.
+    - serial numbers come from the Address (0x06) reply. One RTR broadcast is sent when a node ID without a known serial
+      shows up and one every `probe_interval` seconds (default 10 s) to find unaddressed O-Drives.
+
+Changes are delivered as ("join" | "leave" | "serial", NodeInfo) events to callbacks on the event loop and to events().
+"""
+
+
+HEARTBEAT_CMD = 0x01
+ADDRESS_CMD = 0x06
+BROADCAST_NODE_ID = 0x3f
+
+_HEARTBEAT = struct.Struct('<IBBB')
+
+
+def sn_str(sn):
+    return f"{sn:012X}"
+
+
+
+class NodeInfo:
+    """
+    What is known about one node.
+
+    Attributes:
+    - node_id (int): CAN node ID.
+    - serial (int or None): Serial number from the Address reply, None until it answered.
+    - alive (bool): Heartbeats are arriving.
+    - last_heartbeat (float): time.monotonic() of the last heartbeat.
+    - axis_error, axis_state, procedure_result, trajectory_done (int): Fields of the last heartbeat.
+    """
+    __slots__ = ("node_id", "serial", "alive", "last_heartbeat", "axis_error", "axis_state", "procedure_result",
+                 "trajectory_done")
+
+    def __init__(self, node_id):
+        self.node_id = node_id
+        self.serial = None
+        self.alive = False
+        self.last_heartbeat = 0.0
+        self.axis_error = 0
+        self.axis_state = 0
+        self.procedure_result = 0
+        self.trajectory_done = 0
+
+
+    def __repr__(self):
+        serial = sn_str(self.serial) if self.serial is not None else "?"
+        return f"NodeInfo(node_id={self.node_id}, serial={serial}, alive={self.alive}, axis_state={self.axis_state})"
+
+
+
+class NodeDiscovery(can.Listener):
+    """
+    Tracks which node IDs are on the bus, their serial numbers and heartbeat liveness.
+
+    Attributes:
+    - nodes (dict): node_id -> NodeInfo, including nodes that left.
+    - unaddressed (set): Serial numbers of O-Drives that answered the Address request without a node ID.
+    - probes (int): Address requests sent.
+
+    Example:
+        >>> async with NodeDiscovery(bus) as discovery:
+        ...     discovery.subscribe(lambda kind, node: print(kind, node))
+        ...     alive = await discovery.wait_for([0, 1, 2], timeout=1.0)
+    """
+
+    def __init__(self, bus, heartbeat_timeout=0.35, probe_interval=10.0, check_interval=0.05, notifier=None):
+        """
+        Parameters:
+        - bus: python-can bus (the same one the controllers use).
+        - heartbeat_timeout: Seconds without a heartbeat before a node leaves (> the O-Drive's heartbeat_msg_rate_ms).
+        - probe_interval: Seconds between Address broadcasts, None to only probe for new node IDs.
+        - check_interval: Seconds between liveness checks.
+        - notifier: Existing can.Notifier to listen on, default a new one.
+        """
+        self.bus = bus
+        self.heartbeat_timeout = heartbeat_timeout
+        self.probe_interval = probe_interval
+        self.check_interval = check_interval
+        self.nodes = {}
+        self.unaddressed = set()
+        self.probes = 0
+        self._notifier = notifier
+        self._own_notifier = notifier is None
+        self._loop = None
+        self._task = None
+        self._callbacks = []
+        self._queues = []
+        self._probe_requested = False
+        self._last_probe = 0.0
+
+
+    async def __aenter__(self):
+        self._loop = asyncio.get_running_loop()
+        if self._own_notifier:
+            self._notifier = can.Notifier(self.bus, [self])
+        else:
+            self._notifier.add_listener(self)
+        self._task = asyncio.create_task(self._run())
+        return self
+
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        if self._own_notifier:
+            self._notifier.stop()
+        else:
+            self._notifier.remove_listener(self)
+
+
+    #---------------------------------------- Events START -------------------------------------------------
+
+    def subscribe(self, callback):
+        """Calls callback(kind, node) on the event loop for every "join", "leave" and "serial" event."""
+        self._callbacks.append(callback)
+
+
+    async def events(self):
+        """
+        Async iterator over (kind, NodeInfo) events from now on.
+
+        Example:
+            >>> async for kind, node in discovery.events():
+            ...     print(kind, node.node_id)
+        """
+        queue = asyncio.Queue()
+        self._queues.append(queue)
+        try:
+            while True:
+                yield await queue.get()
+        finally:
+            self._queues.remove(queue)
+
+
+    def _emit(self, kind, node):
+        for callback in self._callbacks:
+            try:
+                callback(kind, node)
+            except Exception as e:
+                print(f"Error in node discovery callback: {e}")
+        for queue in self._queues:
+            queue.put_nowait((kind, node))
+
+    #---------------------------------------- Events END -------------------------------------------------
+
+
+    def on_message_received(self, msg):
+        """Runs in the notifier thread: only heartbeats and Address replies are looked at."""
+        if msg.is_extended_id or msg.is_remote_frame:
+            return
+        cmd = msg.arbitration_id & 0x1F
+        if cmd == HEARTBEAT_CMD and len(msg.data) >= 7:
+            self._loop.call_soon_threadsafe(self._on_heartbeat, msg.arbitration_id >> 5, bytes(msg.data[:7]))
+        elif cmd == ADDRESS_CMD and len(msg.data) >= 7:
+            self._loop.call_soon_threadsafe(self._on_address, msg.data[0], int.from_bytes(msg.data[1:7], byteorder='little'))
+
+
+    def _on_heartbeat(self, node_id, data):
+        node = self.nodes.get(node_id)
+        if node is None:
+            node = self.nodes[node_id] = NodeInfo(node_id)
+        node.axis_error, node.axis_state, node.procedure_result, node.trajectory_done = _HEARTBEAT.unpack(data)
+        node.last_heartbeat = time.monotonic()
+        if not node.alive:
+            node.alive = True
+            if node.serial is None:
+                self._probe_requested = True
+            self._emit("join", node)
+
+
+    def _on_address(self, node_id, serial):
+        if node_id == BROADCAST_NODE_ID:
+            self.unaddressed.add(serial)
+            return
+        self.unaddressed.discard(serial)
+        node = self.nodes.get(node_id)
+        if node is None:
+            node = self.nodes[node_id] = NodeInfo(node_id)
+        if node.serial != serial:
+            # The O-Drive was readdressed: its serial belongs to this node ID now, not to the one it had before
+            for other in self.nodes.values():
+                if other.serial == serial:
+                    other.serial = None
+                    self._emit("serial", other)
+            node.serial = serial
+            self._emit("serial", node)
+
+
+    def probe(self):
+        """Broadcasts one Address request (RTR); every O-Drive answers with its node ID and serial number."""
+        self.bus.send(can.Message(arbitration_id=(BROADCAST_NODE_ID << 5 | ADDRESS_CMD), is_extended_id=False,
+                                  is_remote_frame=True))
+        self.probes += 1
+        self._last_probe = time.monotonic()
+
+
+    async def _run(self):
+        self.probe()
+        while True:
+            await asyncio.sleep(self.check_interval)
+            now = time.monotonic()
+            for node in self.nodes.values():
+                if node.alive and now - node.last_heartbeat > self.heartbeat_timeout:
+                    node.alive = False
+                    self._emit("leave", node)
+            if self._probe_requested or (self.probe_interval is not None and now - self._last_probe > self.probe_interval):
+                self._probe_requested = False
+                try:
+                    self.probe()
+                except can.CanError as e:
+                    print(f"Error sending address request: {e}")
+
+
+    def alive_ids(self):
+        """Sorted node IDs currently sending heartbeats."""
+        return sorted(node_id for node_id, node in self.nodes.items() if node.alive)
+
+
+    def by_serial(self):
+        """{serial: node_id} of every node that answered the Address request."""
+        return {node.serial: node_id for node_id, node in self.nodes.items() if node.serial is not None}
+
+
+    async def wait_for(self, node_ids, timeout):
+        """
+        Waits until all `node_ids` are alive, or `timeout` seconds.
+
+        Returns:
+        - The set of node_ids that are alive (a subset of node_ids if some never showed up).
+        """
+        wanted = set(node_ids)
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            if wanted <= set(self.alive_ids()):
+                break
+            await asyncio.sleep(self.check_interval)
+        return wanted & set(self.alive_ids())
+
+
+
+#---------------------------------------- Simulated Nodes START -------------------------------------------------
+
+async def _simulated_node(bus, node_id, serial, start, stop, rate=0.1):
+    """Sends heartbeats from `start` to `stop` seconds and answers Address requests while it is up."""
+    begin = time.monotonic()
+    while time.monotonic() - begin < stop:
+        await asyncio.sleep(rate)
+        up = time.monotonic() - begin >= start
+        message = bus.recv(timeout=0)
+        while message is not None:
+            if up and message.is_remote_frame and message.arbitration_id & 0x1F == ADDRESS_CMD:
+                bus.send(can.Message(arbitration_id=(node_id << 5 | ADDRESS_CMD),
+                                     data=bytes([node_id]) + serial.to_bytes(6, 'little') + b'\x00', is_extended_id=False))
+            message = bus.recv(timeout=0)
+        if up:
+            bus.send(can.Message(arbitration_id=(node_id << 5 | HEARTBEAT_CMD), data=_HEARTBEAT.pack(0, 1, 0, 1) + b'\x00',
+                                 is_extended_id=False))
+
+#---------------------------------------- Simulated Nodes END -------------------------------------------------
+
+
+
+async def main(duration):
+    bus = can.interface.Bus("node_discovery_sim", interface="virtual")
+    node_buses = [can.interface.Bus("node_discovery_sim", interface="virtual") for _ in range(3)]
+
+    async with NodeDiscovery(bus) as discovery:
+        start = time.monotonic()
+        discovery.subscribe(lambda kind, node: print(f"{time.monotonic() - start:5.2f} s  {kind:<6} {node}"))
+        await asyncio.gather(
+            _simulated_node(node_buses[0], 0, 0x3A0012345678, start=0.0, stop=duration),
+            _simulated_node(node_buses[1], 1, 0x3A00ABCDEF01, start=0.0, stop=1.0),       # unplugged after 1 s
+            _simulated_node(node_buses[2], 2, 0x3A0055550002, start=1.5, stop=duration),  # plugged in at 1.5 s
+        )
+        print(f"alive {discovery.alive_ids()}, serials { {sn_str(sn): node_id for sn, node_id in discovery.by_serial().items()} }, "
+              f"{discovery.probes} address requests sent")
+
+    for b in [bus] + node_buses:
+        b.shutdown()
+
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Node discovery dry run with simulated O-Drives joining and leaving.')
+    parser.add_argument('--duration', type=float, default=3.0)
+    args = parser.parse_args()
+    asyncio.run(main(args.duration))
+
+
+
+"""
+Example
+
+import can
+import node_discovery
+
+bus = can.interface.Bus("can0", interface="socketcan")
+async with node_discovery.NodeDiscovery(bus) as discovery:
+    found = await discovery.wait_for([0, 1, 2], timeout=1.0)
+    print(f"missing: {set([0, 1, 2]) - found}")
+
+    async for kind, node in discovery.events():
+        print(kind, node)
+"""
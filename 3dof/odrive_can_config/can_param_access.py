@@ -1,25 +1,11 @@
 
 # -- start load
-import json
-with open('flat_endpoints.json', 'r') as f:
-    endpoint_data = json.load(f)
-    endpoints = endpoint_data['endpoints']
+# Compiled on first use and cached next to flat_endpoints.json, see endpoint_registry.py
+from endpoint_registry import get_registry, OPCODE_WRITE
+endpoints = get_registry('flat_endpoints.json')
 # -- end load
 
 # -- start definitions
-OPCODE_READ = 0x00
-OPCODE_WRITE = 0x01
-
-# See https://docs.python.org/3/library/struct.html#format-characters
-format_lookup = {
-    'bool': '?',
-    'uint8': 'B', 'int8': 'b',
-    'uint16': 'H', 'int16': 'h',
-    'uint32': 'I', 'int32': 'i',
-    'uint64': 'Q', 'int64': 'q',
-    'float': 'f'
-}
-
 node_id = 0 # must match the configured node_id on your ODrive (default 0)
 # -- end definitions
 
@@ -44,9 +30,8 @@ for msg in bus:
 
 _, hw_product_line, hw_version, hw_variant, fw_major, fw_minor, fw_revision, fw_unreleased = struct.unpack('<BBBBBBBB', msg.data)
 
-# If one of these asserts fail, you're probably not using the right flat_endpoints.json file
-assert endpoint_data['fw_version'] == f"{fw_major}.{fw_minor}.{fw_revision}"
-assert endpoint_data['hw_version'] == f"{hw_product_line}.{hw_version}.{hw_variant}"
+# If this fails, you're probably not using the right flat_endpoints.json file
+endpoints.check_version(f"{fw_major}.{fw_minor}.{fw_revision}", f"{hw_product_line}.{hw_version}.{hw_variant}")
 # -- end version check
 
 # -- start write
@@ -55,14 +40,13 @@ import struct
 path = 'axis0.controller.config.vel_integrator_limit'
 value_to_write = 1.234
 
-# Convert path to endpoint ID
-endpoint_id = endpoints[path]['id']
-endpoint_type = endpoints[path]['type']
+# Look up the endpoint (ID and precompiled frame format)
+endpoint = endpoints[path]
 
 # Send write command
 bus.send(can.Message(
     arbitration_id=(node_id << 5 | 0x04), # 0x04: RxSdo
-    data=struct.pack('<BHB' + format_lookup[endpoint_type], OPCODE_WRITE, endpoint_id, 0, value_to_write),
+    data=endpoint.write_frame(value_to_write),
     is_extended_id=False
 ))
 # -- end write
@@ -72,9 +56,8 @@ import struct
 
 path = 'axis0.controller.config.vel_integrator_limit'
 
-# Convert path to endpoint ID
-endpoint_id = endpoints[path]['id']
-endpoint_type = endpoints[path]['type']
+# Look up the endpoint (ID and precompiled frame format)
+endpoint = endpoints[path]
 
 # Flush CAN RX buffer so there are no more old pending messages
 while not (bus.recv(timeout=0) is None): pass
@@ -82,7 +65,7 @@ while not (bus.recv(timeout=0) is None): pass
 # Send read command
 bus.send(can.Message(
     arbitration_id=(node_id << 5 | 0x04), # 0x04: RxSdo
-    data=struct.pack('<BHB', OPCODE_READ, endpoint_id, 0),
+    data=endpoint.read_request,
     is_extended_id=False
 ))
 
@@ -92,7 +75,7 @@ for msg in bus:
         break
 
 # Unpack and print reply
-_, _, _, return_value = struct.unpack_from('<BHB' + format_lookup[endpoint_type], msg.data)
+return_value = endpoint.unpack(msg.data)
 print(f"received: {return_value}")
 # -- end read
 
@@ -102,7 +85,7 @@ import struct
 path = "save_configuration"
 
 # Convert path to endpoint ID
-endpoint_id = endpoints[path]['id']
+endpoint_id = endpoints[path].id
 
 bus.send(can.Message(
     arbitration_id=(node_id << 5 | 0x04), # 0x04: RxSdo
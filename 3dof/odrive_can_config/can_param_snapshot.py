@@ -0,0 +1,231 @@
+
+import argparse
+import asyncio
+import can
+import datetime
+import json
+import math
+import time
+from endpoint_registry import get_registry # if this import fails, make sure you copy the whole folder from the git repository
+from sdo_engine import SdoEngine, SimulatedSdoNode
+
+
+"""
+Dump every readable endpoint of one or more ODrives over CAN into a snapshot file, and diff snapshots.
+
+    python can_param_snapshot.py take -c can0 --node-ids 0 1 2 -o before.json
+    python can_param_snapshot.py diff before.json after.json
+    python can_param_snapshot.py diff before.json config.json        # only the keys config.json sets (either order)
+    python can_param_snapshot.py take --simulate 3 -o sim.json       # dry run on a virtual bus
+
+All nodes are read at once through SdoEngine (up to --window reads in flight per node), so the ~530 value endpoints
+of a node take about (endpoints / window) round trips instead of one round trip each.
+"""
+
+
+SNAPSHOT_FORMAT = 1
+
+
+async def read_node(engine, node_id, endpoints):
+    """
+    Reads the given endpoints of one node, all in flight up to the engine's window.
+
+    Returns:
+    - ({path: value}, {path: error string}) for the endpoints that did / did not answer.
+    """
+    values = {}
+    failed = {}
+
+    async def read(endpoint):
+        try:
+            values[endpoint.path] = await engine.read(node_id, endpoint.path)
+        except Exception as e:
+            failed[endpoint.path] = str(e)
+
+    await asyncio.gather(*(read(endpoint) for endpoint in endpoints))
+    return dict(sorted(values.items())), failed
+
+
+async def take_snapshot(bus, node_ids, registry, prefix='', window=8, timeout=0.5):
+    """
+    Reads every readable endpoint (optionally only under `prefix`) of every node concurrently.
+
+    Returns:
+    - Snapshot dict, see save_snapshot().
+    """
+    endpoints = registry.readable(prefix)
+    start = time.perf_counter()
+    async with SdoEngine(bus, registry, window=window, timeout=timeout, retries=1) as engine:
+        await asyncio.gather(*(engine.version_check(node_id) for node_id in node_ids))
+        results = await asyncio.gather(*(read_node(engine, node_id, endpoints) for node_id in node_ids))
+    seconds = time.perf_counter() - start
+
+    return {
+        "format": SNAPSHOT_FORMAT,
+        "taken_at": datetime.datetime.now().isoformat(timespec='seconds'),
+        "fw_version": registry.fw_version,
+        "hw_version": registry.hw_version,
+        "crc": registry.crc,
+        "prefix": prefix,
+        "seconds": round(seconds, 3),
+        "nodes": {str(node_id): values for node_id, (values, _) in zip(node_ids, results)},
+        "failed": {str(node_id): failed for node_id, (_, failed) in zip(node_ids, results) if failed},
+    }
+
+
+def save_snapshot(snapshot, path):
+    """
+    Writes a snapshot as JSON:
+    {"format", "taken_at", "fw_version", "hw_version", "crc", "prefix", "seconds",
+     "nodes": {node_id: {path: value}}, "failed": {node_id: {path: error}}}
+    """
+    with open(path, 'w') as f:
+        json.dump(snapshot, f, indent=1)
+
+
+def load_snapshot(path):
+    """
+    Loads a snapshot, or a config.json ({path: value}) as a snapshot with node "*" (compared against every node).
+    """
+    with open(path, 'r') as f:
+        data = json.load(f)
+    if "nodes" in data and "format" in data:
+        if data["format"] > SNAPSHOT_FORMAT:
+            raise Exception(f"{path} is snapshot format {data['format']}, this tool reads up to {SNAPSHOT_FORMAT}")
+        return data
+    return {"format": SNAPSHOT_FORMAT, "nodes": {"*": data}, "config": True}
+
+
+def _same(a, b):
+    if isinstance(a, float) or isinstance(b, float):
+        if isinstance(a, (int, float)) and isinstance(b, (int, float)):
+            if math.isnan(a) and math.isnan(b):
+                return True
+            # Snapshots hold float32 values, configs the decimal a human typed
+            return math.isclose(a, b, rel_tol=1e-6, abs_tol=1e-9)
+    if isinstance(a, bool) or isinstance(b, bool):
+        return bool(a) == bool(b)
+    return a == b
+
+
+def _node_values(snapshot, other):
+    """{node_id: {path: value}} of one side of a diff, a config.json is expanded to every node of the other side."""
+    if snapshot.get("config") and not other.get("config"):
+        return {node_id: snapshot["nodes"]["*"] for node_id in other["nodes"]}
+    return snapshot["nodes"]
+
+
+def diff_snapshots(old, new):
+    """
+    Compares two snapshots node by node. If either side is a config.json, only its keys are compared, against every
+    node of the snapshot on the other side.
+
+    Returns:
+    - {node_id: [(path, old value, new value)]} with None for a key missing on one side (config keys are never
+      reported missing from the snapshot side unless the snapshot read them).
+    """
+    config_keys = None
+    if old.get("config") != new.get("config"):
+        config_keys = (old if old.get("config") else new)["nodes"]["*"].keys()
+    old_nodes = _node_values(old, new)
+    new_nodes = _node_values(new, old)
+
+    result = {}
+    for node_id, old_values in old_nodes.items():
+        new_values = new_nodes.get(node_id)
+        if new_values is None:
+            result[node_id] = [("<node>", "present", None)]
+            continue
+        paths = config_keys if config_keys is not None else sorted(old_values.keys() | new_values.keys())
+        changes = [(path, old_values.get(path), new_values.get(path)) for path in paths
+                   if not _same(old_values.get(path), new_values.get(path))]
+        if changes:
+            result[node_id] = changes
+    for node_id in new_nodes.keys() - old_nodes.keys():
+        result[node_id] = [("<node>", None, "present")]
+    return result
+
+
+def _check_diff():
+    """Regression checks of diff_snapshots() for every pairing of snapshot and config.json."""
+    snapshot = {"format": SNAPSHOT_FORMAT, "nodes": {"0": {"a": 1.0, "b": 2, "c": True}, "1": {"a": 1.5, "b": 2, "c": True}}}
+    changed = {"format": SNAPSHOT_FORMAT, "nodes": {"0": {"a": 1.0, "b": 3, "c": True}, "2": {"a": 1.0}}}
+    config = {"format": SNAPSHOT_FORMAT, "nodes": {"*": {"a": 1.0, "c": True}}, "config": True}
+    other_config = {"format": SNAPSHOT_FORMAT, "nodes": {"*": {"a": 2.0, "d": 1}}, "config": True}
+
+    assert diff_snapshots(snapshot, snapshot) == {}
+    assert diff_snapshots(snapshot, changed) == {"0": [("b", 2, 3)], "1": [("<node>", "present", None)],
+                                                 "2": [("<node>", None, "present")]}
+    # Snapshot vs config and config vs snapshot: only the config keys, against every node, no "<node>" entries
+    assert diff_snapshots(snapshot, config) == {"1": [("a", 1.5, 1.0)]}
+    assert diff_snapshots(config, snapshot) == {"1": [("a", 1.0, 1.5)]}
+    assert diff_snapshots(config, other_config) == {"*": [("a", 1.0, 2.0), ("c", True, None), ("d", None, 1)]}
+    print("diff checks passed")
+
+
+def print_diff(diff, old_name, new_name):
+    if not diff:
+        print(f"No differences between {old_name} and {new_name}")
+        return
+    for node_id, changes in diff.items():
+        print(f"Node {node_id}: {len(changes)} differences")
+        for path, old_value, new_value in changes:
+            print(f"  {path}: {old_value} -> {new_value}")
+
+
+async def main():
+    parser = argparse.ArgumentParser(description='Snapshot every readable ODrive endpoint over CAN bus, or diff snapshots.')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    take = subparsers.add_parser('take', help='Read all endpoints of the given nodes into a snapshot file.')
+    take.add_argument('-i', '--interface', type=str, default='socketcan', required=False, help='Interface type (e.g., socketcan, slcan). Default is socketcan.')
+    take.add_argument('-c', '--channel', type=str, default='can0', required=False, help='Channel/path/interface name of the device (e.g., can0, /dev/tty.usbmodem11201).')
+    take.add_argument('-b', '--bitrate', type=int, default=250000, required=False, help='Bitrate for CAN bus. Default is 250000.')
+    take.add_argument('--node-ids', type=int, nargs='+', default=[0, 1], help='CAN Node IDs of the ODrives. Default is 0 1.')
+    take.add_argument('--endpoints-json', default='flat_endpoints.json', type=str, required=False, help='Path to flat_endpoints.json corresponding to the given ODrive and firmware version.')
+    take.add_argument('--prefix', type=str, default='', help='Only read endpoints under this path, e.g. axis0.controller.config.')
+    take.add_argument('--window', type=int, default=8, help='Outstanding SDO requests per node. Default is 8.')
+    take.add_argument('--timeout', type=float, default=0.5, help='Seconds to wait for one reply. Default is 0.5.')
+    take.add_argument('-o', '--output', type=str, default=None, help='Snapshot file. Default is snapshot_<date>_<time>.json.')
+    take.add_argument('--simulate', type=int, metavar='N', help='Dry run against N simulated ODrives (node IDs 0..N-1) on a virtual CAN bus.')
+    take.add_argument('--latency', type=float, default=0.001, help='Reply latency of the simulated ODrives in seconds. Default is 0.001.')
+
+    diff = subparsers.add_parser('diff', help='Diff two snapshots, or a snapshot and a config.json.')
+    diff.add_argument('old', type=str, help='Snapshot file or config.json.')
+    diff.add_argument('new', type=str, help='Snapshot file or config.json.')
+    subparsers.add_parser('check', help='Run the diff regression checks.')
+    args = parser.parse_args()
+
+    if args.command == 'check':
+        _check_diff()
+        return
+    if args.command == 'diff':
+        print_diff(diff_snapshots(load_snapshot(args.old), load_snapshot(args.new)), args.old, args.new)
+        return
+
+    registry = get_registry(args.endpoints_json)
+    output = args.output or f"snapshot_{datetime.datetime.now():%Y%m%d_%H%M%S}.json"
+    node_ids = args.node_ids
+    if args.simulate:
+        args.interface = 'virtual'
+        args.channel = 'param_snapshot_sim'
+        node_ids = list(range(args.simulate))
+
+    print(f"Opening CAN bus on {args.channel}...")
+    with can.interface.Bus(args.channel, bustype=args.interface, bitrate=args.bitrate) as bus:
+        simulated = [SimulatedSdoNode(can.interface.Bus(args.channel, bustype='virtual'), node_id, registry, latency=args.latency)
+                     for node_id in node_ids] if args.simulate else []
+        try:
+            snapshot = await take_snapshot(bus, node_ids, registry, args.prefix, args.window, args.timeout)
+        finally:
+            for node in simulated:
+                node.stop()
+                node.bus.shutdown()
+
+    save_snapshot(snapshot, output)
+    values = sum(len(v) for v in snapshot["nodes"].values())
+    failed = sum(len(v) for v in snapshot["failed"].values())
+    print(f"Read {values} values from {len(node_ids)} nodes in {snapshot['seconds']:.2f} s ({failed} failed), saved to {output}")
+
+if __name__ == "__main__":
+    asyncio.run(main())
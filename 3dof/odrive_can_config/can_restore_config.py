@@ -5,22 +5,12 @@ import can
 from dataclasses import dataclass
 import json
 import struct
+import time
 from can_simple_utils import CanSimpleNode, REBOOT_ACTION_SAVE # if this import fails, make sure you copy the whole folder from the git repository
+from endpoint_registry import EndpointRegistry, get_registry
+from sdo_engine import SdoEngine, SimulatedSdoNode
 
 
-_OPCODE_READ = 0x00
-_OPCODE_WRITE = 0x01
-
-# See https://docs.python.org/3/library/struct.html#format-characters
-_FORMAT_LOOKUP = {
-    'bool': '?',
-    'uint8': 'B', 'int8': 'b',
-    'uint16': 'H', 'int16': 'h',
-    'uint32': 'I', 'int32': 'i',
-    'uint64': 'Q', 'int64': 'q',
-    'float': 'f'
-}
-
 _GET_VERSION_CMD = 0x00 # Get_Version
 _RX_SDO = 0x04 # RxSdo
 _TX_SDO = 0x05 # TxSdo
@@ -29,7 +19,7 @@ _TX_SDO = 0x05 # TxSdo
 @dataclass
 class EndpointAccess():
     node: CanSimpleNode
-    endpoint_data: dict
+    registry: EndpointRegistry
 
     async def version_check(self):
         self.node.flush_rx()
@@ -45,23 +35,16 @@ class EndpointAccess():
         msg = await self.node.await_msg(_GET_VERSION_CMD)
 
         _, hw_product_line, hw_version, hw_variant, fw_major, fw_minor, fw_revision, fw_unreleased = struct.unpack('<BBBBBBBB', msg.data)
-        hw_version_str = f"{hw_product_line}.{hw_version}.{hw_variant}"
-        fw_version_str = f"{fw_major}.{fw_minor}.{fw_revision}"
 
-        # If one of these asserts fail, you're probably not using the right flat_endpoints.json file
-        if self.endpoint_data['fw_version'] != fw_version_str:
-            raise Exception(f"the file provided in --endpoints-json does not match the firmware version of the ODrive: {self.endpoint_data['fw_version']} != {fw_version_str}")
-        if self.endpoint_data['hw_version'] != hw_version_str:
-            raise Exception(f"the file provided in --endpoints-json does not match the firmware version of the ODrive: {self.endpoint_data['hw_version']} != {hw_version_str}")
+        # If this fails, you're probably not using the right file in --endpoints-json
+        self.registry.check_version(f"{fw_major}.{fw_minor}.{fw_revision}", f"{hw_product_line}.{hw_version}.{hw_variant}")
 
     async def write_and_verify(self, path: str, val):
-        endpoint_id = self.endpoint_data['endpoints'][path]['id']
-        endpoint_type = self.endpoint_data['endpoints'][path]['type']
-        endpoint_fmt = _FORMAT_LOOKUP[endpoint_type]
+        endpoint = self.registry[path]
 
         self.node.bus.send(can.Message(
             arbitration_id=(self.node.node_id << 5 | _RX_SDO),
-            data=struct.pack('<BHB' + endpoint_fmt, _OPCODE_WRITE, endpoint_id, 0, val),
+            data=endpoint.write_frame(val),
             is_extended_id=False
         ))
 
@@ -69,15 +52,15 @@ class EndpointAccess():
 
         self.node.bus.send(can.Message(
             arbitration_id=(self.node.node_id << 5 | _RX_SDO),
-            data=struct.pack('<BHB', _OPCODE_READ, endpoint_id, 0),
+            data=endpoint.read_request,
             is_extended_id=False
         ))
 
         msg = await self.node.await_msg(_TX_SDO)
 
         # Unpack and cpmpare reply
-        _, _, _, return_value = struct.unpack_from('<BHB' + endpoint_fmt, msg.data)
-        val_pruned = val if endpoint_type != 'float' else struct.unpack('<f', struct.pack('<f', val))[0]
+        return_value = endpoint.unpack(msg.data)
+        val_pruned = endpoint.prune(val)
         if return_value != val_pruned:
             raise Exception(f"failed to write {path}: {return_value} != {val_pruned}")
 
@@ -88,6 +71,49 @@ async def restore_config(odrv: EndpointAccess, config: dict):
         print(f"  {k} = {v}")
         await odrv.write_and_verify(k, v)
 
+async def restore_config_serial(bus, node_ids, registry, config_list, save_config):
+    """
+    The one key at a time path (EndpointAccess.write_and_verify), one node after the other.
+
+    Returns:
+    - Seconds spent checking versions and writing (not opening / closing the nodes).
+    """
+    seconds = 0.0
+    for node_id in node_ids:
+        print(f"Configuring node {node_id}...")
+        with CanSimpleNode(bus=bus, node_id=node_id) as node:
+            odrv = EndpointAccess(node=node, registry=registry)
+
+            start = time.perf_counter()
+            print("Checking version...")
+            await odrv.version_check()
+            await restore_config(odrv, config_list)
+            seconds += time.perf_counter() - start
+
+            if save_config:
+                print(f"Saving configuration for node {node_id}...")
+                node.reboot_msg(REBOOT_ACTION_SAVE)
+
+            await asyncio.sleep(0.1)  # small delay between configurations
+    return seconds
+
+
+async def restore_config_pipelined(bus, node_ids, registry, config_list, save_config, window, skip_matching):
+    """All nodes at once with up to `window` SDO requests in flight per node, see sdo_engine.py."""
+    async with SdoEngine(bus, registry, window=window) as engine:
+        results, seconds = await engine.restore(node_ids, config_list, skip_matching=skip_matching)
+
+    for node_id, result in results.items():
+        print(f"Node {node_id}: {len(result['written'])} written, {len(result['skipped'])} already set, {len(result['failed'])} failed")
+        for path, error in result['failed']:
+            print(f"  Error writing {path}: {error}")
+        if save_config and not result['failed']:
+            print(f"Saving configuration for node {node_id}...")
+            CanSimpleNode(bus=bus, node_id=node_id).reboot_msg(REBOOT_ACTION_SAVE)
+    print(f"Restored {len(config_list)} variables on {len(node_ids)} nodes in {seconds * 1e3:.1f} ms "
+          f"({engine.requests} SDO requests, {engine.timeouts} timeouts)")
+
+
 async def main():
     parser = argparse.ArgumentParser(description='Script to configure ODrive over CAN bus.')
     parser.add_argument('-i', '--interface', type=str, default='socketcan', required=False, help='Interface type (e.g., socketcan, slcan). Default is socketcan.')
@@ -97,6 +123,11 @@ async def main():
     parser.add_argument('--endpoints-json', default='flat_endpoints.json', type=str, required=False, help='Path to flat_endpoints.json corresponding to the given ODrive and firmware version.')
     parser.add_argument('--config', type=str, default='config.json', required=False, help='JSON file with configuration settings.')
     parser.add_argument("--save-config", action='store_true', help="Save the configuration to NVM and reboot ODrive.")
+    parser.add_argument('--window', type=int, default=8, help='Outstanding SDO requests per node. Default is 8.')
+    parser.add_argument('--no-skip', action='store_true', help='Write every key, even if the ODrive already has that value.')
+    parser.add_argument('--serial', action='store_true', help='Restore one key at a time, one node at a time (original behaviour).')
+    parser.add_argument('--simulate', type=int, metavar='N', help='Dry run against N simulated ODrives on a virtual CAN bus.')
+    parser.add_argument('--latency', type=float, default=0.001, help='Reply latency of the simulated ODrives in seconds. Default is 0.001.')
     args = parser.parse_args()
 
     """
@@ -111,10 +142,14 @@ async def main():
         'can0': list(range(0, 2))
     }
 
+    if args.simulate:
+        args.interface = 'virtual'
+        node_ids_channels = {'restore_config_sim': list(range(args.simulate))}
+
 
 
-    with open(args.endpoints_json, 'r') as f:
-        endpoint_data = json.load(f)
+    # Compiled once per flat_endpoints.json and cached next to it, see endpoint_registry.py
+    registry = get_registry(args.endpoints_json)
 
     with open(args.config, 'r') as f:
         config_list = json.load(f)
@@ -122,22 +157,19 @@ async def main():
     for channel, node_ids in node_ids_channels.items():
         print(f"Opening CAN bus on {channel}...")
         with can.interface.Bus(channel, bustype=args.interface, bitrate=args.bitrate) as bus:
-            for node_id in node_ids:
-                print(f"Configuring node {node_id} on {channel}...")
-                with CanSimpleNode(bus=bus, node_id=node_id) as node:
-                    odrv = EndpointAccess(node=node, endpoint_data=endpoint_data)
-
-                    print("Checking version...")
-                    await odrv.version_check()
-                    await restore_config(odrv, config_list)
-
-                    if args.save_config:
-                        print(f"Saving configuration for node {node_id}...")
-                        node.reboot_msg(REBOOT_ACTION_SAVE)
-
-                    await asyncio.sleep(0.1)  # small delay between configurations
-                    for i in range(3):
-                        print(" ")
+            simulated = [SimulatedSdoNode(can.interface.Bus(channel, bustype='virtual'), node_id, registry, latency=args.latency)
+                         for node_id in node_ids] if args.simulate else []
+            try:
+                if args.serial:
+                    seconds = await restore_config_serial(bus, node_ids, registry, config_list, args.save_config)
+                    print(f"Restored {len(config_list)} variables on {len(node_ids)} nodes in {seconds * 1e3:.1f} ms")
+                else:
+                    await restore_config_pipelined(bus, node_ids, registry, config_list, args.save_config, args.window, not args.no_skip)
+                await asyncio.sleep(0.1) # needed for last message to get through on SLCAN backend
+            finally:
+                for node in simulated:
+                    node.stop()
+                    node.bus.shutdown()
 
 if __name__ == "__main__":
     asyncio.run(main())
\ No newline at end of file
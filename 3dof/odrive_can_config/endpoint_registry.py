@@ -0,0 +1,236 @@
+import bisect
+import json
+import os
+import struct
+import time
+
+
+"""
+Compiled endpoint registry for flat_endpoints.json.
+
+flat_endpoints.json is parsed once per process (get_registry() shares the result). Every endpoint gets a precompiled
+struct.Struct for its SDO frame ('<BHB' + value format, one Struct object shared per type) and its read request bytes,
+so an access is one dict lookup and a Struct.pack / unpack_from, no format string building.
+
+Example:
+    >>> registry = EndpointRegistry.load('flat_endpoints.json')
+    >>> endpoint = registry['axis0.controller.config.vel_limit']
+    >>> data = endpoint.write_frame(90.0)
+    >>> value = endpoint.unpack(reply.data)
+"""
+
+
+OPCODE_READ = 0x00
+OPCODE_WRITE = 0x01
+
+# See https://docs.python.org/3/library/struct.html#format-characters
+FORMAT_LOOKUP = {
+    'bool': '?',
+    'uint8': 'B', 'int8': 'b',
+    'uint16': 'H', 'int16': 'h',
+    'uint32': 'I', 'int32': 'i',
+    'uint64': 'Q', 'int64': 'q',
+    'float': 'f'
+}
+
+HEADER = struct.Struct('<BHB')
+
+# One frame Struct per value type, shared by every endpoint of that type
+FRAME_STRUCTS = {endpoint_type: struct.Struct('<BHB' + fmt) for endpoint_type, fmt in FORMAT_LOOKUP.items()}
+
+
+
+class Endpoint:
+    """
+    One endpoint of flat_endpoints.json.
+
+    Attributes:
+    - path (str): e.g. 'axis0.controller.config.vel_limit'.
+    - id (int): SDO endpoint id.
+    - type (str): 'float', 'uint32', ... or 'function' / 'endpoint_ref' (not readable as a value).
+    - frame (struct.Struct or None): '<BHB' + value format, None for non value types.
+    - read_request (bytes): RxSdo read frame payload.
+    """
+    __slots__ = ("path", "id", "type", "frame", "read_request")
+
+    def __init__(self, path, endpoint_id, endpoint_type):
+        self.path = path
+        self.id = endpoint_id
+        self.type = endpoint_type
+        self.frame = FRAME_STRUCTS.get(endpoint_type)
+        self.read_request = HEADER.pack(OPCODE_READ, endpoint_id, 0)
+
+
+    @property
+    def readable(self):
+        return self.frame is not None
+
+
+    def write_frame(self, value):
+        """RxSdo write frame payload."""
+        return self.frame.pack(OPCODE_WRITE, self.id, 0, value)
+
+
+    def unpack(self, data):
+        """Value of a TxSdo reply payload."""
+        return self.frame.unpack_from(data)[3]
+
+
+    def prune(self, value):
+        """The value as the O-Drive stores it (floats rounded to float32), for comparing against read backs."""
+        if self.type == 'float':
+            return struct.unpack('<f', struct.pack('<f', value))[0]
+        if self.type == 'bool':
+            return bool(value)
+        return value
+
+
+    def __repr__(self):
+        return f"Endpoint({self.path!r}, id={self.id}, type={self.type!r})"
+
+
+
+class EndpointRegistry:
+    """
+    All endpoints of one firmware, by path and by id.
+
+    Attributes:
+    - fw_version, hw_version (str): Versions the endpoint table belongs to.
+    - crc (int): Endpoint table CRC from flat_endpoints.json.
+    - paths (list): Sorted endpoint paths.
+    """
+    __slots__ = ("fw_version", "hw_version", "crc", "paths", "_by_path", "_by_id")
+
+    def __init__(self, fw_version, hw_version, crc, table):
+        """
+        Parameters:
+        - fw_version, hw_version, crc: From flat_endpoints.json.
+        - table: List of (path, id, type).
+        """
+        self.fw_version = fw_version
+        self.hw_version = hw_version
+        self.crc = crc
+        self._by_path = {path: Endpoint(path, endpoint_id, endpoint_type) for path, endpoint_id, endpoint_type in table}
+        self._by_id = {endpoint.id: endpoint for endpoint in self._by_path.values()}
+        self.paths = sorted(self._by_path)
+
+
+    @classmethod
+    def from_json(cls, endpoint_data):
+        """Builds a registry from parsed flat_endpoints.json data."""
+        table = [(path, endpoint['id'], endpoint['type']) for path, endpoint in endpoint_data['endpoints'].items()]
+        return cls(endpoint_data['fw_version'], endpoint_data['hw_version'], endpoint_data['crc'], table)
+
+
+    @classmethod
+    def load(cls, json_path='flat_endpoints.json'):
+        """
+        Parses flat_endpoints.json and compiles every endpoint.
+
+        Parameters:
+        - json_path: Path of flat_endpoints.json.
+
+        Returns:
+        - EndpointRegistry.
+        """
+        with open(json_path, 'r') as f:
+            return cls.from_json(json.load(f))
+
+
+    def __getitem__(self, path):
+        return self._by_path[path]
+
+
+    def __contains__(self, path):
+        return path in self._by_path
+
+
+    def __len__(self):
+        return len(self._by_path)
+
+
+    def __iter__(self):
+        return iter(self._by_path.values())
+
+
+    def by_id(self, endpoint_id):
+        """Endpoint with this SDO id, None if unknown."""
+        return self._by_id.get(endpoint_id)
+
+
+    def prefix(self, prefix):
+        """
+        Endpoints whose path is `prefix` or below it, sorted by path.
+
+        Example:
+            >>> registry.prefix('axis0.controller.config')
+        """
+        start = bisect.bisect_left(self.paths, prefix)
+        result = []
+        for path in self.paths[start:]:
+            if not path.startswith(prefix):
+                break
+            if len(path) == len(prefix) or path[len(prefix)] == '.' or prefix.endswith('.'):
+                result.append(self._by_path[path])
+        return result
+
+
+    def readable(self, prefix=''):
+        """Endpoints with a value type (not functions / endpoint refs), optionally under a prefix."""
+        return [endpoint for endpoint in (self.prefix(prefix) if prefix else self) if endpoint.readable]
+
+
+    def check_version(self, fw_version, hw_version, node_id=None):
+        """Raises if a node's versions (strings like '0.6.9') do not match this endpoint table."""
+        node = f"node {node_id}: " if node_id is not None else ""
+        if self.fw_version != fw_version:
+            raise Exception(f"{node}flat_endpoints.json does not match the firmware version of the ODrive: {self.fw_version} != {fw_version}")
+        if self.hw_version != hw_version:
+            raise Exception(f"{node}flat_endpoints.json does not match the hardware version of the ODrive: {self.hw_version} != {hw_version}")
+
+
+
+_registries = {}
+
+
+def get_registry(json_path='flat_endpoints.json'):
+    """The registry of a flat_endpoints.json, loaded on first use and shared by everything in this process."""
+    key = os.path.abspath(json_path)
+    registry = _registries.get(key)
+    if registry is None:
+        registry = _registries[key] = EndpointRegistry.load(json_path)
+    return registry
+
+
+
+if __name__ == "__main__":
+    source = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'flat_endpoints.json')
+
+    start = time.perf_counter()
+    with open(source) as f:
+        endpoint_data = json.load(f)
+    json_ms = (time.perf_counter() - start) * 1e3
+
+    start = time.perf_counter()
+    registry = EndpointRegistry.load(source)
+    load_ms = (time.perf_counter() - start) * 1e3
+    print(f"json.load {json_ms:.2f} ms, load + compile {load_ms:.2f} ms ({len(registry)} endpoints, crc {registry.crc})")
+
+    # Same frames as the string building code in can_param_access.py
+    path = 'axis0.controller.config.vel_integrator_limit'
+    endpoint = registry[path]
+    endpoints = endpoint_data['endpoints']
+    assert endpoint.write_frame(1.234) == struct.pack('<BHB' + FORMAT_LOOKUP[endpoints[path]['type']], OPCODE_WRITE, endpoints[path]['id'], 0, 1.234)
+
+    n = 200000
+    start = time.perf_counter()
+    for _ in range(n):
+        struct.pack('<BHB' + FORMAT_LOOKUP[endpoints[path]['type']], OPCODE_WRITE, endpoints[path]['id'], 0, 1.234)
+    old = (time.perf_counter() - start) / n * 1e9
+    start = time.perf_counter()
+    for _ in range(n):
+        registry[path].write_frame(1.234)
+    new = (time.perf_counter() - start) / n * 1e9
+    print(f"write frame: dict lookups + format concat {old:.0f} ns, registry {new:.0f} ns")
+    print(f"{len(registry.prefix('axis0.controller.config'))} endpoints under axis0.controller.config, "
+          f"{len(registry.readable())} readable in total")
@@ -0,0 +1,659 @@
+import argparse
+import asyncio
+import heapq
+import os
+import struct
+import threading
+import time
+
+import can
+import numpy as np
+
+from endpoint_registry import get_registry, HEADER as _HEADER, OPCODE_READ, OPCODE_WRITE
+
+
+"""
+Software O-Drives on a virtual / vcan bus, for running the scripts and benchmarking drivers and controllers without
+hardware.
+
+One SimulatedODrives object emulates any number of nodes from a single thread: every tick (1 ms by default) it answers
+the frames received since the last tick, steps a vectorised motor + load model of all the axes, and sends each node's
+cyclic messages at the rates in its axis0.config.can.*_msg_rate_ms endpoints. It handles:
+
+    Heartbeat / Get_Error / Get_Encoder_Estimates / Get_Iq / Get_Temperature / Get_Bus_Voltage_Current / Get_Torques /
+    Get_Powers       cyclic, and on RTR
+    Set_Axis_State   IDLE, CLOSED_LOOP_CONTROL, calibration sequences (IDLE again after `calibration_time`)
+    Set_Controller_Mode, Set_Input_Pos / Vel / Torque, Set_Limits, Set_Absolute_Position, Estop, Clear_Errors, Reboot
+    Address          RTR to a node or the broadcast ID 0x3f, replies node ID + serial number
+    Get_Version, RxSdo  reads / writes of every endpoint in flat_endpoints.json (the ones the model uses are live)
+
+Model per axis, position in turns: the O-Drive cascade (position P -> velocity PI -> torque, limited by vel_limit,
+torque_soft_max and current_soft_max * torque_constant) drives an inertia with viscous damping, Coulomb friction and an
+external load torque (`load_torque`, settable per axis while running).
+
+    python odrive_sim.py serve -c vcan0 --nodes 0 1 2       # emulate nodes 0..2 on vcan0 for the other scripts
+    python odrive_sim.py bench --nodes 0 1 2 3 4 5          # discovery, SDO, closed loop, RTR latency, step response
+"""
+
+
+HEARTBEAT_CMD = 0x01
+ESTOP_CMD = 0x02
+GET_ERROR_CMD = 0x03
+RX_SDO = 0x04
+TX_SDO = 0x05
+ADDRESS_CMD = 0x06
+SET_AXIS_STATE_CMD = 0x07
+GET_ENCODER_ESTIMATES_CMD = 0x09
+SET_CONTROLLER_MODE_CMD = 0x0B
+SET_INPUT_POS_CMD = 0x0C
+SET_INPUT_VEL_CMD = 0x0D
+SET_INPUT_TORQUE_CMD = 0x0E
+SET_LIMITS_CMD = 0x0F
+GET_IQ_CMD = 0x14
+GET_TEMPERATURE_CMD = 0x15
+REBOOT_CMD = 0x16
+GET_BUS_VOLTAGE_CURRENT_CMD = 0x17
+CLEAR_ERRORS_CMD = 0x18
+SET_ABSOLUTE_POSITION_CMD = 0x19
+GET_TORQUES_CMD = 0x1C
+GET_POWERS_CMD = 0x1D
+GET_VERSION_CMD = 0x00
+BROADCAST_NODE_ID = 0x3F
+
+# AxisState
+IDLE = 1
+CLOSED_LOOP_CONTROL = 8
+CALIBRATION_STATES = (3, 4, 6, 7)  # FULL_CALIBRATION_SEQUENCE, MOTOR_CALIBRATION, ENCODER_INDEX_SEARCH, ENCODER_OFFSET_CALIBRATION
+
+# ControlMode
+TORQUE_CONTROL = 1
+VELOCITY_CONTROL = 2
+POSITION_CONTROL = 3
+
+# ProcedureResult
+SUCCESS = 0
+BUSY = 1
+
+ESTOP_REQUESTED = 0x2000000
+
+_HEARTBEAT = struct.Struct('<IBBBx')
+_TWO_FLOATS = struct.Struct('<ff')
+_TWO_UINTS = struct.Struct('<II')
+_FLOAT = struct.Struct('<f')
+_UINT = struct.Struct('<I')
+_INPUT_POS = struct.Struct('<fhh')
+
+# Cyclic messages: (command, message rate endpoint, default rate in ms)
+CYCLIC = (
+    (HEARTBEAT_CMD, 'axis0.config.can.heartbeat_msg_rate_ms', 100),
+    (GET_ERROR_CMD, 'axis0.config.can.error_msg_rate_ms', 0),
+    (GET_ENCODER_ESTIMATES_CMD, 'axis0.config.can.encoder_msg_rate_ms', 10),
+    (GET_IQ_CMD, 'axis0.config.can.iq_msg_rate_ms', 0),
+    (GET_TEMPERATURE_CMD, 'axis0.config.can.temperature_msg_rate_ms', 0),
+    (GET_BUS_VOLTAGE_CURRENT_CMD, 'axis0.config.can.bus_voltage_msg_rate_ms', 0),
+    (GET_TORQUES_CMD, 'axis0.config.can.torques_msg_rate_ms', 0),
+    (GET_POWERS_CMD, 'axis0.config.can.powers_msg_rate_ms', 0),
+)
+
+# Endpoints backed by the model's arrays instead of the plain value store: path -> array attribute
+LIVE_ENDPOINTS = {
+    'vbus_voltage': 'vbus',
+    'ibus': 'ibus',
+    'axis0.current_state': 'state',
+    'axis0.active_errors': 'active_errors',
+    'axis0.disarm_reason': 'disarm_reason',
+    'axis0.procedure_result': 'procedure_result',
+    'axis0.pos_estimate': 'pos',
+    'axis0.vel_estimate': 'vel',
+    'axis0.motor.torque_estimate': 'torque',
+    'axis0.controller.torque_setpoint': 'torque_target',
+    'axis0.controller.vel_integrator_torque': 'integrator',
+    'axis0.controller.input_pos': 'input_pos',
+    'axis0.controller.input_vel': 'input_vel',
+    'axis0.controller.input_torque': 'input_torque',
+    'axis0.controller.config.control_mode': 'control_mode',
+    'axis0.controller.config.input_mode': 'input_mode',
+    'axis0.controller.config.pos_gain': 'pos_gain',
+    'axis0.controller.config.vel_gain': 'vel_gain',
+    'axis0.controller.config.vel_integrator_gain': 'vel_integrator_gain',
+    'axis0.controller.config.vel_limit': 'vel_limit',
+    'axis0.config.torque_soft_max': 'torque_limit',
+    'axis0.config.motor.current_soft_max': 'current_limit',
+    'axis0.config.motor.torque_constant': 'torque_constant',
+    'axis0.config.motor.phase_resistance': 'phase_resistance',
+}
+
+# Power-on values of the live endpoints (a fresh O-Drive Pro with a small motor)
+DEFAULTS = {
+    'vbus': 24.0, 'state': IDLE, 'control_mode': POSITION_CONTROL, 'input_mode': 1, 'pos_gain': 20.0, 'vel_gain': 0.16,
+    'vel_integrator_gain': 0.32, 'vel_limit': 10.0, 'torque_limit': np.inf, 'current_limit': 10.0,
+    'torque_constant': 0.083, 'phase_resistance': 0.05,
+}
+
+
+
+class SimulatedODrives:
+    """
+    Emulates O-Drives on one python-can bus, all nodes from one thread.
+
+    Attributes:
+    - node_ids (list): Emulated CAN node IDs, axis k of every array is node_ids[k].
+    - pos, vel, torque (numpy.ndarray): Position [turns], velocity [turns/s] and torque [Nm] of every axis.
+    - load_torque (numpy.ndarray): External torque [Nm] on every axis, e.g. gravity or a disturbance, settable any time.
+    - inertia, damping, friction (numpy.ndarray): Load model, [kg m^2], [Nm s/rad], [Nm].
+    - frames_received, frames_sent (int): Frame counters.
+    - tick_seconds (float): Average wall time of one model tick (message handling excluded).
+
+    Example:
+        >>> bus = can.interface.Bus("vcan0", interface="socketcan")
+        >>> with SimulatedODrives(bus, [0, 1, 2]) as sim:
+        ...     run_script_against_vcan0()
+    """
+
+    def __init__(self, bus, node_ids, registry=None, values=None, dt=0.001, latency=0.0, inertia=2e-4, damping=1e-4,
+                 friction=0.005, calibration_time=0.5, serial_base=0x3A0000000000):
+        """
+        Parameters:
+        - bus: python-can bus the nodes listen and reply on (a virtual bus on the driver's channel, or vcan0).
+        - node_ids: CAN node IDs to emulate.
+        - registry: EndpointRegistry for SDO access and Get_Version, default flat_endpoints.json next to this file.
+        - values: Optional {path: value} applied to every node (e.g. config.json), or {node_id: {path: value}}.
+        - dt: Model step and cyclic message resolution in seconds.
+        - latency: Seconds added to every reply and cyclic message (adapter + firmware), order is kept.
+        - inertia, damping, friction: Load model, scalars or one value per node.
+        - calibration_time: Seconds a calibration state lasts before the axis returns to IDLE.
+        - serial_base: Serial number of the node at index 0, the others count up.
+        """
+        self.bus = bus
+        self.node_ids = list(node_ids)
+        self.dt = dt
+        self.latency = latency
+        self.calibration_time = calibration_time
+        self.registry = registry if registry is not None else get_registry(
+            os.path.join(os.path.dirname(os.path.abspath(__file__)), 'flat_endpoints.json'))
+        self._index = {node_id: k for k, node_id in enumerate(self.node_ids)}
+        n = len(self.node_ids)
+        self.serials = [serial_base + k for k in range(n)]
+
+        fw = [int(x) for x in self.registry.fw_version.split('.')]
+        hw = [int(x) for x in self.registry.hw_version.split('.')]
+        self._version_reply = struct.pack('<BBBBBBBB', 2, *hw, *fw, 0)
+
+        # Model state, one entry per axis
+        self.pos = np.zeros(n)
+        self.vel = np.zeros(n)
+        self.torque = np.zeros(n)
+        self.torque_target = np.zeros(n)
+        self.integrator = np.zeros(n)
+        self.input_pos = np.zeros(n)
+        self.input_vel = np.zeros(n)
+        self.input_torque = np.zeros(n)
+        self.vel_ff = np.zeros(n)
+        self.torque_ff = np.zeros(n)
+        self.ibus = np.zeros(n)
+        self.electrical_power = np.zeros(n)
+        self.mechanical_power = np.zeros(n)
+        self.load_torque = np.zeros(n)
+        self.inertia = np.broadcast_to(np.asarray(inertia, dtype=float), (n,)).copy()
+        self.damping = np.broadcast_to(np.asarray(damping, dtype=float), (n,)).copy()
+        self.friction = np.broadcast_to(np.asarray(friction, dtype=float), (n,)).copy()
+        self.active_errors = np.zeros(n, dtype=np.int64)
+        self.disarm_reason = np.zeros(n, dtype=np.int64)
+        self.procedure_result = np.zeros(n, dtype=np.int64)
+        self._calibration_until = np.full(n, np.inf)
+        for attribute in set(LIVE_ENDPOINTS.values()):
+            if not hasattr(self, attribute):
+                dtype = np.int64 if attribute in ('state', 'control_mode', 'input_mode') else float
+                setattr(self, attribute, np.full(n, DEFAULTS.get(attribute, 0), dtype=dtype))
+
+        # Everything else SDO can reach, per node
+        self.values = [{endpoint.path: endpoint.prune(0) for endpoint in self.registry.readable()
+                        if endpoint.path not in LIVE_ENDPOINTS} for _ in range(n)]
+        for k, node_id in enumerate(self.node_ids):
+            self.values[k]['serial_number'] = self.serials[k]
+            self.values[k]['axis0.config.can.node_id'] = node_id
+            for _, path, rate in CYCLIC:
+                self.values[k][path] = rate
+        self._rates = np.zeros((len(CYCLIC), n))
+        self._next_due = np.zeros((len(CYCLIC), n))
+        if values:
+            per_node = all(isinstance(key, int) for key in values)
+            for k, node_id in enumerate(self.node_ids):
+                for path, value in (values.get(node_id, {}) if per_node else values).items():
+                    if path in self.registry:
+                        self._set(k, self.registry[path], value)
+        self._update_rates()
+
+        self.frames_received = 0
+        self.frames_sent = 0
+        self.tick_seconds = 0.0
+        self._ticks = 0
+        self._time = None
+        self._pending = []  # (due, seq, message) heap when latency > 0
+        self._seq = 0
+        self._running = False
+        self._thread = None
+
+
+    #---------------------------------------- Runtime START -------------------------------------------------
+
+    def start(self):
+        self._running = True
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+        return self
+
+
+    def stop(self):
+        self._running = False
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+
+    def __enter__(self):
+        return self.start()
+
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.stop()
+
+
+    def _run(self):
+        next_tick = time.perf_counter()
+        while self._running:
+            wake = next_tick if not self._pending else min(next_tick, self._pending[0][0])
+            self.poll(max(0.0, wake - time.perf_counter()))
+            now = time.perf_counter()
+            if now >= next_tick:
+                next_tick += self.dt
+                if next_tick < now - 0.05:
+                    next_tick = now + self.dt  # stalled (e.g. a GC pause or a loaded CI machine), do not burst
+
+
+    def poll(self, timeout=0.0):
+        """
+        Handles received frames (waiting up to `timeout` for the first), advances the model to now and sends what is
+        due. start() runs this in a thread; call it from your own loop instead for lock step benchmarks.
+        """
+        msg = self.bus.recv(timeout=timeout)
+        while msg is not None:
+            self.frames_received += 1
+            self._on_message(msg)
+            msg = self.bus.recv(timeout=0)
+
+        now = time.perf_counter()
+        if self._time is None:
+            self._time = now
+        if now - self._time >= self.dt:
+            began = now
+            steps = min(int((now - self._time) / self.dt), 50)
+            for _ in range(steps):
+                self.step(self.dt)
+            self._time = now if steps == 50 else self._time + steps * self.dt
+            self._finish_calibrations(now)
+            self._send_cyclic(now)
+            self._ticks += 1
+            self.tick_seconds += (time.perf_counter() - began - self.tick_seconds) / min(self._ticks, 1000)
+
+        while self._pending and self._pending[0][0] <= now:
+            self._transmit(heapq.heappop(self._pending)[2])
+
+    #---------------------------------------- Runtime END -------------------------------------------------
+
+
+    #---------------------------------------- Model START -------------------------------------------------
+
+    def step(self, dt):
+        """Advances every axis by dt seconds (semi implicit Euler)."""
+        closed = self.state == CLOSED_LOOP_CONTROL
+        position_mode = self.control_mode == POSITION_CONTROL
+        torque_mode = self.control_mode == TORQUE_CONTROL
+
+        vel_setpoint = np.where(position_mode, self.pos_gain * (self.input_pos - self.pos) + self.vel_ff, self.input_vel)
+        vel_setpoint = np.clip(vel_setpoint, -self.vel_limit, self.vel_limit)
+        vel_error = vel_setpoint - self.vel
+        torque_limit = np.minimum(self.torque_limit, self.current_limit * self.torque_constant)
+
+        loop = closed & ~torque_mode
+        self.integrator = np.where(loop, np.clip(self.integrator + self.vel_integrator_gain * dt * vel_error,
+                                                 -torque_limit, torque_limit), 0.0)
+        # Torque mode keeps enable_torque_mode_vel_limit on: the torque fades out approaching +-vel_limit
+        input_torque = np.clip(self.input_torque, (-self.vel_limit - self.vel) * self.vel_gain, (self.vel_limit - self.vel) * self.vel_gain)
+        target = np.where(torque_mode, input_torque, self.vel_gain * vel_error + self.integrator + self.torque_ff)
+        self.torque_target = np.where(closed, np.clip(target, -torque_limit, torque_limit), 0.0)
+        self.torque = self.torque_target  # the current loop is ~10x faster than a 1 ms step
+
+        omega = 2 * np.pi * self.vel
+        drive = self.torque - self.damping * omega + self.load_torque
+        # Coulomb friction, holding the axis at rest until the drive exceeds it
+        moving = np.abs(self.vel) > 1e-4
+        friction = np.where(moving, self.friction * np.sign(self.vel), np.clip(drive, -self.friction, self.friction))
+        accel = (drive - friction) / self.inertia / (2 * np.pi)
+        self.vel = self.vel + accel * dt
+        self.vel[~moving & (np.abs(drive) <= self.friction)] = 0.0
+        self.pos = self.pos + self.vel * dt
+
+        self.mechanical_power = self.torque * 2 * np.pi * self.vel
+        iq = self.torque / self.torque_constant
+        self.electrical_power = self.mechanical_power + self.phase_resistance * iq * iq
+        self.ibus = self.electrical_power / self.vbus
+
+
+    def _request_state(self, k, state):
+        if state != IDLE and self.active_errors[k]:
+            return  # the O-Drive refuses anything but IDLE until Clear_Errors
+        if state == CLOSED_LOOP_CONTROL:
+            # Entering closed loop holds the current position instead of jumping to a stale input_pos
+            self.input_pos[k] = self.pos[k]
+            self.integrator[k] = 0.0
+        elif state in CALIBRATION_STATES:
+            self.procedure_result[k] = BUSY
+            self._calibration_until[k] = time.perf_counter() + self.calibration_time
+        elif state == IDLE:
+            self._calibration_until[k] = np.inf
+        self.state[k] = state
+
+
+    def _finish_calibrations(self, now):
+        done = self._calibration_until <= now
+        if done.any():
+            self.state[done] = IDLE
+            self.procedure_result[done] = SUCCESS
+            self._calibration_until[done] = np.inf
+
+
+    def inject_error(self, node_id, error, disarm_reason=None):
+        """Disarms a node with `error` in active_errors, like a fault on the real drive (until Clear_Errors)."""
+        k = self._index[node_id]
+        self.active_errors[k] |= error
+        self.disarm_reason[k] = error if disarm_reason is None else disarm_reason
+        self._request_state(k, IDLE)
+
+    #---------------------------------------- Model END -------------------------------------------------
+
+
+    #---------------------------------------- CAN START -------------------------------------------------
+
+    def _on_message(self, msg):
+        node_id = msg.arbitration_id >> 5
+        cmd = msg.arbitration_id & 0x1F
+        if node_id == BROADCAST_NODE_ID and cmd == ADDRESS_CMD and msg.is_remote_frame:
+            for k in range(len(self.node_ids)):
+                self._send_address(k)
+            return
+        k = self._index.get(node_id)
+        if k is None:
+            return
+        data = msg.data
+        try:
+            if msg.is_remote_frame:
+                if cmd == ADDRESS_CMD:
+                    self._send_address(k)
+                elif cmd == GET_VERSION_CMD:
+                    self._reply(k, GET_VERSION_CMD, self._version_reply)
+                else:
+                    payload = self._payload(cmd, k)
+                    if payload is not None:
+                        self._reply(k, cmd, payload)
+            elif cmd == GET_VERSION_CMD and len(data) == 0:
+                self._reply(k, GET_VERSION_CMD, self._version_reply)
+            elif cmd == RX_SDO:
+                self._on_sdo(k, data)
+            elif cmd == SET_AXIS_STATE_CMD:
+                self._request_state(k, _UINT.unpack_from(data)[0])
+            elif cmd == SET_INPUT_POS_CMD:
+                self.input_pos[k], vel_ff, torque_ff = _INPUT_POS.unpack_from(data)
+                self.vel_ff[k], self.torque_ff[k] = vel_ff * 0.001, torque_ff * 0.001
+            elif cmd == SET_INPUT_VEL_CMD:
+                self.input_vel[k], self.torque_ff[k] = _TWO_FLOATS.unpack_from(data)
+            elif cmd == SET_INPUT_TORQUE_CMD:
+                self.input_torque[k] = _FLOAT.unpack_from(data)[0]
+            elif cmd == SET_CONTROLLER_MODE_CMD:
+                self.control_mode[k], self.input_mode[k] = _TWO_UINTS.unpack_from(data)
+            elif cmd == SET_LIMITS_CMD:
+                self.vel_limit[k], self.current_limit[k] = _TWO_FLOATS.unpack_from(data)
+            elif cmd == SET_ABSOLUTE_POSITION_CMD:
+                position = _FLOAT.unpack_from(data)[0]
+                self.input_pos[k] += position - self.pos[k]
+                self.pos[k] = position
+            elif cmd == CLEAR_ERRORS_CMD:
+                self.active_errors[k] = 0
+                self.disarm_reason[k] = 0
+            elif cmd == ESTOP_CMD:
+                self.inject_error(self.node_ids[k], ESTOP_REQUESTED)
+            elif cmd == REBOOT_CMD:
+                self._request_state(k, IDLE)
+                self.active_errors[k] = self.disarm_reason[k] = self.procedure_result[k] = 0
+                self.input_pos[k] = self.input_vel[k] = self.input_torque[k] = self.vel_ff[k] = self.torque_ff[k] = 0.0
+        except struct.error as e:
+            print(f"Error: node {self.node_ids[k]} got a malformed command 0x{cmd:02X} ({bytes(data).hex()}): {e}")
+
+
+    def _payload(self, cmd, k):
+        if cmd == HEARTBEAT_CMD:
+            return _HEARTBEAT.pack(int(self.active_errors[k]), int(self.state[k]), int(self.procedure_result[k]), 1)
+        if cmd == GET_ERROR_CMD:
+            return _TWO_UINTS.pack(int(self.active_errors[k]), int(self.disarm_reason[k]))
+        if cmd == GET_ENCODER_ESTIMATES_CMD:
+            return _TWO_FLOATS.pack(self.pos[k], self.vel[k])
+        if cmd == GET_IQ_CMD:
+            return _TWO_FLOATS.pack(self.torque_target[k] / self.torque_constant[k], self.torque[k] / self.torque_constant[k])
+        if cmd == GET_TEMPERATURE_CMD:
+            return _TWO_FLOATS.pack(30.0, 30.0 + 0.5 * abs(self.torque[k]))
+        if cmd == GET_BUS_VOLTAGE_CURRENT_CMD:
+            return _TWO_FLOATS.pack(self.vbus[k], self.ibus[k])
+        if cmd == GET_TORQUES_CMD:
+            return _TWO_FLOATS.pack(self.torque_target[k], self.torque[k])
+        if cmd == GET_POWERS_CMD:
+            return _TWO_FLOATS.pack(self.electrical_power[k], self.mechanical_power[k])
+        return None
+
+
+    def _send_address(self, k):
+        self._reply(k, ADDRESS_CMD, bytes([self.node_ids[k]]) + self.serials[k].to_bytes(6, 'little') + b'\x00')
+
+
+    def _on_sdo(self, k, data):
+        opcode, endpoint_id, _ = _HEADER.unpack_from(data)
+        endpoint = self.registry.by_id(endpoint_id)
+        if endpoint is None or endpoint.frame is None:
+            return
+        if opcode == OPCODE_WRITE:
+            self._set(k, endpoint, endpoint.unpack(data))
+        else:
+            self._reply(k, TX_SDO, endpoint.frame.pack(OPCODE_READ, endpoint_id, 0, self._get(k, endpoint)))
+
+
+    def _get(self, k, endpoint):
+        attribute = LIVE_ENDPOINTS.get(endpoint.path)
+        value = self.values[k].get(endpoint.path, 0) if attribute is None else getattr(self, attribute)[k]
+        if endpoint.type == 'float':
+            return float(value) if np.isfinite(value) else float(np.finfo(np.float32).max)
+        return bool(value) if endpoint.type == 'bool' else int(value)
+
+
+    def _set(self, k, endpoint, value):
+        if endpoint.path == 'axis0.requested_state':
+            self._request_state(k, int(value))
+            return
+        attribute = LIVE_ENDPOINTS.get(endpoint.path)
+        if attribute is not None:
+            getattr(self, attribute)[k] = value
+        else:
+            self.values[k][endpoint.path] = endpoint.prune(value)
+            if endpoint.path.endswith('_msg_rate_ms'):
+                self._update_rates()
+
+
+    def _update_rates(self):
+        for row, (_, path, _) in enumerate(CYCLIC):
+            self._rates[row] = [values.get(path, 0) * 1e-3 for values in self.values]
+
+
+    def _send_cyclic(self, now):
+        due = (self._rates > 0) & (self._next_due <= now)
+        if not due.any():
+            return
+        for row, k in zip(*np.nonzero(due)):
+            cmd = CYCLIC[row][0]
+            self._reply(k, cmd, self._payload(cmd, k))
+        self._next_due[due] += self._rates[due]
+        # Behind by more than a period (stall, or a rate just enabled): restart the schedule from now
+        late = due & (self._next_due <= now)
+        self._next_due[late] = now + self._rates[late]
+
+
+    def _reply(self, k, cmd, data):
+        message = can.Message(arbitration_id=(self.node_ids[k] << 5 | cmd), data=data, is_extended_id=False)
+        if self.latency > 0:
+            self._seq += 1
+            heapq.heappush(self._pending, (time.perf_counter() + self.latency, self._seq, message))
+        else:
+            self._transmit(message)
+
+
+    def _transmit(self, message):
+        try:
+            self.bus.send(message)
+            self.frames_sent += 1
+        except can.CanError as e:
+            print(f"Error sending 0x{message.arbitration_id:03X}: {e}")
+
+    #---------------------------------------- CAN END -------------------------------------------------
+
+
+
+#---------------------------------------- Benchmark START -------------------------------------------------
+
+async def _bench(channel, node_ids, latency, duration):
+    from sdo_engine import SdoEngine
+
+    sim_bus = can.interface.Bus(channel, interface='virtual')
+    bus = can.interface.Bus(channel, interface='virtual')
+    sim = SimulatedODrives(sim_bus, node_ids, latency=latency).start()
+    try:
+        # Address discovery
+        bus.send(can.Message(arbitration_id=(BROADCAST_NODE_ID << 5 | ADDRESS_CMD), is_remote_frame=True, is_extended_id=False))
+        found = {}
+        stop_at = time.perf_counter() + 0.1
+        while time.perf_counter() < stop_at:
+            msg = bus.recv(timeout=0.01)
+            if msg is not None and msg.arbitration_id & 0x1F == ADDRESS_CMD and not msg.is_remote_frame:
+                found[msg.data[0]] = int.from_bytes(msg.data[1:7], 'little')
+        print(f"address discovery: {len(found)} of {len(node_ids)} nodes, serials {[hex(s) for s in found.values()]}")
+
+        # Pipelined SDO through the engine, against the live model values
+        async with SdoEngine(bus, sim.registry) as engine:
+            await engine.version_check(node_ids[0])
+            start = time.perf_counter()
+            vbus = await asyncio.gather(*(engine.read(node_id, 'vbus_voltage') for node_id in node_ids))
+            await asyncio.gather(*(engine.write_and_verify(node_id, 'axis0.controller.config.pos_gain', 25.0) for node_id in node_ids))
+            paths = [endpoint.path for endpoint in sim.registry.readable('axis0.config')]
+            await asyncio.gather(*(engine.read(node_ids[0], path) for path in paths))
+            print(f"SDO: vbus {vbus[0]:.1f} V, pos_gain written and verified on every node, {len(paths)} axis0.config "
+                  f"reads, {(time.perf_counter() - start) * 1e3:.0f} ms in total")
+
+        # Closed loop on every node, then a position step
+        for node_id in node_ids:
+            bus.send(can.Message(arbitration_id=(node_id << 5 | SET_AXIS_STATE_CMD), data=_UINT.pack(CLOSED_LOOP_CONTROL), is_extended_id=False))
+        await asyncio.sleep(0.2)
+        for k, node_id in enumerate(node_ids):
+            bus.send(can.Message(arbitration_id=(node_id << 5 | SET_INPUT_POS_CMD), data=_INPUT_POS.pack(1.0 + k, 0, 0), is_extended_id=False))
+
+        # RTR round trips while the cyclic traffic runs
+        round_trips = []
+        frames = 0
+        positions = {}
+        stop_at = time.perf_counter() + duration
+        while time.perf_counter() < stop_at:
+            node_id = node_ids[len(round_trips) % len(node_ids)]
+            sent = time.perf_counter()
+            bus.send(can.Message(arbitration_id=(node_id << 5 | GET_TORQUES_CMD), is_remote_frame=True, dlc=8, is_extended_id=False))
+            while True:
+                msg = bus.recv(timeout=0.1)
+                if msg is None:
+                    break
+                frames += 1
+                if msg.arbitration_id & 0x1F == GET_ENCODER_ESTIMATES_CMD:
+                    positions[msg.arbitration_id >> 5] = _TWO_FLOATS.unpack(msg.data)[0]
+                if msg.arbitration_id == (node_id << 5 | GET_TORQUES_CMD) and not msg.is_remote_frame:
+                    round_trips.append(time.perf_counter() - sent)
+                    break
+            await asyncio.sleep(0.002)
+        round_trips = np.array(round_trips) * 1e3
+        print(f"RTR Get_Torques: {len(round_trips)} round trips, p50 {np.percentile(round_trips, 50):.2f} ms, "
+              f"p99 {np.percentile(round_trips, 99):.2f} ms (emulated latency {latency * 1e3:.1f} ms)")
+        print(f"cyclic traffic: {frames / duration:.0f} frames/s received, model tick {sim.tick_seconds * 1e6:.0f} us for "
+              f"{len(node_ids)} axes")
+        print("position step to 1 + k turns: " + ", ".join(f"node {node_id} {positions.get(node_id, float('nan')):.3f}" for node_id in node_ids))
+    finally:
+        sim.stop()
+        sim_bus.shutdown()
+        bus.shutdown()
+
+#---------------------------------------- Benchmark END -------------------------------------------------
+
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Emulated O-Drives on a virtual or vcan CAN bus.')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    serve = subparsers.add_parser('serve', help='Emulate nodes on a bus until Ctrl+C.')
+    serve.add_argument('-i', '--interface', type=str, default='socketcan', help='Interface type. Default is socketcan (with vcan0).')
+    serve.add_argument('-c', '--channel', type=str, default='vcan0', help='Channel to emulate the nodes on. Default is vcan0.')
+    serve.add_argument('--nodes', type=int, nargs='+', default=[0, 1, 2], help='Node IDs to emulate. Default is 0 1 2.')
+    serve.add_argument('--config', type=str, default=None, help='config.json style {path: value} applied to every node.')
+    serve.add_argument('--latency', type=float, default=0.0, help='Reply latency in seconds. Default is 0.')
+
+    bench = subparsers.add_parser('bench', help='Discovery, SDO, closed loop and RTR latency against emulated nodes.')
+    bench.add_argument('--nodes', type=int, nargs='+', default=[0, 1, 2, 3, 4, 5])
+    bench.add_argument('--latency', type=float, default=0.0)
+    bench.add_argument('--duration', type=float, default=2.0)
+    args = parser.parse_args()
+
+    if args.command == 'bench':
+        asyncio.run(_bench('odrive_sim_bench', args.nodes, args.latency, args.duration))
+        return
+
+    values = None
+    if args.config:
+        import json
+        with open(args.config) as f:
+            values = json.load(f)
+    with can.interface.Bus(args.channel, bustype=args.interface) as bus:
+        sim = SimulatedODrives(bus, args.nodes, values=values, latency=args.latency).start()
+        print(f"Emulating O-Drive nodes {args.nodes} on {args.channel}, Ctrl+C to stop...")
+        try:
+            while True:
+                time.sleep(1.0)
+                print(f"  {sim.frames_received} frames received, {sim.frames_sent} sent, states {sim.state.tolist()}, "
+                      f"pos {np.round(sim.pos, 3).tolist()}")
+        except KeyboardInterrupt:
+            pass
+        finally:
+            sim.stop()
+
+if __name__ == "__main__":
+    main()
+
+
+
+"""
+Example
+
+import can
+from odrive_sim import SimulatedODrives
+
+# Same process: the emulator and the code under test each open a Bus on one virtual channel
+sim = SimulatedODrives(can.interface.Bus("rig", interface="virtual"), [0, 1, 2]).start()
+bus = can.interface.Bus("rig", interface="virtual")
+...
+sim.load_torque[1] = -0.2      # e.g. a weight hanging on axis 1
+sim.inject_error(2, 0x800)      # DC_BUS_OVER_REGEN_CURRENT on node 2
+sim.stop()
+
+# Other processes / existing scripts: sudo ip link add dev vcan0 type vcan && sudo ip link set up vcan0
+python odrive_sim.py serve -c vcan0 --nodes 0 1 2 --config config.json
+"""
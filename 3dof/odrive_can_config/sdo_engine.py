@@ -0,0 +1,288 @@
+import asyncio
+import queue
+import struct
+import threading
+import time
+
+import can
+
+from endpoint_registry import HEADER as _HEADER, OPCODE_READ, OPCODE_WRITE
+
+
+"""
+Pipelined SDO endpoint access for one or more O-Drives on a CAN bus.
+
+EndpointAccess in can_restore_config.py does one endpoint at a time: write, flush, read, wait for the TxSdo reply,
+next key. SdoEngine instead keeps up to `window` requests outstanding per node, on every node at once, and matches each
+TxSdo reply to its request by (node id, endpoint id). The O-Drive handles RxSdo frames in order, so a read sent right
+after a write returns the written value and a write + verify is one round trip.
+
+Endpoints come from an EndpointRegistry (endpoint_registry.py), so a request is one path lookup and a precompiled
+struct.Struct pack. SimulatedSdoNode answers Get_Version and RxSdo like an O-Drive (values kept in a dict), so the engine
+can be tested on python-can's virtual bus or vcan0 without hardware.
+"""
+
+
+GET_VERSION_CMD = 0x00 # Get_Version
+RX_SDO = 0x04 # RxSdo
+TX_SDO = 0x05 # TxSdo
+
+
+class SdoEngine:
+    """
+    Concurrent, windowed SDO reads and writes by endpoint path.
+
+    Parameters:
+    - bus: python-can bus.
+    - registry: EndpointRegistry of the nodes' firmware.
+    - window: Maximum outstanding requests per node.
+    - timeout: Seconds to wait for one reply.
+    - retries: Extra attempts for a read that timed out.
+
+    Use as an async context manager (it starts a can.Notifier thread that hands replies to the running loop).
+
+    Example:
+        >>> async with SdoEngine(bus, get_registry('flat_endpoints.json')) as engine:
+        ...     value = await engine.read(0, 'axis0.controller.config.vel_limit')
+    """
+
+    def __init__(self, bus, registry, window=8, timeout=0.5, retries=2):
+        self.bus = bus
+        self.registry = registry
+        self.window = window
+        self.timeout = timeout
+        self.retries = retries
+        self.requests = 0
+        self.timeouts = 0
+        self._loop = None
+        self._notifier = None
+        self._pending = {}    # (node_id, endpoint_id) -> future of the outstanding read
+        self._key_locks = {}  # (node_id, endpoint_id) -> lock, one outstanding read per endpoint (replies carry no tag)
+        self._windows = {}    # node_id -> semaphore
+        self._versions = {}   # node_id -> future of the Get_Version reply
+
+
+    async def __aenter__(self):
+        self._loop = asyncio.get_running_loop()
+        self._notifier = can.Notifier(self.bus, [self._on_message])
+        return self
+
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        self._notifier.stop()
+
+
+    def _on_message(self, msg):
+        """Runs in the notifier thread: hand TxSdo / Get_Version replies to the waiting futures."""
+        cmd = msg.arbitration_id & 0x1F
+        if cmd == TX_SDO:
+            _, endpoint_id, _ = _HEADER.unpack_from(msg.data)
+            future = self._pending.get((msg.arbitration_id >> 5, endpoint_id))
+        elif cmd == GET_VERSION_CMD and len(msg.data) == 8:
+            future = self._versions.get(msg.arbitration_id >> 5)
+        else:
+            return
+        if future is not None:
+            self._loop.call_soon_threadsafe(_resolve, future, bytes(msg.data))
+
+
+    def _endpoint(self, path):
+        endpoint = self.registry[path]
+        if endpoint.frame is None:
+            raise ValueError(f"{path} is a {endpoint.type}, not a readable / writable value")
+        return endpoint
+
+
+    def _window(self, node_id):
+        window = self._windows.get(node_id)
+        if window is None:
+            window = self._windows[node_id] = asyncio.Semaphore(self.window)
+        return window
+
+
+    def _send(self, node_id, data):
+        self.bus.send(can.Message(arbitration_id=(node_id << 5 | RX_SDO), data=data, is_extended_id=False))
+
+
+    async def version_check(self, node_id):
+        """Raises if the node's firmware / hardware version does not match flat_endpoints.json."""
+        future = self._versions[node_id] = self._loop.create_future()
+        self.bus.send(can.Message(arbitration_id=(node_id << 5 | GET_VERSION_CMD), data=b'', is_extended_id=False))
+        try:
+            data = await asyncio.wait_for(future, self.timeout)
+        finally:
+            del self._versions[node_id]
+        _, hw_product_line, hw_version, hw_variant, fw_major, fw_minor, fw_revision, _ = struct.unpack('<BBBBBBBB', data)
+        self.registry.check_version(f"{fw_major}.{fw_minor}.{fw_revision}", f"{hw_product_line}.{hw_version}.{hw_variant}", node_id)
+
+
+    async def _request(self, node_id, endpoint, write_data=None):
+        """Optionally sends a write, then a read of the same endpoint, and returns the read value."""
+        key = (node_id, endpoint.id)
+        lock = self._key_locks.get(key)
+        if lock is None:
+            lock = self._key_locks[key] = asyncio.Lock()
+        async with self._window(node_id), lock:
+            for attempt in range(self.retries + 1):
+                future = self._pending[key] = self._loop.create_future()
+                if write_data is not None and attempt == 0:
+                    self._send(node_id, write_data)
+                self._send(node_id, endpoint.read_request)
+                self.requests += 1
+                try:
+                    data = await asyncio.wait_for(future, self.timeout)
+                    return endpoint.unpack(data)
+                except asyncio.TimeoutError:
+                    self.timeouts += 1
+                finally:
+                    del self._pending[key]
+        raise TimeoutError(f"node {node_id}: no reply for {endpoint.path} after {self.retries + 1} attempts")
+
+
+    async def read(self, node_id, path):
+        """Reads one endpoint."""
+        return await self._request(node_id, self._endpoint(path))
+
+
+    def write(self, node_id, path, value):
+        """Writes one endpoint without waiting (the O-Drive does not acknowledge writes)."""
+        self._send(node_id, self._endpoint(path).write_frame(value))
+
+
+    async def write_and_verify(self, node_id, path, value):
+        """Writes one endpoint and reads it back in the same round trip, raises if the read back differs."""
+        endpoint = self._endpoint(path)
+        returned = await self._request(node_id, endpoint, endpoint.write_frame(value))
+        if returned != endpoint.prune(value):
+            raise Exception(f"node {node_id}: failed to write {path}: {returned} != {endpoint.prune(value)}")
+        return returned
+
+
+    async def restore_node(self, node_id, config, skip_matching=True):
+        """
+        Writes a config dict to one node, all keys in flight up to the window.
+
+        Parameters:
+        - node_id: Node to configure.
+        - config: {path: value}, e.g. config.json.
+        - skip_matching: Read every key first and only write the ones that differ.
+
+        Returns:
+        - Dict with the lists "written", "skipped" and "failed" ((path, error) tuples).
+        """
+        result = {"written": [], "skipped": [], "failed": []}
+
+        async def restore_key(path, value):
+            try:
+                if skip_matching:
+                    endpoint = self._endpoint(path)
+                    if await self._request(node_id, endpoint) == endpoint.prune(value):
+                        result["skipped"].append(path)
+                        return
+                await self.write_and_verify(node_id, path, value)
+                result["written"].append(path)
+            except Exception as e:
+                result["failed"].append((path, e))
+
+        await asyncio.gather(*(restore_key(path, value) for path, value in config.items()))
+        return result
+
+
+    async def restore(self, node_ids, config, skip_matching=True, check_version=True):
+        """
+        restore_node() on every node concurrently.
+
+        Returns:
+        - ({node_id: result}, seconds)
+        """
+        start = time.perf_counter()
+        if check_version:
+            await asyncio.gather(*(self.version_check(node_id) for node_id in node_ids))
+        results = await asyncio.gather(*(self.restore_node(node_id, config, skip_matching) for node_id in node_ids))
+        return dict(zip(node_ids, results)), time.perf_counter() - start
+
+
+
+def _resolve(future, data):
+    if not future.done():
+        future.set_result(data)
+
+
+
+#---------------------------------------- Simulated ODrive START -------------------------------------------------
+
+class SimulatedSdoNode:
+    """
+    Answers Get_Version and RxSdo reads / writes like an O-Drive, on its own bus object (e.g. a second virtual bus on
+    the same channel, or vcan0).
+
+    Parameters:
+    - bus: python-can bus the node listens and replies on.
+    - node_id: CAN node id.
+    - registry: EndpointRegistry (ids, types and the version the node reports).
+    - values: Optional {path: value} initial values, everything else starts at 0.
+    - latency: Round trip delay in seconds added to every reply (bus, adapter and firmware), replies stay in order.
+    """
+
+    def __init__(self, bus, node_id, registry, values=None, latency=0.0):
+        self.bus = bus
+        self.node_id = node_id
+        self.latency = latency
+        self.registry = registry
+        self.values = {endpoint.path: endpoint.prune((values or {}).get(endpoint.path, 0)) for endpoint in registry.readable()}
+        fw = [int(x) for x in registry.fw_version.split('.')]
+        hw = [int(x) for x in registry.hw_version.split('.')]
+        self.version_reply = struct.pack('<BBBBBBBB', 2, *hw, *fw, 0)
+        self.reads = 0
+        self.writes = 0
+        self._lock = threading.Lock()
+        self._outbox = queue.Queue()
+        self._sender = threading.Thread(target=self._send_loop, daemon=True)
+        self._sender.start()
+        self._notifier = can.Notifier(bus, [self._on_message])
+
+
+    def _on_message(self, msg):
+        if msg.arbitration_id >> 5 != self.node_id:
+            return
+        cmd = msg.arbitration_id & 0x1F
+        if cmd == GET_VERSION_CMD and len(msg.data) == 0:
+            self._reply(GET_VERSION_CMD, self.version_reply)
+        elif cmd == RX_SDO:
+            opcode, endpoint_id, _ = _HEADER.unpack_from(msg.data)
+            endpoint = self.registry.by_id(endpoint_id)
+            if endpoint is None or endpoint.frame is None:
+                return
+            if opcode == OPCODE_WRITE:
+                with self._lock:
+                    self.values[endpoint.path] = endpoint.unpack(msg.data)
+                    self.writes += 1
+            else:
+                with self._lock:
+                    value = self.values[endpoint.path]
+                    self.reads += 1
+                self._reply(TX_SDO, endpoint.frame.pack(OPCODE_READ, endpoint_id, 0, value))
+
+
+    def _reply(self, cmd, data):
+        message = can.Message(arbitration_id=(self.node_id << 5 | cmd), data=data, is_extended_id=False)
+        self._outbox.put((time.perf_counter() + self.latency, message))
+
+
+    def _send_loop(self):
+        while True:
+            due, message = self._outbox.get()
+            if message is None:
+                return
+            remaining = due - time.perf_counter()
+            if remaining > 0:
+                time.sleep(remaining)
+            self.bus.send(message)
+
+
+    def stop(self):
+        self._notifier.stop()
+        self._outbox.put((0.0, None))
+        self._sender.join()
+
+#---------------------------------------- Simulated ODrive END -------------------------------------------------
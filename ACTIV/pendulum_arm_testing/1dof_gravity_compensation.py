@@ -2,12 +2,20 @@ import pyodrivecan
 import asyncio
 import math
 from datetime import datetime, timedelta
+from telemetry_logger import TelemetryLogger
+from gravity_table import GravityCompensationTable, Link
 
 
 mass = 0.12  # Kg weights = 0.090
 length = 0.11  # Meters
+payload = 0.0  # Kg extra weight at the end of the arm
 
-async def controller(odrive):
+# Use the table fitted to a logged trial if there is one (GravityCompensationTable.fit_from_database(...).save(...)),
+# otherwise build it from the arm parameters above.
+gravity_table = GravityCompensationTable.load('gravity_table.json') or \
+    GravityCompensationTable.from_links([Link(mass=mass, length=length, payload=payload)], gravity=9.8)
+
+async def controller(odrive, telemetry):
     await asyncio.sleep(1)
 
     #Run for set time delay example runs for 15 seconds.
@@ -21,22 +29,27 @@ async def controller(odrive):
         # Convert normalized position to radians (0 to 2pi)
         current_position_rad = normalized_position * 2 * math.pi
 
-        # Calculate next torque
-        next_torque = math.sin(current_position_rad) * mass * length * 9.8
+        # Look up next torque in the precomputed gravity table (with the fitted bias and friction if loaded)
+        next_torque = gravity_table.torque(current_position_rev, odrive.velocity)
 
         # Limit next_torque to between -0.129 and 0.129
         next_torque = max(-0.2, min(0.2, next_torque))
         
         # Set the calculated torque
         odrive.set_torque(next_torque) 
-        print(f"Normalized position {normalized_position} (revs), Current Position {current_position_rad} (rad), Torque Set to {next_torque} (Nm)")
+        telemetry.log(normalized_position, current_position_rad, next_torque)
 
         await asyncio.sleep(0.0015)  # 15ms sleep, adjust based on your control loop requirements
 
+    telemetry.running = False
+
 
 #Set up Node_ID 10 ACTIV NODE ID = 10
 odrive = pyodrivecan.ODriveCAN(0)
 
+#Console output at 5 lines per second instead of every cycle
+telemetry = TelemetryLogger(("Normalized position (revs)", "Current Position (rad)", "Torque Set to (Nm)"), display_rate=5)
+
 # Run multiple busses.
 async def main():
     odrive.clear_errors(identify=False)
@@ -59,7 +72,8 @@ async def main():
     #add each odrive to the async loop so they will run.
     await asyncio.gather(
         odrive.loop(),
-        controller(odrive) 
+        controller(odrive, telemetry),
+        telemetry.loop()
     )
 
 
@@ -69,4 +83,5 @@ if __name__ == "__main__":
     except KeyboardInterrupt:
         print("KeyboardInterrupt caught, stopping...")
         odrive.estop()
+        print(telemetry.summary())
         
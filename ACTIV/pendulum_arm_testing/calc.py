@@ -1,5 +1,6 @@
 import matplotlib.pyplot as plt
 import numpy as np
+from gravity_table import GravityCompensationTable
 
 def calculate_force(mass, g, angle_radians):
     """
@@ -32,8 +33,8 @@ g = 9.81  # Acceleration due to gravity in m/s^2
 angles_degrees = np.linspace(0, 360, 360)
 angles_radians = np.radians(angles_degrees)
 
-# Calculating force for each angle
-forces = [calculate_force(mass, g, angle) for angle in angles_radians]
+# Calculating force for each angle (vectorised, calculate_force works on the whole array)
+forces = calculate_force(mass, g, angles_radians)
 
 
 """
@@ -75,7 +76,11 @@ def calculate_torque(mass, g, arm_length, angle_radians):
 arm_length = 0.1  # 100mm converted to meters
 
 # Calculating torque for each angle
-torques = [calculate_torque(mass, g, arm_length, angle) for angle in angles_radians]
+torques = calculate_torque(mass, g, arm_length, angles_radians)
+
+# Torque the live controller commands, from the table it loads (1dof_gravity_compensation.py), if one has been fitted
+gravity_table = GravityCompensationTable.load('gravity_table.json')
+table_torques = gravity_table.evaluate(angles_degrees / 360.0) if gravity_table is not None else None
 
 # Plotting force and torque on the same graph for comparison
 fig, ax1 = plt.subplots(figsize=(10, 6))
@@ -90,6 +95,8 @@ ax2 = ax1.twinx()  # instantiate a second axes that shares the same x-axis
 color = 'tab:blue'
 ax2.set_ylabel('Torque (Nm)', color=color)  # we already handled the x-label with ax1
 ax2.plot(angles_degrees, torques, color=color, label='Torque')
+if table_torques is not None:
+    ax2.plot(angles_degrees, table_torques, color='tab:green', linestyle='--', label='Torque (gravity_table.json)')
 ax2.tick_params(axis='y', labelcolor=color)
 
 fig.tight_layout()  # otherwise the right y-label is slightly clipped
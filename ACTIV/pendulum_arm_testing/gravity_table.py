@@ -0,0 +1,408 @@
+import json
+import math
+import os
+from dataclasses import dataclass
+
+import numpy as np
+
+
+@dataclass
+class Link:
+    """
+    One link of the arm, measured from the joint that drives it.
+
+    Attributes:
+    - mass: Mass of the link itself [kg].
+    - length: Distance from this joint to the next joint (or to the end of the arm) [m].
+    - com: Distance from this joint to the centre of mass of the link [m], default is `length` (point mass at the end,
+      the same model as `mass * length * 9.8` in 1dof_gravity_compensation.py).
+    - payload: Extra point mass at the end of the link [kg], e.g. the weights bolted to the end of the arm.
+    """
+    mass: float
+    length: float
+    com: float = None
+    payload: float = 0.0
+
+
+
+class GravityCompensationTable:
+    """
+    Precomputed gravity feed-forward torque vs. joint position.
+
+    For a serial arm hanging straight down at position 0 the gravity torque on joint j is
+
+        tau_j = sum over links i >= j of  C_i * sin(2 pi (phi_i + offset_i))
+
+    where phi_i is the absolute angle of link i in turns (the sum of the joint positions up to i) and C_i is the
+    moment of everything that link i carries: its own mass at its centre of mass, its payload and every link after it at
+    its full length. The sine of every link is tabulated once at start-up with NumPy (C_i * sin on a `resolution`
+    point grid over one turn), so a lookup in the control loop is one index and one linear interpolation per link.
+    torque() uses the pre-summed table of all links with the base joint bias folded in, so its cost stays the same
+    whatever the model (fitted offsets, bias, payloads, several links). It is not faster than the inline
+    `sin * mass * length * 9.8` formula in CPython (the method call and interpolation cost about 1.5x the single
+    math.sin), the point is one code path for every model and the same numbers from evaluate() on logged data.
+
+    A fitted table also adds bias_j to every joint and friction_j * sign(velocity_j) when velocities are passed in.
+
+    Positions are in turns, the same as odrive.position, so the controller can pass them in directly.
+
+    Attributes:
+    - coefficients (list): C_i per link [Nm].
+    - offsets (list): Angle offset per link [turns], 0 if position 0 is exactly hanging down.
+    - resolution (int): Number of table points over one turn.
+    - table (np.ndarray): (links x resolution + 2) tabulated torque per link, for plotting / vectorised use.
+    - friction (list): Coulomb friction per joint [Nm] if the table was fitted with velocities, otherwise zeros.
+    - bias (list): Constant torque offset per joint [Nm] found by fit(), otherwise zeros. Read only, the lookup tables
+      are built with it.
+    """
+    __slots__ = ("coefficients", "offsets", "resolution", "table", "friction", "bias", "_rows", "_total_row")
+
+    def __init__(self, coefficients, offsets=None, resolution=4096, friction=None, bias=None):
+        """
+        Parameters:
+        - coefficients: C_i per link [Nm], see the class docstring.
+        - offsets: Angle offset per link [turns], default is all 0.
+        - resolution: Number of table points over one turn, default is 4096.
+        - friction: Coulomb friction per joint [Nm], default is all 0.
+        - bias: Constant torque offset per joint [Nm], default is all 0.
+        """
+        n = len(coefficients)
+        self.coefficients = [float(c) for c in coefficients]
+        self.offsets = [float(o) for o in offsets] if offsets is not None else [0.0] * n
+        self.friction = [float(f) for f in friction] if friction is not None else [0.0] * n
+        self.bias = [float(b) for b in bias] if bias is not None else [0.0] * n
+        if not len(self.offsets) == len(self.friction) == len(self.bias) == n:
+            raise ValueError("Need one offset, friction and bias per link")
+        self.resolution = resolution
+
+        # Two extra points so index i + 1 is always valid, even when position % 1.0 rounds up to 1.0
+        grid = np.arange(resolution + 2) / resolution
+        phase = 2.0 * np.pi * (grid[np.newaxis, :] + np.asarray(self.offsets)[:, np.newaxis])
+        self.table = np.asarray(self.coefficients)[:, np.newaxis] * np.sin(phase)
+
+        # Plain Python lists for the scalar lookups, indexing a list is much cheaper than indexing a NumPy array
+        self._rows = [row.tolist() for row in self.table]
+        self._total_row = (self.table.sum(axis=0) + self.bias[0]).tolist()
+
+
+#---------------------------------------- Constructors START -------------------------------------------------
+
+    @classmethod
+    def from_links(cls, links, gravity=9.8, resolution=4096):
+        """
+        Builds the table from the physical parameters of the arm.
+
+        Parameters:
+        - links: List of Link, from the base joint outwards.
+        - gravity: Gravitational acceleration [m/s^2], default is 9.8.
+        - resolution: Number of table points over one turn.
+
+        Example:
+            >>> table = GravityCompensationTable.from_links([Link(mass=0.12, length=0.11)])
+            >>> torque = table.torque(odrive.position)
+        """
+        coefficients = []
+        mass_beyond = 0.0
+        for link in reversed(links):
+            com = link.length if link.com is None else link.com
+            coefficients.append(gravity * (link.mass * com + (link.payload + mass_beyond) * link.length))
+            mass_beyond += link.mass + link.payload
+        coefficients.reverse()
+        return cls(coefficients, resolution=resolution)
+
+
+    @classmethod
+    def fit(cls, positions, torques, velocities=None, max_velocity=None, resolution=4096):
+        """
+        Fits the coefficients and offsets to logged joint positions and torques with least squares.
+
+        Every joint contributes one equation per sample: tau_j = sum_(i >= j) (a_i sin(phi_i) + b_i cos(phi_i)) + bias_j
+        (+ friction_j * sign(velocity_j) if velocities are given), which is linear in a, b, bias and friction. The
+        coefficient and offset of each link come from a_i and b_i.
+
+        Parameters:
+        - positions: (samples,) or (samples x joints) joint positions [turns].
+        - torques: Same shape, measured joint torques [Nm] (e.g. ODriveData.torque_estimate).
+        - velocities: Same shape, joint velocities [turns/s], optional. Adds a coulomb friction term per joint.
+        - max_velocity: Only use samples where every joint is slower than this [turns/s], needs velocities.
+        - resolution: Number of table points over one turn.
+
+        Returns:
+        - The fitted GravityCompensationTable.
+        """
+        positions = np.asarray(positions, dtype=np.float64)
+        torques = np.asarray(torques, dtype=np.float64)
+        if positions.ndim == 1:
+            positions = positions[:, np.newaxis]
+            torques = torques[:, np.newaxis]
+        if velocities is not None:
+            velocities = np.asarray(velocities, dtype=np.float64).reshape(positions.shape)
+            if max_velocity is not None:
+                keep = np.all(np.abs(velocities) < max_velocity, axis=1)
+                positions, torques, velocities = positions[keep], torques[keep], velocities[keep]
+
+        samples, n = positions.shape
+        if samples < 3 * n:
+            raise ValueError(f"Not enough samples to fit {n} link(s): {samples}")
+
+        phase = 2.0 * np.pi * np.cumsum(positions, axis=1)
+        sin_phi = np.sin(phase)
+        cos_phi = np.cos(phase)
+
+        # Columns: a_0..a_n-1, b_0..b_n-1, bias_0..bias_n-1 [, friction_0..friction_n-1]
+        columns = 4 * n if velocities is not None else 3 * n
+        design = np.zeros((samples, n, columns))
+        for j in range(n):
+            design[:, j, j:n] = sin_phi[:, j:]
+            design[:, j, n + j:2 * n] = cos_phi[:, j:]
+            design[:, j, 2 * n + j] = 1.0
+            if velocities is not None:
+                design[:, j, 3 * n + j] = np.sign(velocities[:, j])
+
+        solution, _, _, _ = np.linalg.lstsq(design.reshape(samples * n, columns), torques.reshape(samples * n), rcond=None)
+        a = solution[:n]
+        b = solution[n:2 * n]
+        friction = solution[3 * n:4 * n] if velocities is not None else None
+        return cls(np.hypot(a, b), np.arctan2(b, a) / (2.0 * np.pi), resolution, friction, solution[2 * n:3 * n])
+
+
+    @classmethod
+    def fit_from_database(cls, database, trial_id, node_id=None, max_velocity=None, resolution=4096):
+        """
+        Fits a single joint table to the ODriveData rows of one logged trial.
+
+        Parameters:
+        - database: pyodrivecan.OdriveDatabase (anything with fetch(sql, params)).
+        - trial_id: Trial to fit to.
+        - node_id: Only use rows from this O-Drive node, default is all rows of the trial.
+        - max_velocity: Only use samples slower than this [turns/s], default uses every sample.
+        - resolution: Number of table points over one turn.
+
+        Example:
+            >>> table = GravityCompensationTable.fit_from_database(pyodrivecan.OdriveDatabase('odrive_data.db'), 12)
+            >>> table.save('gravity_table.json')
+        """
+        sql = "SELECT position, velocity, torque_estimate FROM ODriveData WHERE trial_id = ?"
+        params = [trial_id]
+        if node_id is not None:
+            sql += " AND node_ID = ?"
+            params.append(str(node_id))
+        rows = [row for row in database.fetch(sql, tuple(params)) if None not in row]
+        if not rows:
+            raise ValueError(f"No ODriveData rows with position, velocity and torque_estimate for trial {trial_id}")
+        data = np.asarray(rows, dtype=np.float64)
+        return cls.fit(data[:, 0], data[:, 2], velocities=data[:, 1], max_velocity=max_velocity, resolution=resolution)
+
+#---------------------------------------- Constructors END -------------------------------------------------
+
+
+#---------------------------------------- Persistence START -------------------------------------------------
+
+    def save(self, path):
+        """Saves the coefficients, offsets and fit results to a JSON file."""
+        data = {
+            "coefficients": self.coefficients,
+            "offsets": self.offsets,
+            "friction": self.friction,
+            "bias": self.bias,
+            "resolution": self.resolution,
+        }
+        with open(path, "w") as fp:
+            json.dump(data, fp, indent=4)
+
+
+    @classmethod
+    def load(cls, path):
+        """
+        Loads a table saved with save().
+
+        Returns:
+        - The GravityCompensationTable, or None if the file does not exist.
+        """
+        if not os.path.exists(path):
+            return None
+        with open(path) as fp:
+            data = json.load(fp)
+        return cls(data["coefficients"], data.get("offsets"), data.get("resolution", 4096), data.get("friction"),
+                   data.get("bias"))
+
+#---------------------------------------- Persistence END -------------------------------------------------
+
+
+#---------------------------------------- Lookups START -------------------------------------------------
+
+    def torque(self, position, velocity=0.0):
+        """
+        Gravity torque on a single joint arm (or the base joint with every other joint at 0), plus the fitted bias and
+        friction.
+
+        Parameters:
+        - position: Joint position [turns], any value (wrapped to one turn).
+        - velocity: Joint velocity [turns/s], default is 0 (no friction term).
+
+        Returns:
+        - Feed-forward torque [Nm].
+
+        Example:
+            >>> next_torque = table.torque(odrive.position, odrive.velocity)
+        """
+        x = (position % 1.0) * self.resolution
+        i = int(x)
+        row = self._total_row
+        low = row[i]
+        tau = low + (x - i) * (row[i + 1] - low)
+        if velocity:
+            return tau + math.copysign(self.friction[0], velocity)
+        return tau
+
+
+    def torques(self, positions, velocities=None):
+        """
+        Gravity torque on every joint of a multi-link arm, plus the fitted bias and friction.
+
+        Parameters:
+        - positions: Joint positions [turns] from the base joint outwards.
+        - velocities: Joint velocities [turns/s], default is None (no friction term).
+
+        Returns:
+        - List of feed-forward torques [Nm], one per joint.
+        """
+        n = len(self._rows)
+        resolution = self.resolution
+        link_torques = [0.0] * n
+        phi = 0.0
+        for k in range(n):
+            phi += positions[k]
+            x = (phi % 1.0) * resolution
+            i = int(x)
+            row = self._rows[k]
+            low = row[i]
+            link_torques[k] = low + (x - i) * (row[i + 1] - low)
+
+        # tau_j is the sum of the link terms from j outwards
+        bias = self.bias
+        total = 0.0
+        for k in range(n - 1, -1, -1):
+            total += link_torques[k]
+            link_torques[k] = total + bias[k]
+        if velocities is not None:
+            friction = self.friction
+            for k in range(n):
+                if velocities[k]:
+                    link_torques[k] += math.copysign(friction[k], velocities[k])
+        return link_torques
+
+
+    def evaluate(self, positions, velocities=None):
+        """
+        Vectorised version of torque() / torques() for whole arrays, uses the same tables, interpolation, bias and
+        friction.
+
+        Parameters:
+        - positions: (samples,) positions of a single joint arm, or (samples x joints) [turns].
+        - velocities: Same shape, joint velocities [turns/s], default is None (no friction term).
+
+        Returns:
+        - Gravity torques [Nm] with the same shape as positions.
+
+        Example:
+            >>> torques = table.evaluate(np.linspace(0, 1, 360))
+        """
+        positions = np.asarray(positions, dtype=np.float64)
+        single = positions.ndim == 1
+        phi = positions[:, np.newaxis] if single else np.cumsum(positions, axis=1)
+        if single:
+            phi = np.repeat(phi, len(self._rows), axis=1)
+
+        x = np.mod(phi, 1.0) * self.resolution
+        i = x.astype(np.intp)
+        link = np.arange(len(self._rows))[np.newaxis, :]
+        low = self.table[link, i]
+        link_torques = low + (x - i) * (self.table[link, i + 1] - low)
+
+        if single:
+            result = link_torques.sum(axis=1) + self.bias[0]
+            if velocities is not None:
+                result = result + self.friction[0] * np.sign(np.asarray(velocities, dtype=np.float64))
+            return result
+        result = np.cumsum(link_torques[:, ::-1], axis=1)[:, ::-1] + np.asarray(self.bias)
+        if velocities is not None:
+            result = result + np.asarray(self.friction) * np.sign(np.asarray(velocities, dtype=np.float64))
+        return result
+
+#---------------------------------------- Lookups END -------------------------------------------------
+
+
+
+if __name__ == "__main__":
+    import time
+
+    # Single link, same parameters as 1dof_gravity_compensation.py
+    mass = 0.12
+    length = 0.11
+    table = GravityCompensationTable.from_links([Link(mass=mass, length=length)], gravity=9.8)
+
+    positions = np.linspace(-2.0, 2.0, 100001)
+    exact = np.sin(positions * 2 * math.pi) * mass * length * 9.8
+    print(f"Max table error (vectorised): {np.abs(table.evaluate(positions) - exact).max():.2e} Nm")
+    print(f"Max table error (scalar): {max(abs(table.torque(p) - e) for p, e in zip(positions[::100], exact[::100])):.2e} Nm")
+
+    n = 200000
+    start = time.perf_counter()
+    for k in range(n):
+        math.sin((k * 1e-5 % 1) * 2 * math.pi) * mass * length * 9.8
+    direct_cost = (time.perf_counter() - start) / n
+    start = time.perf_counter()
+    for k in range(n):
+        table.torque(k * 1e-5)
+    table_cost = (time.perf_counter() - start) / n
+    print(f"Per call: math.sin model {direct_cost * 1e6:.3f} us, table lookup {table_cost * 1e6:.3f} us")
+
+    # Two link arm with a payload, scalar against vectorised and against the direct sum
+    links = [Link(mass=0.10, length=0.20, com=0.10), Link(mass=0.05, length=0.15, payload=0.08)]
+    table2 = GravityCompensationTable.from_links(links, gravity=9.81)
+    q = np.random.default_rng(0).uniform(-1, 1, size=(1000, 2))
+    phi = np.cumsum(q, axis=1) * 2 * math.pi
+    direct = np.empty_like(q)
+    direct[:, 1] = 9.81 * (0.05 * 0.15 + 0.08 * 0.15) * np.sin(phi[:, 1])
+    direct[:, 0] = 9.81 * (0.10 * 0.10 + (0.05 + 0.08) * 0.20) * np.sin(phi[:, 0]) + direct[:, 1]
+    scalar = np.array([table2.torques(row) for row in q])
+    print(f"Two link: max error {np.abs(table2.evaluate(q) - direct).max():.2e} Nm, "
+          f"scalar vs vectorised {np.abs(scalar - table2.evaluate(q)).max():.2e} Nm")
+
+    # Fit from a simulated slow sweep with friction, noise and a 0.02 turn zero offset
+    rng = np.random.default_rng(1)
+    sweep = 0.4 * np.sin(np.linspace(0, 6 * math.pi, 3000))
+    sweep_velocity = np.gradient(sweep)
+    measured = (mass * length * 9.8 * np.sin(2 * math.pi * (sweep + 0.02)) + 0.01 * np.sign(sweep_velocity) + 0.005
+                + rng.normal(0, 0.002, sweep.shape))
+    fitted = GravityCompensationTable.fit(sweep, measured, velocities=sweep_velocity)
+    print(f"Fit: C {fitted.coefficients[0]:.4f} Nm (true {mass * length * 9.8:.4f}), offset {fitted.offsets[0]:.4f} turns "
+          f"(true 0.02), friction {fitted.friction[0]:.4f} Nm (true 0.01), bias {fitted.bias[0]:.4f} Nm (true 0.005)")
+
+    # The lookups apply the fitted bias and friction, scalar and vectorised agree with the measured torques
+    model = fitted.evaluate(sweep, sweep_velocity)
+    scalar = np.array([fitted.torque(p, v) for p, v in zip(sweep, sweep_velocity)])
+    residual = (model - measured).std()
+    print(f"Fit residual {residual:.4f} Nm (noise 0.002), scalar vs vectorised {np.abs(scalar - model).max():.2e} Nm")
+    assert residual < 0.003 and np.abs(scalar - model).max() < 1e-9
+    reloaded = GravityCompensationTable(fitted.coefficients, fitted.offsets, fitted.resolution, fitted.friction, fitted.bias)
+    assert abs(reloaded.torques([0.1], [-1.0])[0] - fitted.torque(0.1, -1.0)) < 1e-12
+
+
+
+"""
+Example
+
+from gravity_table import GravityCompensationTable, Link
+
+# From the arm parameters
+table = GravityCompensationTable.from_links([Link(mass=0.12, length=0.11, payload=0.09)])
+
+# Or fitted to a logged trial
+table = GravityCompensationTable.fit_from_database(pyodrivecan.OdriveDatabase('odrive_data.db'), trial_id=12)
+table.save('gravity_table.json')
+
+while True:
+    odrive.set_torque(table.torque(odrive.position, odrive.velocity))
+"""
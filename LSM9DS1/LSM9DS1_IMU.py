@@ -1,7 +1,8 @@
-import smbus
 import time
 import math
 
+from i2c_backends import open_bus
+
 # LSM9DS1 I2C address
 LSM9DS1_ADDRESS = 0x1E
 
@@ -20,8 +21,8 @@ OUT_Y_H_XL = 0x2B
 OUT_Z_L_XL = 0x2C
 OUT_Z_H_XL = 0x2D
 
-# Initialize the I2C bus and LSM9DS1
-bus = smbus.SMBus(1)
+# Initialize the I2C bus and LSM9DS1 (smbus.SMBus(1) on the Pi, I2C_BACKEND=sim for the simulated sensor)
+bus = open_bus()
 
 def read_word_2c(addr):
     high = bus.read_byte_data(LSM9DS1_ADDRESS, addr)
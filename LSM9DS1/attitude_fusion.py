@@ -0,0 +1,481 @@
+import math
+import numpy as np
+
+
+#---------------------------------------- Sample Layout START -------------------------------------------------
+# Every filter in this file takes one IMU sample as 9 numbers in the order the Adafruit driver hands them back:
+#
+#   [gyro_x, gyro_y, gyro_z, accel_x, accel_y, accel_z, mag_x, mag_y, mag_z]
+#
+# - gyro in degrees/second (sensor.gyro)
+# - accel in any unit, only the direction is used (sensor.acceleration)
+# - mag in gauss, only the direction is used (sensor.magnetic). Pass zeros to run without the magnetometer.
+#
+# Logged raw data is processed the same way as an (N x 9) NumPy array with filter.batch(samples, dt).
+# The streaming step() and batch() both run through the same _update() kernel so they give identical results.
+
+GYRO_COLS = slice(0, 3)
+ACCEL_COLS = slice(3, 6)
+MAG_COLS = slice(6, 9)
+
+DEG_TO_RAD = math.pi / 180.0
+RAD_TO_DEG = 180.0 / math.pi
+
+#---------------------------------------- Sample Layout END -------------------------------------------------
+
+
+
+class AttitudeFilter:
+    """
+    Base class for the attitude filters.
+
+    Subclasses only implement _update() (one sample, gyro already in rad/s) and reset().
+    The roll, pitch and yaw estimate in degrees is kept in the preallocated self.euler list.
+    """
+    __slots__ = ("euler",)
+
+    def __init__(self):
+        self.euler = [0.0, 0.0, 0.0]  # roll, pitch, yaw in degrees
+
+
+    def reset(self):
+        """Resets the filter state back to level."""
+        self.euler[0] = 0.0
+        self.euler[1] = 0.0
+        self.euler[2] = 0.0
+
+
+    def _update(self, gx, gy, gz, ax, ay, az, mx, my, mz, dt):
+        raise NotImplementedError
+
+
+    def step(self, sample, dt):
+        """
+        Runs the filter on one streaming IMU sample.
+
+        Parameters:
+        - sample: 9 values [gx, gy, gz, ax, ay, az, mx, my, mz] (gyro in deg/s).
+        - dt: Time since the previous sample in seconds.
+
+        Returns:
+        - (roll, pitch, yaw) in degrees.
+
+        Example:
+            >>> imu_filter = ComplementaryFilter(alpha=0.98)
+            >>> roll, pitch, yaw = imu_filter.step(sensor.gyro + sensor.acceleration + sensor.magnetic, dt)
+        """
+        gx, gy, gz, ax, ay, az, mx, my, mz = sample
+        self._update(gx * DEG_TO_RAD, gy * DEG_TO_RAD, gz * DEG_TO_RAD, ax, ay, az, mx, my, mz, dt)
+        euler = self.euler
+        return euler[0], euler[1], euler[2]
+
+
+    def batch(self, samples, dt, out=None):
+        """
+        Runs the filter over a block of logged raw IMU samples.
+
+        The unit conversion is done once on the whole array, then the recursive part of the filter walks the rows.
+        The filter state carries on from (and is left at) the last sample so blocks can be chained.
+
+        Parameters:
+        - samples: (N x 9) array of raw samples in the layout described at the top of this file.
+        - dt: Sample period in seconds, either one number or an array of N periods.
+        - out: Optional preallocated (N x 3) float64 array for the results.
+
+        Returns:
+        - (N x 3) array of roll, pitch, yaw in degrees.
+
+        Example:
+            >>> angles = MadgwickFilter(beta=0.05).batch(raw_imu, 1 / 952)
+        """
+        samples = np.asarray(samples, dtype=np.float64)
+        if samples.ndim != 2 or samples.shape[1] != 9:
+            raise ValueError(f"Expected an (N x 9) array of IMU samples, got shape {samples.shape}")
+        n = samples.shape[0]
+
+        if out is None:
+            out = np.empty((n, 3), dtype=np.float64)
+
+        # Vectorised unit conversion, bit for bit the same as the per-sample multiply in step()
+        work = samples.copy()
+        work[:, GYRO_COLS] *= DEG_TO_RAD
+
+        dts = np.broadcast_to(np.asarray(dt, dtype=np.float64), (n,)).tolist()
+        rows = work.tolist()
+
+        update = self._update
+        euler = self.euler
+        for i in range(n):
+            gx, gy, gz, ax, ay, az, mx, my, mz = rows[i]
+            update(gx, gy, gz, ax, ay, az, mx, my, mz, dts[i])
+            out[i, 0] = euler[0]
+            out[i, 1] = euler[1]
+            out[i, 2] = euler[2]
+
+        return out
+
+
+
+#---------------------------------------- Complementary Filter START -------------------------------------------------
+
+class ComplementaryFilter(AttitudeFilter):
+    """
+    The complementary filter from LSM9DS1_threading.py / measure_all.py without the global variables.
+
+    Pitch and roll keep the axis pairing used on the rig (pitch integrates gyro_x, roll integrates gyro_y).
+    Yaw is the tilt compensated magnetometer heading from calculate_yaw_pitch_roll() in LSM9DS1_IMU.py,
+    it stays at 0 if the magnetometer columns are all zero.
+
+    Parameters:
+    - alpha: Weight given to the integrated gyro angle, default is 0.98.
+    """
+    __slots__ = ("alpha",)
+
+    def __init__(self, alpha=0.98):
+        super().__init__()
+        self.alpha = alpha
+
+
+    def _update(self, gx, gy, gz, ax, ay, az, mx, my, mz, dt):
+        euler = self.euler
+        alpha = self.alpha
+
+        pitch_acc = math.atan2(ax, math.sqrt(ay * ay + az * az)) * RAD_TO_DEG
+        roll_acc = math.atan2(ay, az) * RAD_TO_DEG
+
+        # gx/gy come in as rad/s, the angles are kept in degrees like the original scripts
+        pitch_gyro = euler[1] + gx * RAD_TO_DEG * dt
+        roll_gyro = euler[0] + gy * RAD_TO_DEG * dt
+
+        roll = alpha * roll_gyro + (1 - alpha) * roll_acc
+        pitch = alpha * pitch_gyro + (1 - alpha) * pitch_acc
+        euler[0] = roll
+        euler[1] = pitch
+
+        if mx != 0.0 or my != 0.0 or mz != 0.0:
+            roll_rad = roll * DEG_TO_RAD
+            pitch_rad = pitch * DEG_TO_RAD
+            euler[2] = math.atan2(
+                mx * math.cos(roll_rad) + my * math.sin(roll_rad),
+                mx * math.cos(pitch_rad) * math.sin(roll_rad) + my * math.cos(pitch_rad) * math.cos(roll_rad) - mz * math.sin(pitch_rad)
+            ) * RAD_TO_DEG
+
+#---------------------------------------- Complementary Filter END -------------------------------------------------
+
+
+
+#---------------------------------------- Quaternion Filters START -------------------------------------------------
+
+class QuaternionAttitudeFilter(AttitudeFilter):
+    """
+    Base class for the filters that keep the attitude as a unit quaternion (w, x, y, z).
+    """
+    __slots__ = ("q0", "q1", "q2", "q3")
+
+    def __init__(self):
+        super().__init__()
+        self.q0 = 1.0
+        self.q1 = 0.0
+        self.q2 = 0.0
+        self.q3 = 0.0
+
+
+    def reset(self):
+        """Resets the filter state back to level."""
+        super().reset()
+        self.q0 = 1.0
+        self.q1 = 0.0
+        self.q2 = 0.0
+        self.q3 = 0.0
+
+
+    def _store_euler(self, q0, q1, q2, q3):
+        """Normalises and stores the quaternion, then writes roll, pitch, yaw (degrees) into self.euler."""
+        recip_norm = 1.0 / math.sqrt(q0 * q0 + q1 * q1 + q2 * q2 + q3 * q3)
+        q0 *= recip_norm
+        q1 *= recip_norm
+        q2 *= recip_norm
+        q3 *= recip_norm
+        self.q0 = q0
+        self.q1 = q1
+        self.q2 = q2
+        self.q3 = q3
+
+        euler = self.euler
+        euler[0] = math.atan2(2.0 * (q0 * q1 + q2 * q3), 1.0 - 2.0 * (q1 * q1 + q2 * q2)) * RAD_TO_DEG
+        sin_pitch = 2.0 * (q0 * q2 - q3 * q1)
+        sin_pitch = -1.0 if sin_pitch < -1.0 else 1.0 if sin_pitch > 1.0 else sin_pitch
+        euler[1] = math.asin(sin_pitch) * RAD_TO_DEG
+        euler[2] = math.atan2(2.0 * (q0 * q3 + q1 * q2), 1.0 - 2.0 * (q2 * q2 + q3 * q3)) * RAD_TO_DEG
+
+
+
+class MadgwickFilter(QuaternionAttitudeFilter):
+    """
+    Madgwick gradient descent orientation filter (IMU and MARG versions).
+
+    The MARG version is used when the magnetometer columns are non-zero, otherwise only gyro + accel are fused.
+
+    Parameters:
+    - beta: Gradient descent step gain, default is 0.1.
+    """
+    __slots__ = ("beta",)
+
+    def __init__(self, beta=0.1):
+        super().__init__()
+        self.beta = beta
+
+
+    def _update(self, gx, gy, gz, ax, ay, az, mx, my, mz, dt):
+        q0 = self.q0
+        q1 = self.q1
+        q2 = self.q2
+        q3 = self.q3
+        beta = self.beta
+
+        # Rate of change of quaternion from gyroscope
+        q_dot1 = 0.5 * (-q1 * gx - q2 * gy - q3 * gz)
+        q_dot2 = 0.5 * (q0 * gx + q2 * gz - q3 * gy)
+        q_dot3 = 0.5 * (q0 * gy - q1 * gz + q3 * gx)
+        q_dot4 = 0.5 * (q0 * gz + q1 * gy - q2 * gx)
+
+        accel_norm = math.sqrt(ax * ax + ay * ay + az * az)
+        if accel_norm > 0.0:
+            ax /= accel_norm
+            ay /= accel_norm
+            az /= accel_norm
+
+            mag_norm = math.sqrt(mx * mx + my * my + mz * mz)
+            if mag_norm > 0.0:
+                mx /= mag_norm
+                my /= mag_norm
+                mz /= mag_norm
+
+                _2q0mx = 2.0 * q0 * mx
+                _2q0my = 2.0 * q0 * my
+                _2q0mz = 2.0 * q0 * mz
+                _2q1mx = 2.0 * q1 * mx
+                _2q0 = 2.0 * q0
+                _2q1 = 2.0 * q1
+                _2q2 = 2.0 * q2
+                _2q3 = 2.0 * q3
+                _2q0q2 = 2.0 * q0 * q2
+                _2q2q3 = 2.0 * q2 * q3
+                q0q0 = q0 * q0
+                q0q1 = q0 * q1
+                q0q2 = q0 * q2
+                q0q3 = q0 * q3
+                q1q1 = q1 * q1
+                q1q2 = q1 * q2
+                q1q3 = q1 * q3
+                q2q2 = q2 * q2
+                q2q3 = q2 * q3
+                q3q3 = q3 * q3
+
+                # Reference direction of Earth's magnetic field
+                hx = mx * q0q0 - _2q0my * q3 + _2q0mz * q2 + mx * q1q1 + _2q1 * my * q2 + _2q1 * mz * q3 - mx * q2q2 - mx * q3q3
+                hy = _2q0mx * q3 + my * q0q0 - _2q0mz * q1 + _2q1mx * q2 - my * q1q1 + my * q2q2 + _2q2 * mz * q3 - my * q3q3
+                _2bx = math.sqrt(hx * hx + hy * hy)
+                _2bz = -_2q0mx * q2 + _2q0my * q1 + mz * q0q0 + _2q1mx * q3 - mz * q1q1 + _2q2 * my * q3 - mz * q2q2 + mz * q3q3
+                _4bx = 2.0 * _2bx
+                _4bz = 2.0 * _2bz
+
+                # Gradient descent corrective step
+                s0 = (-_2q2 * (2.0 * q1q3 - _2q0q2 - ax) + _2q1 * (2.0 * q0q1 + _2q2q3 - ay)
+                      - _2bz * q2 * (_2bx * (0.5 - q2q2 - q3q3) + _2bz * (q1q3 - q0q2) - mx)
+                      + (-_2bx * q3 + _2bz * q1) * (_2bx * (q1q2 - q0q3) + _2bz * (q0q1 + q2q3) - my)
+                      + _2bx * q2 * (_2bx * (q0q2 + q1q3) + _2bz * (0.5 - q1q1 - q2q2) - mz))
+                s1 = (_2q3 * (2.0 * q1q3 - _2q0q2 - ax) + _2q0 * (2.0 * q0q1 + _2q2q3 - ay)
+                      - 4.0 * q1 * (1 - 2.0 * q1q1 - 2.0 * q2q2 - az)
+                      + _2bz * q3 * (_2bx * (0.5 - q2q2 - q3q3) + _2bz * (q1q3 - q0q2) - mx)
+                      + (_2bx * q2 + _2bz * q0) * (_2bx * (q1q2 - q0q3) + _2bz * (q0q1 + q2q3) - my)
+                      + (_2bx * q3 - _4bz * q1) * (_2bx * (q0q2 + q1q3) + _2bz * (0.5 - q1q1 - q2q2) - mz))
+                s2 = (-_2q0 * (2.0 * q1q3 - _2q0q2 - ax) + _2q3 * (2.0 * q0q1 + _2q2q3 - ay)
+                      - 4.0 * q2 * (1 - 2.0 * q1q1 - 2.0 * q2q2 - az)
+                      + (-_4bx * q2 - _2bz * q0) * (_2bx * (0.5 - q2q2 - q3q3) + _2bz * (q1q3 - q0q2) - mx)
+                      + (_2bx * q1 + _2bz * q3) * (_2bx * (q1q2 - q0q3) + _2bz * (q0q1 + q2q3) - my)
+                      + (_2bx * q0 - _4bz * q2) * (_2bx * (q0q2 + q1q3) + _2bz * (0.5 - q1q1 - q2q2) - mz))
+                s3 = (_2q1 * (2.0 * q1q3 - _2q0q2 - ax) + _2q2 * (2.0 * q0q1 + _2q2q3 - ay)
+                      + (-_4bx * q3 + _2bz * q1) * (_2bx * (0.5 - q2q2 - q3q3) + _2bz * (q1q3 - q0q2) - mx)
+                      + (-_2bx * q0 + _2bz * q2) * (_2bx * (q1q2 - q0q3) + _2bz * (q0q1 + q2q3) - my)
+                      + _2bx * q1 * (_2bx * (q0q2 + q1q3) + _2bz * (0.5 - q1q1 - q2q2) - mz))
+            else:
+                _2q0 = 2.0 * q0
+                _2q1 = 2.0 * q1
+                _2q2 = 2.0 * q2
+                _2q3 = 2.0 * q3
+                _4q0 = 4.0 * q0
+                _4q1 = 4.0 * q1
+                _4q2 = 4.0 * q2
+                _8q1 = 8.0 * q1
+                _8q2 = 8.0 * q2
+                q0q0 = q0 * q0
+                q1q1 = q1 * q1
+                q2q2 = q2 * q2
+                q3q3 = q3 * q3
+
+                s0 = _4q0 * q2q2 + _2q2 * ax + _4q0 * q1q1 - _2q1 * ay
+                s1 = _4q1 * q3q3 - _2q3 * ax + 4.0 * q0q0 * q1 - _2q0 * ay - _4q1 + _8q1 * q1q1 + _8q1 * q2q2 + _4q1 * az
+                s2 = 4.0 * q0q0 * q2 + _2q0 * ax + _4q2 * q3q3 - _2q3 * ay - _4q2 + _8q2 * q1q1 + _8q2 * q2q2 + _4q2 * az
+                s3 = 4.0 * q1q1 * q3 - _2q1 * ax + 4.0 * q2q2 * q3 - _2q2 * ay
+
+            step_norm = math.sqrt(s0 * s0 + s1 * s1 + s2 * s2 + s3 * s3)
+            if step_norm > 0.0:
+                q_dot1 -= beta * s0 / step_norm
+                q_dot2 -= beta * s1 / step_norm
+                q_dot3 -= beta * s2 / step_norm
+                q_dot4 -= beta * s3 / step_norm
+
+        self._store_euler(q0 + q_dot1 * dt, q1 + q_dot2 * dt, q2 + q_dot3 * dt, q3 + q_dot4 * dt)
+
+
+
+class MahonyFilter(QuaternionAttitudeFilter):
+    """
+    Mahony explicit complementary filter with proportional and integral feedback (IMU and MARG versions).
+
+    Parameters:
+    - kp: Proportional feedback gain, default is 1.0.
+    - ki: Integral feedback gain, default is 0.0 (integral term disabled).
+    """
+    __slots__ = ("kp", "ki", "integral_fb_x", "integral_fb_y", "integral_fb_z")
+
+    def __init__(self, kp=1.0, ki=0.0):
+        super().__init__()
+        self.kp = kp
+        self.ki = ki
+        self.integral_fb_x = 0.0
+        self.integral_fb_y = 0.0
+        self.integral_fb_z = 0.0
+
+
+    def reset(self):
+        """Resets the filter state back to level and clears the integral feedback."""
+        super().reset()
+        self.integral_fb_x = 0.0
+        self.integral_fb_y = 0.0
+        self.integral_fb_z = 0.0
+
+
+    def _update(self, gx, gy, gz, ax, ay, az, mx, my, mz, dt):
+        q0 = self.q0
+        q1 = self.q1
+        q2 = self.q2
+        q3 = self.q3
+
+        accel_norm = math.sqrt(ax * ax + ay * ay + az * az)
+        if accel_norm > 0.0:
+            ax /= accel_norm
+            ay /= accel_norm
+            az /= accel_norm
+
+            # Estimated direction of gravity
+            half_vx = q1 * q3 - q0 * q2
+            half_vy = q0 * q1 + q2 * q3
+            half_vz = q0 * q0 - 0.5 + q3 * q3
+
+            half_ex = ay * half_vz - az * half_vy
+            half_ey = az * half_vx - ax * half_vz
+            half_ez = ax * half_vy - ay * half_vx
+
+            mag_norm = math.sqrt(mx * mx + my * my + mz * mz)
+            if mag_norm > 0.0:
+                mx /= mag_norm
+                my /= mag_norm
+                mz /= mag_norm
+
+                q0q0 = q0 * q0
+                q0q1 = q0 * q1
+                q0q2 = q0 * q2
+                q0q3 = q0 * q3
+                q1q1 = q1 * q1
+                q1q2 = q1 * q2
+                q1q3 = q1 * q3
+                q2q2 = q2 * q2
+                q2q3 = q2 * q3
+                q3q3 = q3 * q3
+
+                # Reference direction of Earth's magnetic field
+                hx = 2.0 * (mx * (0.5 - q2q2 - q3q3) + my * (q1q2 - q0q3) + mz * (q1q3 + q0q2))
+                hy = 2.0 * (mx * (q1q2 + q0q3) + my * (0.5 - q1q1 - q3q3) + mz * (q2q3 - q0q1))
+                bx = math.sqrt(hx * hx + hy * hy)
+                bz = 2.0 * (mx * (q1q3 - q0q2) + my * (q2q3 + q0q1) + mz * (0.5 - q1q1 - q2q2))
+
+                # Estimated direction of magnetic field
+                half_wx = bx * (0.5 - q2q2 - q3q3) + bz * (q1q3 - q0q2)
+                half_wy = bx * (q1q2 - q0q3) + bz * (q0q1 + q2q3)
+                half_wz = bx * (q0q2 + q1q3) + bz * (0.5 - q1q1 - q2q2)
+
+                half_ex += my * half_wz - mz * half_wy
+                half_ey += mz * half_wx - mx * half_wz
+                half_ez += mx * half_wy - my * half_wx
+
+            if self.ki > 0.0:
+                self.integral_fb_x += 2.0 * self.ki * half_ex * dt
+                self.integral_fb_y += 2.0 * self.ki * half_ey * dt
+                self.integral_fb_z += 2.0 * self.ki * half_ez * dt
+                gx += self.integral_fb_x
+                gy += self.integral_fb_y
+                gz += self.integral_fb_z
+
+            gx += 2.0 * self.kp * half_ex
+            gy += 2.0 * self.kp * half_ey
+            gz += 2.0 * self.kp * half_ez
+
+        # Integrate rate of change of quaternion
+        half_dt = 0.5 * dt
+        gx *= half_dt
+        gy *= half_dt
+        gz *= half_dt
+        self._store_euler(
+            q0 + (-q1 * gx - q2 * gy - q3 * gz),
+            q1 + (q0 * gx + q2 * gz - q3 * gy),
+            q2 + (q0 * gy - q1 * gz + q3 * gx),
+            q3 + (q0 * gz + q1 * gy - q2 * gx),
+        )
+
+#---------------------------------------- Quaternion Filters END -------------------------------------------------
+
+
+
+"""
+Example
+
+import adafruit_lsm9ds1
+import board
+import attitude_fusion
+
+sensor = adafruit_lsm9ds1.LSM9DS1_I2C(board.I2C())
+imu_filter = attitude_fusion.MahonyFilter(kp=1.0, ki=0.01)
+
+previous_time = time.monotonic()
+while True:
+    current_time = time.monotonic()
+    roll, pitch, yaw = imu_filter.step(sensor.gyro + sensor.acceleration + sensor.magnetic, current_time - previous_time)
+    previous_time = current_time
+
+
+# Offline, on a logged (N x 9) array of raw samples
+angles = attitude_fusion.MahonyFilter(kp=1.0, ki=0.01).batch(raw_imu, 1 / 952)
+"""
+
+
+if __name__ == "__main__":
+    # Check that the streaming and batch paths agree on a synthetic rocking motion
+    rng = np.random.default_rng(0)
+    n = 2000
+    dt = 0.01
+    t = np.arange(n) * dt
+    roll_true = 20 * np.sin(2 * np.pi * 0.5 * t)
+    samples = np.zeros((n, 9))
+    samples[:, 1] = np.gradient(roll_true, dt) + rng.normal(0, 0.5, n)
+    samples[:, 4] = 9.81 * np.sin(np.radians(roll_true)) + rng.normal(0, 0.05, n)
+    samples[:, 5] = 9.81 * np.cos(np.radians(roll_true)) + rng.normal(0, 0.05, n)
+    samples[:, 6] = 0.2
+    samples[:, 8] = -0.4
+
+    for imu_filter_type in (ComplementaryFilter, MadgwickFilter, MahonyFilter):
+        streaming_filter = imu_filter_type()
+        streaming = np.array([streaming_filter.step(row, dt) for row in samples.tolist()])
+        batched = imu_filter_type().batch(samples, dt)
+        print(f"{imu_filter_type.__name__}: identical = {np.array_equal(streaming, batched)}")
@@ -0,0 +1,155 @@
+"""
+Throughput benchmark for the encoder and IMU sampling paths on the simulated I2C bus (see i2c_backends.py).
+
+Each path is run for --duration seconds at every --latency (seconds per bus transaction) and the achieved
+sample rate is printed. --save writes the results to a JSON file and --compare checks a later run against it,
+exiting with an error if any path got more than --tolerance slower, so it can be used as a regression check.
+
+Example:
+    python benchmark_i2c.py --latency 0 100e-6 250e-6 --save baseline.json
+    python benchmark_i2c.py --latency 0 100e-6 250e-6 --compare baseline.json
+"""
+
+import argparse
+import json
+import time
+
+from i2c_backends import (
+    AS5048B_ADDRESS, AS5048B_REG_ANGLE_HIGH, LSM9DS1_AG_ADDRESS, OUT_X_L_G, OUT_X_L_XL,
+    MotionProfile, default_simulated_bus,
+)
+from lsm9ds1_fifo import CTRL_REG9, STATUS_REG, STATUS_REG_XLDA, LSM9DS1FifoReader
+
+
+#---------------------------------------- Sampling Paths START -------------------------------------------------
+
+def as5048b_block_read(bus, duration):
+    """Encoder_as5048b.read_angle(): one 2 byte block read per sample."""
+    samples = 0
+    stop_at = time.perf_counter() + duration
+    while time.perf_counter() < stop_at:
+        data = bus.read_i2c_block_data(AS5048B_ADDRESS, AS5048B_REG_ANGLE_HIGH, 2)
+        angle = (data[0] << 6 | (data[1] & 0x3F)) * 360 / 16384.0
+        samples += 1
+    return samples
+
+
+def as5048b_byte_reads(bus, duration):
+    """encoder/basic_test.py read_angle(): two single byte reads per sample."""
+    samples = 0
+    stop_at = time.perf_counter() + duration
+    while time.perf_counter() < stop_at:
+        angle_high = bus.read_byte_data(AS5048B_ADDRESS, AS5048B_REG_ANGLE_HIGH)
+        angle_low = bus.read_byte_data(AS5048B_ADDRESS, AS5048B_REG_ANGLE_HIGH + 1)
+        angle = (((angle_high & 0x7F) << 6) | (angle_low & 0x3F)) * 360 / 16384.0
+        samples += 1
+    return samples
+
+
+def imu_polling(bus, duration):
+    """
+    sensor.gyro + sensor.acceleration polling: a 6 byte gyro and a 6 byte accel read per sample.
+
+    Only new samples are counted: STATUS_REG is polled and the outputs are read once its accel data ready bit is set,
+    so the rate tops out at the 952 Hz ODR instead of counting the same sample many times.
+    """
+    reader = LSM9DS1FifoReader(bus, odr=952)
+    reader.configure()
+    bus.write_byte_data(LSM9DS1_AG_ADDRESS, CTRL_REG9, 0x00)  # FIFO off, output registers hold the latest sample
+    samples = 0
+    stop_at = time.perf_counter() + duration
+    while time.perf_counter() < stop_at:
+        if not bus.read_byte_data(LSM9DS1_AG_ADDRESS, STATUS_REG) & STATUS_REG_XLDA:
+            continue
+        gyro = bus.read_i2c_block_data(LSM9DS1_AG_ADDRESS, OUT_X_L_G, 6)
+        accel = bus.read_i2c_block_data(LSM9DS1_AG_ADDRESS, OUT_X_L_XL, 6)
+        samples += 1
+    return samples
+
+
+def imu_fifo(bus, duration, use_rdwr=True):
+    """LSM9DS1FifoReader.read_block(): drains the whole FIFO level in one I2C_RDWR transaction."""
+    reader = LSM9DS1FifoReader(bus, odr=952, use_rdwr=use_rdwr)
+    reader.configure()
+    stop_at = time.perf_counter() + duration
+    while time.perf_counter() < stop_at:
+        reader.read_block()
+        time.sleep(0.005)
+    return reader.samples_read
+
+
+def imu_fifo_block_reads(bus, duration):
+    """LSM9DS1FifoReader.read_block() on plain smbus: one 24 byte block read per 2 FIFO slots."""
+    return imu_fifo(bus, duration, use_rdwr=False)
+
+
+PATHS = {
+    "as5048b_block_read": as5048b_block_read,
+    "as5048b_byte_reads": as5048b_byte_reads,
+    "imu_polling": imu_polling,
+    "imu_fifo_952hz": imu_fifo,
+    "imu_fifo_block_reads_952hz": imu_fifo_block_reads,
+}
+
+#---------------------------------------- Sampling Paths END -------------------------------------------------
+
+
+
+def run(latencies, duration):
+    """
+    Runs every sampling path at every latency.
+
+    Returns:
+    - dict of "path@latency" -> {"rate_hz": ..., "transactions_per_sample": ...}
+    """
+    results = {}
+    for latency in latencies:
+        for name, path in PATHS.items():
+            bus = default_simulated_bus(motion=MotionProfile.sine(20.0, 0.5), latency=latency, seed=0)
+            samples = path(bus, duration)
+            key = f"{name}@{latency:g}"
+            results[key] = {
+                "rate_hz": samples / duration,
+                "transactions_per_sample": bus.transactions / samples if samples else float("nan"),
+            }
+            print(f"{key:32s} {results[key]['rate_hz']:12.0f} samples/s   "
+                  f"{results[key]['transactions_per_sample']:6.2f} bus transactions per sample")
+    return results
+
+
+def compare(results, baseline, tolerance):
+    """Returns the list of paths that are more than `tolerance` (fraction) slower than the baseline."""
+    regressions = []
+    for key, old in baseline.items():
+        new = results.get(key)
+        if new is None:
+            continue
+        if new["rate_hz"] < old["rate_hz"] * (1.0 - tolerance):
+            regressions.append(f"{key}: {new['rate_hz']:.0f} samples/s vs baseline {old['rate_hz']:.0f}")
+    return regressions
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Benchmark the encoder and IMU sampling paths on the simulated I2C bus.')
+    parser.add_argument('--latency', type=float, nargs='+', default=[0.0, 100e-6, 250e-6], help='Seconds per bus transaction.')
+    parser.add_argument('--duration', type=float, default=1.0, help='Seconds to run each path for.')
+    parser.add_argument('--save', type=str, help='Write the results to this JSON file.')
+    parser.add_argument('--compare', type=str, help='Compare against results saved with --save.')
+    parser.add_argument('--tolerance', type=float, default=0.2, help='Allowed slowdown against --compare (fraction).')
+    args = parser.parse_args()
+
+    results = run(args.latency, args.duration)
+
+    if args.save:
+        with open(args.save, 'w') as fp:
+            json.dump(results, fp, indent=4)
+
+    if args.compare:
+        with open(args.compare) as fp:
+            baseline = json.load(fp)
+        regressions = compare(results, baseline, args.tolerance)
+        for line in regressions:
+            print(f"REGRESSION {line}")
+        if regressions:
+            raise SystemExit(1)
+        print("No regressions.")
@@ -0,0 +1,462 @@
+"""
+Pluggable I2C bus backends for the sensor code.
+
+Everything that talks to the IMU or the AS5048B only needs an object with the smbus methods
+(read_byte_data, write_byte_data, read_i2c_block_data, write_i2c_block_data). open_bus() picks the backend:
+
+- "smbus":  smbus.SMBus on the Raspberry Pi (what the scripts used before)
+- "smbus2": smbus2.SMBus, also gives LSM9DS1FifoReader its combined I2C_RDWR path
+- "sim":    SimulatedI2CBus with a simulated LSM9DS1 (accel/gyro + magnetometer) and AS5048B on it
+
+The backend can be chosen with the I2C_BACKEND environment variable so the same script runs on the Pi and on a laptop:
+
+    I2C_BACKEND=sim python LSM9DS1_IMU.py
+    I2C_BACKEND=sim PYTHONPATH=../LSM9DS1 python main.py      # the aysnc_as5048b encoder copies, via default_bus()
+
+The simulated devices produce physically consistent readings from a MotionProfile (the gyro is the derivative of the
+angle, the accelerometer and magnetometer are gravity and the earth field rotated into the sensor frame) and every
+bus transaction can be given a latency so read paths can be throughput tested without the hardware.
+"""
+
+import math
+import os
+import random
+import time
+from collections import deque
+
+from lsm9ds1_fifo import (
+    LSM9DS1_AG_ADDRESS, WHO_AM_I_AG_RSP, WHO_AM_I_XG, CTRL_REG1_G, OUT_X_L_G, CTRL_REG6_XL, CTRL_REG8, CTRL_REG9,
+    OUT_X_L_XL, FIFO_CTRL, FIFO_SRC, FIFO_DEPTH, SAMPLE_BYTES, ODR_FROM_BITS, GYRO_SCALE_BITS, GYRO_SENSITIVITY_DPS,
+    ACCEL_RANGE_BITS, ACCEL_SENSITIVITY_G, CTRL_REG8_IF_ADD_INC, CTRL_REG9_FIFO_EN, FIFO_MODE_BYPASS,
+    FIFO_MODE_CONTINUOUS, FIFO_SRC_OVRN, STANDARD_GRAVITY, SLOT_BYTES, STATUS_REG, STATUS_REG_XLDA, STATUS_REG_GDA,
+)
+
+# LSM9DS1 accel/gyro register map lives with the driver in lsm9ds1_fifo.py
+GYRO_SENSITIVITY_FROM_BITS = {bits: GYRO_SENSITIVITY_DPS[scale] for scale, bits in GYRO_SCALE_BITS.items()}  # deg/s per LSB
+ACCEL_SENSITIVITY_FROM_BITS = {bits: ACCEL_SENSITIVITY_G[g] for g, bits in ACCEL_RANGE_BITS.items()}  # g per LSB
+
+# LSM9DS1 magnetometer registers
+LSM9DS1_M_ADDRESS = 0x1E
+WHO_AM_I_M_RSP = 0x3D
+WHO_AM_I_M = 0x0F
+CTRL_REG2_M = 0x21
+OUT_X_L_M = 0x28
+MAG_SENSITIVITY_FROM_BITS = {0b00: 0.00014, 0b01: 0.00029, 0b10: 0.00043, 0b11: 0.00058}  # gauss per LSB
+
+# AS5048B registers
+AS5048B_ADDRESS = 0x40
+AS5048B_REG_ZERO_HIGH = 0x16
+AS5048B_REG_ZERO_LOW = 0x17
+AS5048B_REG_AGC = 0xFA
+AS5048B_REG_DIAG = 0xFB
+AS5048B_REG_MAGNITUDE_HIGH = 0xFC
+AS5048B_REG_ANGLE_HIGH = 0xFE
+AS5048B_RESOLUTION = 16384
+
+
+
+#---------------------------------------- Backend Selection START -------------------------------------------------
+
+def open_bus(backend=None, bus_number=1, **sim_options):
+    """
+    Opens an I2C bus with the requested backend.
+
+    Parameters:
+    - backend: "smbus", "smbus2" or "sim". Defaults to the I2C_BACKEND environment variable, then "smbus".
+    - bus_number: I2C bus number on the Pi, default is 1.
+    - sim_options: Passed to default_simulated_bus() when backend is "sim" (motion, latency, ...).
+
+    Returns:
+    - A bus object with the smbus API.
+
+    Example:
+        >>> bus = open_bus()                          # smbus.SMBus(1) on the Pi
+        >>> bus = open_bus("sim", latency=200e-6)     # simulated IMU + encoder, 200 us per transaction
+    """
+    if backend is None:
+        backend = os.environ.get("I2C_BACKEND", "smbus")
+
+    if backend == "smbus":
+        import smbus
+        return smbus.SMBus(bus_number)
+    if backend == "smbus2":
+        import smbus2
+        return smbus2.SMBus(bus_number)
+    if backend == "sim":
+        return default_simulated_bus(**sim_options)
+    raise ValueError(f"Unknown I2C backend '{backend}', use 'smbus', 'smbus2' or 'sim'")
+
+
+def default_simulated_bus(motion=None, latency=0.0, byte_time=0.0, clock=time.monotonic, seed=None):
+    """
+    Builds the rig's bus in simulation: LSM9DS1 accel/gyro (0x6B), LSM9DS1 magnetometer (0x1E) and AS5048B (0x40),
+    all driven by the same motion profile.
+
+    Parameters:
+    - motion: MotionProfile for the sensors, default is a 20 degree 0.5 Hz roll oscillation.
+    - latency: Fixed time per bus transaction in seconds.
+    - byte_time: Extra time per transferred byte in seconds (about 22.5e-6 at 400 kHz).
+    - clock: Function returning the current time in seconds.
+    - seed: Seed for the sensor noise.
+    """
+    motion = motion or MotionProfile.sine(amplitude_deg=20.0, frequency=0.5, axis="x")
+    rng = random.Random(seed)
+    return SimulatedI2CBus(
+        [SimulatedLSM9DS1(motion, rng=rng), SimulatedLSM9DS1Mag(motion, rng=rng), SimulatedAS5048B(motion, rng=rng)],
+        latency=latency, byte_time=byte_time, clock=clock,
+    )
+
+#---------------------------------------- Backend Selection END -------------------------------------------------
+
+
+
+#---------------------------------------- Motion Profiles START -------------------------------------------------
+
+class MotionProfile:
+    """
+    Rotation of the rig about one sensor axis as a function of time.
+
+    Parameters:
+    - angle: Function of t [s] returning the angle [deg].
+    - rate: Function of t [s] returning the angular rate [deg/s].
+    - axis: Sensor axis the rotation is about, "x", "y" or "z".
+    """
+
+    def __init__(self, angle, rate, axis="x"):
+        if axis not in ("x", "y", "z"):
+            raise ValueError(f"axis must be 'x', 'y' or 'z', got {axis}")
+        self.angle = angle
+        self.rate = rate
+        self.axis = axis
+
+    @classmethod
+    def still(cls, angle_deg=0.0, axis="x"):
+        return cls(lambda t: angle_deg, lambda t: 0.0, axis)
+
+    @classmethod
+    def constant_rate(cls, rate_deg_s, axis="z"):
+        return cls(lambda t: rate_deg_s * t, lambda t: rate_deg_s, axis)
+
+    @classmethod
+    def sine(cls, amplitude_deg, frequency, axis="x"):
+        w = 2.0 * math.pi * frequency
+        return cls(lambda t: amplitude_deg * math.sin(w * t), lambda t: amplitude_deg * w * math.cos(w * t), axis)
+
+    def gyro(self, t):
+        """Angular rate in the sensor frame [deg/s]."""
+        rate = self.rate(t)
+        return (rate if self.axis == "x" else 0.0, rate if self.axis == "y" else 0.0, rate if self.axis == "z" else 0.0)
+
+    def to_sensor_frame(self, vector, t):
+        """Rotates a world frame vector into the sensor frame."""
+        a = math.radians(self.angle(t))
+        c = math.cos(a)
+        s = math.sin(a)
+        x, y, z = vector
+        if self.axis == "x":
+            return (x, c * y + s * z, -s * y + c * z)
+        if self.axis == "y":
+            return (c * x - s * z, y, s * x + c * z)
+        return (c * x + s * y, -s * x + c * y, z)
+
+    def acceleration(self, t):
+        """Accelerometer reading (gravity only) in the sensor frame [m/s^2]."""
+        # Gravity reads as +z when level, so roll = atan2(ay, az) as in the filters
+        return self.to_sensor_frame((0.0, 0.0, STANDARD_GRAVITY), t)
+
+    def magnetic(self, t, earth_field=(0.2, 0.0, -0.4)):
+        """Magnetometer reading in the sensor frame [gauss]."""
+        return self.to_sensor_frame(earth_field, t)
+
+#---------------------------------------- Motion Profiles END -------------------------------------------------
+
+
+
+#---------------------------------------- Simulated Bus START -------------------------------------------------
+
+class SimulatedI2CMessage:
+    """
+    The part of smbus2.i2c_msg that SimulatedI2CBus.i2c_rdwr() needs: write(address, data), read(address, length),
+    and bytes(msg) / iter(msg) for the data.
+    """
+    __slots__ = ("addr", "read_length", "buf")
+
+    def __init__(self, addr, read_length, buf):
+        self.addr = addr
+        self.read_length = read_length
+        self.buf = buf
+
+    @classmethod
+    def write(cls, address, data):
+        return cls(address, None, bytearray(data))
+
+    @classmethod
+    def read(cls, address, length):
+        return cls(address, length, bytearray(length))
+
+    def __bytes__(self):
+        return bytes(self.buf)
+
+    def __iter__(self):
+        return iter(self.buf)
+
+    def __len__(self):
+        return len(self.buf)
+
+
+class SimulatedI2CBus:
+    """
+    smbus compatible bus that routes transactions to simulated devices by address.
+
+    Also has smbus2's i2c_rdwr() (with SimulatedI2CMessage as `i2c_msg`), which counts as one transaction however many
+    messages it carries, like the single ioctl it is on Linux.
+
+    Attributes:
+    - devices (dict): address -> simulated device.
+    - latency (float): Fixed time per transaction [s].
+    - byte_time (float): Extra time per transferred byte [s].
+    - transactions (int): Number of transactions so far.
+    - bytes_transferred (int): Number of data bytes read or written so far.
+    """
+
+    i2c_msg = SimulatedI2CMessage
+
+    def __init__(self, devices, latency=0.0, byte_time=0.0, clock=time.monotonic):
+        self.devices = {device.address: device for device in devices}
+        self.latency = latency
+        self.byte_time = byte_time
+        self.clock = clock
+        self.transactions = 0
+        self.bytes_transferred = 0
+
+    def _device(self, address, nbytes):
+        device = self.devices.get(address)
+        if device is None:
+            raise OSError(121, "Remote I/O error")  # Same errno smbus raises for a missing device
+        self.transactions += 1
+        self.bytes_transferred += nbytes
+        delay = self.latency + self.byte_time * nbytes
+        if delay > 0.0:
+            # Busy wait, time.sleep cannot resolve the sub-millisecond times of a real bus
+            end = time.perf_counter() + delay
+            while time.perf_counter() < end:
+                pass
+        device.advance(self.clock())
+        return device
+
+    def read_byte_data(self, address, register):
+        return self._device(address, 1).read(register, 1)[0]
+
+    def write_byte_data(self, address, register, value):
+        self._device(address, 1).write(register, [value & 0xFF])
+
+    def read_word_data(self, address, register):
+        data = self._device(address, 2).read(register, 2)
+        return data[0] | (data[1] << 8)
+
+    def read_i2c_block_data(self, address, register, length):
+        return self._device(address, length).read(register, length)
+
+    def write_i2c_block_data(self, address, register, data):
+        self._device(address, len(data)).write(register, list(data))
+
+    def i2c_rdwr(self, *messages):
+        """Combined transaction: a write sets the register pointer (first byte) and writes the rest, a read reads from it."""
+        # One ioctl: the latency and the transaction count are paid once for all the messages
+        self._device(messages[0].addr, sum(len(message.buf) for message in messages))
+        pointers = {}
+        for message in messages:
+            device = self.devices.get(message.addr)
+            if device is None:
+                raise OSError(121, "Remote I/O error")
+            if message.addr != messages[0].addr:
+                device.advance(self.clock())
+            if message.read_length is None:
+                pointers[message.addr] = message.buf[0]
+                if len(message.buf) > 1:
+                    device.write(message.buf[0], list(message.buf[1:]))
+            else:
+                message.buf[:] = bytes(device.read(pointers.get(message.addr, 0), message.read_length))
+
+    def close(self):
+        pass
+
+
+class SimulatedDevice:
+    """
+    Base class for a simulated I2C device: a 256 byte register map with auto increment on block reads/writes.
+
+    Subclasses override advance() to update their output registers from the motion profile and may override
+    read()/write() for registers with side effects.
+    """
+
+    def __init__(self, address, motion=None, rng=None):
+        self.address = address
+        self.motion = motion or MotionProfile.still()
+        self.rng = rng or random.Random()
+        self.registers = bytearray(256)
+
+    def advance(self, t):
+        pass
+
+    def read(self, register, length):
+        return list(self.registers[register:register + length])
+
+    def write(self, register, data):
+        self.registers[register:register + len(data)] = bytes(data)
+
+    @staticmethod
+    def _pack_xyz(registers, register, values, sensitivity):
+        for i, value in enumerate(values):
+            count = int(round(value / sensitivity))
+            count = -32768 if count < -32768 else 32767 if count > 32767 else count
+            count &= 0xFFFF
+            registers[register + 2 * i] = count & 0xFF
+            registers[register + 2 * i + 1] = count >> 8
+
+#---------------------------------------- Simulated Bus END -------------------------------------------------
+
+
+
+#---------------------------------------- Simulated Devices START -------------------------------------------------
+
+class SimulatedAS5048B(SimulatedDevice):
+    """
+    AS5048B 14 bit magnetic encoder. The angle register follows the motion profile angle minus the programmed zero.
+
+    Parameters:
+    - motion: MotionProfile, the encoder reads its angle.
+    - noise_counts: Standard deviation of the angle noise in counts.
+    """
+
+    def __init__(self, motion=None, address=AS5048B_ADDRESS, noise_counts=1.0, rng=None):
+        super().__init__(address, motion, rng)
+        self.noise_counts = noise_counts
+        self.registers[AS5048B_REG_AGC] = 0x80
+        self.registers[AS5048B_REG_DIAG] = 0x01  # OCF: offset compensation finished
+        self.registers[AS5048B_REG_MAGNITUDE_HIGH] = 0xFF
+
+    def advance(self, t):
+        counts = self.motion.angle(t) / 360.0 * AS5048B_RESOLUTION
+        if self.noise_counts:
+            counts += self.rng.gauss(0.0, self.noise_counts)
+        zero = (self.registers[AS5048B_REG_ZERO_HIGH] << 6) | (self.registers[AS5048B_REG_ZERO_LOW] & 0x3F)
+        raw = (int(round(counts)) - zero) % AS5048B_RESOLUTION
+        self.registers[AS5048B_REG_ANGLE_HIGH] = raw >> 6
+        self.registers[AS5048B_REG_ANGLE_HIGH + 1] = raw & 0x3F
+
+
+class SimulatedLSM9DS1(SimulatedDevice):
+    """
+    LSM9DS1 accelerometer / gyroscope with a working FIFO.
+
+    Samples are produced at the ODR set in CTRL_REG1_G and set the data ready flags in STATUS_REG, reading the gyro
+    or accel output registers clears the matching flag. With FIFO_EN set and continuous mode selected in FIFO_CTRL,
+    the FIFO keeps the newest 32 samples and sets the overrun flag when older ones are dropped. Reading the accel
+    output registers pops the current FIFO slot. A block read from OUT_X_L_G of whole slots (12 bytes each) returns
+    gyro then accel of each slot and pops them, like the chip's address pointer rolling over in FIFO mode.
+
+    Parameters:
+    - motion: MotionProfile the readings are generated from.
+    - gyro_bias: Constant gyro bias (x, y, z) [deg/s].
+    - gyro_noise: Gyro noise standard deviation [deg/s].
+    - accel_noise: Accel noise standard deviation [m/s^2].
+    """
+
+    def __init__(self, motion=None, address=LSM9DS1_AG_ADDRESS, gyro_bias=(0.0, 0.0, 0.0), gyro_noise=0.05,
+                 accel_noise=0.02, rng=None):
+        super().__init__(address, motion, rng)
+        self.gyro_bias = gyro_bias
+        self.gyro_noise = gyro_noise
+        self.accel_noise = accel_noise
+        self.registers[WHO_AM_I_XG] = WHO_AM_I_AG_RSP
+        self.registers[CTRL_REG8] = CTRL_REG8_IF_ADD_INC
+        self.fifo = deque()
+        self.overrun = False
+        self._next_sample_time = None
+
+    def _sample(self, t):
+        gauss = self.rng.gauss
+        gyro = [g + b + gauss(0.0, self.gyro_noise) for g, b in zip(self.motion.gyro(t), self.gyro_bias)]
+        accel = [a + gauss(0.0, self.accel_noise) for a in self.motion.acceleration(t)]
+        registers = self.registers
+        self._pack_xyz(registers, OUT_X_L_G, gyro, GYRO_SENSITIVITY_FROM_BITS[(registers[CTRL_REG1_G] >> 3) & 0b11])
+        self._pack_xyz(registers, OUT_X_L_XL, accel,
+                       ACCEL_SENSITIVITY_FROM_BITS[(registers[CTRL_REG6_XL] >> 3) & 0b11] * STANDARD_GRAVITY)
+        return (bytes(registers[OUT_X_L_G:OUT_X_L_G + SAMPLE_BYTES]), bytes(registers[OUT_X_L_XL:OUT_X_L_XL + SAMPLE_BYTES]))
+
+    def advance(self, t):
+        odr = ODR_FROM_BITS.get(self.registers[CTRL_REG1_G] >> 5)
+        if odr is None:
+            self._next_sample_time = None
+            return
+        if self._next_sample_time is None:
+            self._next_sample_time = t + 1.0 / odr
+            return
+        fifo_on = (self.registers[CTRL_REG9] & CTRL_REG9_FIFO_EN
+                   and self.registers[FIFO_CTRL] & 0xE0 == FIFO_MODE_CONTINUOUS)
+        while self._next_sample_time <= t:
+            sample = self._sample(self._next_sample_time)
+            self.registers[STATUS_REG] |= STATUS_REG_XLDA | STATUS_REG_GDA
+            if fifo_on:
+                if len(self.fifo) == FIFO_DEPTH:
+                    self.fifo.popleft()
+                    self.overrun = True
+                self.fifo.append(sample)
+            self._next_sample_time += 1.0 / odr
+
+    def read(self, register, length):
+        if register == FIFO_SRC:
+            status = min(len(self.fifo), FIFO_DEPTH)
+            if self.overrun:
+                status |= FIFO_SRC_OVRN
+                self.overrun = False
+            return [status]
+        if self.fifo and register == OUT_X_L_G and length >= SLOT_BYTES and length % SLOT_BYTES == 0:
+            data = []
+            for _ in range(length // SLOT_BYTES):
+                gyro, accel = self.fifo.popleft() if self.fifo else (
+                    bytes(self.registers[OUT_X_L_G:OUT_X_L_G + SAMPLE_BYTES]),
+                    bytes(self.registers[OUT_X_L_XL:OUT_X_L_XL + SAMPLE_BYTES]))
+                data += gyro
+                data += accel
+            return data
+        if self.fifo and register == OUT_X_L_G and length == SAMPLE_BYTES:
+            return list(self.fifo[0][0])
+        if self.fifo and register == OUT_X_L_XL and length == SAMPLE_BYTES:
+            return list(self.fifo.popleft()[1])
+        if register == OUT_X_L_G:
+            self.registers[STATUS_REG] &= ~STATUS_REG_GDA
+        elif register == OUT_X_L_XL:
+            self.registers[STATUS_REG] &= ~STATUS_REG_XLDA
+        return super().read(register, length)
+
+    def write(self, register, data):
+        super().write(register, data)
+        if register == FIFO_CTRL and self.registers[FIFO_CTRL] & 0xE0 == FIFO_MODE_BYPASS:
+            self.fifo.clear()
+            self.overrun = False
+
+
+class SimulatedLSM9DS1Mag(SimulatedDevice):
+    """
+    LSM9DS1 magnetometer. The output registers hold the earth field rotated by the motion profile.
+
+    Parameters:
+    - motion: MotionProfile the readings are generated from.
+    - earth_field: World frame magnetic field (x, y, z) [gauss].
+    - noise: Noise standard deviation [gauss].
+    """
+
+    def __init__(self, motion=None, address=LSM9DS1_M_ADDRESS, earth_field=(0.2, 0.0, -0.4), noise=0.002, rng=None):
+        super().__init__(address, motion, rng)
+        self.earth_field = earth_field
+        self.noise = noise
+        self.registers[WHO_AM_I_M] = WHO_AM_I_M_RSP
+
+    def advance(self, t):
+        gauss = self.rng.gauss
+        field = [m + gauss(0.0, self.noise) for m in self.motion.magnetic(t, self.earth_field)]
+        self._pack_xyz(self.registers, OUT_X_L_M, field, MAG_SENSITIVITY_FROM_BITS[(self.registers[CTRL_REG2_M] >> 5) & 0b11])
+
+#---------------------------------------- Simulated Devices END -------------------------------------------------
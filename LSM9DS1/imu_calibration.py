@@ -0,0 +1,298 @@
+import json
+import math
+import os
+import time
+
+
+class GyroBiasEstimator:
+    """
+    Gyro bias calibration that is saved to disk and refined while the rig is running.
+
+    Replaces the blocking `calibration_duration = 15` averaging loop. At start-up the last saved bias is loaded
+    from calibration_path (or a short quick_start() average is taken if there is no file yet). After that every
+    sample is pushed through update(). A sliding window of the last `window_size` samples is kept with running sums,
+    and whenever the window is stationary (gyro and accel spread both under their thresholds, and the gyro mean within
+    bias_threshold of the current bias) the bias is nudged towards the window mean. The accelerometer scale is refined at the same time from the magnitude of gravity.
+
+    There is no gyro scale estimate: a scale error only shows up while rotating at a known rate, which stationary
+    windows cannot provide.
+
+    Attributes:
+    - calibration_path (str): JSON file the estimates are loaded from and saved to.
+    - gyro_bias (list): Gyro bias per axis in deg/s.
+    - accel_scale (float): Accelerometer scale factor so that a stationary reading has magnitude `gravity`.
+    - stationary (bool): True while the last full window was judged stationary.
+    - loaded (bool): True if the estimates came from calibration_path.
+    - refinements (int): Number of times the bias has been refined online.
+    """
+    __slots__ = (
+        "calibration_path", "window_size", "gyro_threshold", "accel_threshold", "bias_threshold", "learning_rate",
+        "gravity", "save_interval", "gyro_bias", "accel_scale", "stationary", "loaded", "refinements",
+        "_gyro_window", "_accel_window", "_index", "_count", "_sum", "_sum_sq", "_last_save",
+    )
+
+    def __init__(self, calibration_path="imu_calibration.json", window_size=100, gyro_threshold=0.5,
+                 accel_threshold=0.1, bias_threshold=2.0, learning_rate=0.05, gravity=9.80665, save_interval=30.0):
+        """
+        Parameters:
+        - calibration_path: JSON file the estimates are stored in, default is 'imu_calibration.json'.
+        - window_size: Number of samples in the stationarity window.
+        - gyro_threshold: Max standard deviation (deg/s) of each gyro axis for the window to count as stationary.
+        - accel_threshold: Max standard deviation (m/s^2) of the accel magnitude for the window to count as stationary.
+        - bias_threshold: Max distance (deg/s) of each gyro axis mean from the current bias for the window to count as
+          stationary. A steady rotation has almost no spread, this keeps it from being learned as bias, so the bias
+          must be seeded with load() or quick_start() first.
+        - learning_rate: How far the bias moves towards the window mean over one full stationary window (0-1).
+        - gravity: Expected accel magnitude when stationary, in the same unit as the accel readings.
+        - save_interval: Minimum seconds between automatic saves after a refinement, None to never auto save.
+        """
+        self.calibration_path = calibration_path
+        self.window_size = window_size
+        self.gyro_threshold = gyro_threshold
+        self.accel_threshold = accel_threshold
+        self.bias_threshold = bias_threshold
+        self.learning_rate = learning_rate
+        self.gravity = gravity
+        self.save_interval = save_interval
+
+        self.gyro_bias = [0.0, 0.0, 0.0]
+        self.accel_scale = 1.0
+        self.stationary = False
+        self.loaded = False
+        self.refinements = 0
+
+        # Preallocated sliding window: gyro x, y, z and accel magnitude per slot
+        self._gyro_window = [[0.0, 0.0, 0.0] for _ in range(window_size)]
+        self._accel_window = [0.0] * window_size
+        self._index = 0
+        self._count = 0
+        self._sum = [0.0, 0.0, 0.0, 0.0]
+        self._sum_sq = [0.0, 0.0, 0.0, 0.0]
+        self._last_save = time.monotonic()
+
+
+#---------------------------------------- Persistence START -------------------------------------------------
+
+    def load(self):
+        """
+        Loads the saved gyro bias and accel scale estimates from calibration_path.
+
+        Returns:
+        - True if the file was found and loaded, False otherwise.
+
+        Example:
+            >>> calibration = GyroBiasEstimator()
+            >>> if not calibration.load():
+            ...     calibration.quick_start(sensor)
+        """
+        if not os.path.exists(self.calibration_path):
+            return False
+        try:
+            with open(self.calibration_path) as fp:
+                data = json.load(fp)
+            self.gyro_bias = [float(x) for x in data["gyro_bias"]]
+            self.accel_scale = float(data.get("accel_scale", 1.0))
+        except (OSError, ValueError, KeyError, TypeError) as e:
+            print(f"Error loading IMU calibration from {self.calibration_path}: {e}")
+            return False
+        self.loaded = True
+        print(f"Loaded IMU calibration from {self.calibration_path}: gyro bias {self.gyro_bias}")
+        return True
+
+
+    def save(self):
+        """
+        Saves the current gyro bias and accel scale estimates to calibration_path.
+
+        The file is written to a temporary path first and then renamed so a crash mid-write cannot corrupt it.
+        """
+        data = {
+            "gyro_bias": self.gyro_bias,
+            "accel_scale": self.accel_scale,
+            "refinements": self.refinements,
+            "saved_at": time.time(),
+        }
+        tmp_path = self.calibration_path + ".tmp"
+        with open(tmp_path, "w") as fp:
+            json.dump(data, fp, indent=4)
+        os.replace(tmp_path, self.calibration_path)
+        self._last_save = time.monotonic()
+
+#---------------------------------------- Persistence END -------------------------------------------------
+
+
+    def quick_start(self, sensor, duration=0.5):
+        """
+        Takes a short gyro average to seed the bias when there is no saved calibration yet.
+
+        The result only needs to be close enough to start the controller, update() keeps refining it afterwards.
+
+        Parameters:
+        - sensor: Anything with a .gyro attribute returning (x, y, z) in deg/s, e.g. adafruit_lsm9ds1.LSM9DS1_I2C.
+        - duration: Averaging time in seconds, default is 0.5.
+        """
+        totals = [0.0, 0.0, 0.0]
+        sample_count = 0
+        start_time = time.monotonic()
+        while time.monotonic() - start_time < duration:
+            gyro_x, gyro_y, gyro_z = sensor.gyro
+            totals[0] += gyro_x
+            totals[1] += gyro_y
+            totals[2] += gyro_z
+            sample_count += 1
+        if sample_count:
+            self.gyro_bias = [total / sample_count for total in totals]
+
+
+    def correct(self, gyro):
+        """
+        Removes the current bias from one gyro reading.
+
+        Parameters:
+        - gyro: (x, y, z) in deg/s.
+
+        Returns:
+        - Bias corrected (x, y, z) in deg/s.
+        """
+        bias = self.gyro_bias
+        return gyro[0] - bias[0], gyro[1] - bias[1], gyro[2] - bias[2]
+
+
+    def correct_accel(self, accel):
+        """
+        Applies the current accelerometer scale to one accel reading.
+
+        Parameters:
+        - accel: (x, y, z) accel reading.
+
+        Returns:
+        - Scaled (x, y, z) accel reading.
+        """
+        scale = self.accel_scale
+        return accel[0] * scale, accel[1] * scale, accel[2] * scale
+
+
+    def update(self, gyro, accel):
+        """
+        Pushes one raw sample through the stationarity window and returns the corrected gyro reading.
+
+        The window keeps running sums so the cost per call does not depend on window_size.
+
+        Parameters:
+        - gyro: Raw (x, y, z) gyro reading in deg/s.
+        - accel: Raw (x, y, z) accel reading.
+
+        Returns:
+        - Bias corrected (x, y, z) gyro reading in deg/s.
+
+        Example:
+            >>> gyro_x, gyro_y, gyro_z = calibration.update(sensor.gyro, sensor.acceleration)
+        """
+        gx, gy, gz = gyro
+        ax, ay, az = accel
+        accel_mag = math.sqrt(ax * ax + ay * ay + az * az)
+
+        slot = self._gyro_window[self._index]
+        total = self._sum
+        total_sq = self._sum_sq
+        if self._count == self.window_size:
+            old_accel = self._accel_window[self._index]
+            total[0] -= slot[0]
+            total[1] -= slot[1]
+            total[2] -= slot[2]
+            total[3] -= old_accel
+            total_sq[0] -= slot[0] * slot[0]
+            total_sq[1] -= slot[1] * slot[1]
+            total_sq[2] -= slot[2] * slot[2]
+            total_sq[3] -= old_accel * old_accel
+        else:
+            self._count += 1
+
+        slot[0] = gx
+        slot[1] = gy
+        slot[2] = gz
+        self._accel_window[self._index] = accel_mag
+        total[0] += gx
+        total[1] += gy
+        total[2] += gz
+        total[3] += accel_mag
+        total_sq[0] += gx * gx
+        total_sq[1] += gy * gy
+        total_sq[2] += gz * gz
+        total_sq[3] += accel_mag * accel_mag
+
+        self._index += 1
+        if self._index == self.window_size:
+            self._index = 0
+            self._resum()
+
+        if self._count == self.window_size:
+            self._check_stationary()
+
+        return self.correct(gyro)
+
+
+    def _resum(self):
+        """Recomputes the running sums from the window once per wrap so floating point drift cannot build up."""
+        window = self._gyro_window
+        for axis in range(3):
+            self._sum[axis] = sum(slot[axis] for slot in window)
+            self._sum_sq[axis] = sum(slot[axis] * slot[axis] for slot in window)
+        self._sum[3] = sum(self._accel_window)
+        self._sum_sq[3] = sum(x * x for x in self._accel_window)
+
+
+    def _check_stationary(self):
+        n = self.window_size
+        means = [s / n for s in self._sum]
+        gyro_limit = self.gyro_threshold * self.gyro_threshold
+        accel_limit = self.accel_threshold * self.accel_threshold
+
+        for axis in range(4):
+            variance = self._sum_sq[axis] / n - means[axis] * means[axis]
+            if variance > (gyro_limit if axis < 3 else accel_limit):
+                self.stationary = False
+                return
+
+        # A constant rate (e.g. a steady yaw) passes the spread test, bias drift is never this far from the estimate
+        bias = self.gyro_bias
+        for axis in range(3):
+            if abs(means[axis] - bias[axis]) > self.bias_threshold:
+                self.stationary = False
+                return
+
+        # Spread the step over the window so a full stationary window moves the bias by learning_rate
+        self.stationary = True
+        rate = self.learning_rate / n
+        bias[0] += rate * (means[0] - bias[0])
+        bias[1] += rate * (means[1] - bias[1])
+        bias[2] += rate * (means[2] - bias[2])
+        if means[3] > 0.0:
+            self.accel_scale += rate * (self.gravity / means[3] - self.accel_scale)
+        self.refinements += 1
+
+        if self.save_interval is not None and time.monotonic() - self._last_save >= self.save_interval:
+            self.save()
+
+
+
+"""
+Example
+
+import adafruit_lsm9ds1
+import board
+from imu_calibration import GyroBiasEstimator
+
+sensor = adafruit_lsm9ds1.LSM9DS1_I2C(board.I2C())
+
+calibration = GyroBiasEstimator('imu_calibration.json')
+if not calibration.load():
+    calibration.quick_start(sensor)  # 0.5 s instead of 15 s, refined online below
+
+try:
+    while True:
+        gyro_x, gyro_y, gyro_z = calibration.update(sensor.gyro, sensor.acceleration)
+        ...
+finally:
+    calibration.save()
+"""
@@ -5,6 +5,8 @@ import math
 import time
 import threading
 
+from imu_calibration import GyroBiasEstimator
+
 # Declare previous_time, angle_pitch, and angle_roll as global variables
 global previous_time
 global angle_pitch
@@ -18,22 +20,11 @@ sensor = adafruit_lsm9ds1.LSM9DS1_I2C(i2c)
 sensor.accel_range = adafruit_lsm9ds1.ACCELRANGE_2G
 sensor.gyro_scale = adafruit_lsm9ds1.GYROSCALE_245DPS
 
-# Calibration period (in seconds)
-calibration_duration = 15  
-print("Calibrating LSM9DS1. Please keep the sensor stable...")
-calibration_data = {"gyro_total": [0, 0, 0], "sample_count": 0}
-
-start_time = time.monotonic()
-while time.monotonic() - start_time < calibration_duration:
-    gyro_x, gyro_y, gyro_z = sensor.gyro
-    calibration_data["gyro_total"][0] += gyro_x
-    calibration_data["gyro_total"][1] += gyro_y
-    calibration_data["gyro_total"][2] += gyro_z
-    calibration_data["sample_count"] += 1
-
-calibration_data["gyro_total"][0] /= calibration_data["sample_count"]
-calibration_data["gyro_total"][1] /= calibration_data["sample_count"]
-calibration_data["gyro_total"][2] /= calibration_data["sample_count"]
+# Gyro calibration: reuse the saved bias and keep refining it while running (see imu_calibration.py)
+calibration = GyroBiasEstimator('imu_calibration.json')
+if not calibration.load():
+    print("No saved IMU calibration found. Keep the sensor stable for half a second...")
+    calibration.quick_start(sensor, duration=0.5)
 
 # Complementary filter parameters
 alpha = 0.98
@@ -60,12 +51,9 @@ def read_and_print_roll():
         current_time = time.monotonic()
         elapsed_time = current_time - previous_time
 
-        accel_x, accel_y, accel_z = sensor.acceleration
-        gyro_x, gyro_y, gyro_z = sensor.gyro
-
-        gyro_x -= calibration_data["gyro_total"][0]
-        gyro_y -= calibration_data["gyro_total"][1]
-        gyro_z -= calibration_data["gyro_total"][2]
+        accel = sensor.acceleration
+        accel_x, accel_y, accel_z = accel
+        gyro_x, gyro_y, gyro_z = calibration.update(sensor.gyro, accel)
 
         pitch_acc = math.atan2(accel_x, math.sqrt(accel_y * accel_y + accel_z * accel_z)) * (180 / math.pi)
         roll_acc = math.atan2(accel_y, accel_z) * (180 / math.pi)
@@ -2,8 +2,11 @@ import asyncio
 import can
 import struct
 import time
+from math import nan
 from datetime import datetime
 from odrivedatabase import OdriveDatabase
+from telemetry_logger import TelemetryLogger
+from loop_timing import LoopTimer
 
 class ODriveCAN:
     def __init__(self, nodeID, canBusID="can0", canBusType="socketcan"):
@@ -28,6 +31,17 @@ class ODriveCAN:
         self.latest_data = {}
         self.running = True
 
+        # Collected data is printed at a throttled rate instead of every interval, collect_data_at_interval() runs
+        # self.telemetry.loop() alongside itself
+        self.telemetry = TelemetryLogger(
+            ("time", "pos", "vel", "torque_target", "torque_estimate", "bus_voltage", "bus_current",
+             "iq_setpoint", "iq_measured", "electrical_power", "mechanical_power"),
+            display_rate=2, label=f"O-Drive {nodeID}",
+        )
+
+        # Time spent reading from the O-Drive and inserting into the database per data_collection_loop() cycle
+        self.timer = LoopTimer(("read", "db"))
+
 
 
     async def async_recv(self, timeout=1.0):
@@ -368,7 +382,18 @@ class ODriveCAN:
         
 
     async def collect_data_at_interval(self, interval, trial_id):
-        """Collects the latest data at set intervals and formats it."""
+        """Collects the latest data at set intervals and formats it, printed at a throttled rate by self.telemetry."""
+        self.telemetry.running = True
+        printer = asyncio.create_task(self.telemetry.loop())
+        try:
+            await self._collect_data_at_interval(interval)
+        finally:
+            # loop() prints the last record once more on the way out
+            self.telemetry.running = False
+            await printer
+
+
+    async def _collect_data_at_interval(self, interval):
         while self.running:
             current_time = time.time() - self.start_time  # Assuming you want to track time relative to start
             # Create a dictionary with the structure of all_data
@@ -381,7 +406,8 @@ class ODriveCAN:
             }
             # Here, instead of just printing, you append the snapshot to the collected_data list
             self.collected_data.append((current_time, formatted_data))
-            print(f"Collected Data at {current_time}: {formatted_data}")
+            self.telemetry.log(current_time, *(nan if value is None else value
+                                               for pair in formatted_data.values() for value in pair))
             await asyncio.sleep(interval)
 
 
@@ -431,10 +457,15 @@ class ODriveCAN:
 
 
 
-    async def collect_and_store_data(self, trial_id):
+    async def collect_and_store_data(self, trial_id, timer=None):
         """
         Collects data from the ODrive and stores it in the database asynchronously.
 
+        Para:
+            trial_id (int): Trial the row is stored under.
+            timer (LoopTimer): Records the "read" and "db" phases when given, its cycle must already be start()ed
+                (data_collection_loop passes self.timer). Direct calls leave it out.
+
         Example:
             >>> await odrive_can.collect_and_store_data()
         """
@@ -444,6 +475,8 @@ class ODriveCAN:
         bus_voltage_current = await self.get_one_bus_voltage_current(timeout=1.0)
         iq_setpoint_measured = await self.get_one_iq_setpoint_measured(timeout=1.0)
         powers = await self.get_one_powers(timeout=1.0)
+        if timer is not None:
+            timer.mark(0)  # read
 
         # Use datetime to format the current time as a string
         #current_time = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
@@ -470,6 +503,8 @@ class ODriveCAN:
             torque_target, torque_estimate, bus_voltage, bus_current, 
             iq_setpoint, iq_measured, electrical_power, mechanical_power
         )
+        if timer is not None:
+            timer.mark(1)  # db
     
 
 
@@ -496,7 +531,9 @@ class ODriveCAN:
             >>> await odrive_can.data_collection_loop(0.2, next_trial_id)
         """
         while True:
-            await self.collect_and_store_data(next_trial_id)
+            self.timer.start()
+            await self.collect_and_store_data(next_trial_id, self.timer)
+            self.timer.end_cycle()
             await asyncio.sleep(interval)
 
 
@@ -562,6 +599,7 @@ async def main():
         await data_collection_task
     except asyncio.CancelledError:
         pass  # Task cancellation is expected
+    print(odrive_can.timer.report(f"O-Drive {nodeID} data collection timing"))
 
     # Upload collected data to the database
     if hasattr(odrive_can, 'collected_data') and odrive_can.collected_data:
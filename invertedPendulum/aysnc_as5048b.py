@@ -4,7 +4,18 @@ from datetime import datetime, timedelta
 import pyodrivecan
 import time
 
-from smbus import SMBus
+
+def default_bus():
+    """
+    The encoder's I2C bus: LSM9DS1/i2c_backends.open_bus() when it is importable (so I2C_BACKEND=sim runs without the
+    hardware, with LSM9DS1 on PYTHONPATH), otherwise smbus.SMBus(1). smbus is only imported when it is needed.
+    """
+    try:
+        from i2c_backends import open_bus
+    except ImportError:
+        from smbus import SMBus
+        return SMBus(1)
+    return open_bus()
 
 
 @dataclass
@@ -13,14 +24,14 @@ class Encoder_as5048b:
     A class to represent an AS5048B magnetic rotary encoder.
 
     Attributes:
-    - bus (SMBus): The SMBus object for I2C communication.
+    - bus: The SMBus style object for I2C communication (default_bus()).
     - address (int): The I2C address of the AS5048B encoder.
     - angle_reg (int): The register address to read the angle from.
     - angle (float): The latest read angle value after offset adjustment.
     - offset (float): The calibrated offset value for the angle.
     - running (bool): Flag to control the asynchronous angle reading loop.
     """
-    bus: SMBus = field(default_factory=lambda: SMBus(1))
+    bus: object = field(default_factory=default_bus)
     address: int = 0x40    # AS5048B default address
     angle_reg: int = 0xFE  # AS5048B Register
     angle: float = 0.0     # Initialized angle
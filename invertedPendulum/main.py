@@ -3,6 +3,7 @@ import asyncio
 from datetime import datetime, timedelta
 import aysnc_as5048b
 import pid
+from telemetry_logger import TelemetryLogger
 
 
 
@@ -41,7 +42,7 @@ def clamp(x, lower, upper):
 
 
 #Example of how you can create a controller to get data from the O-Drives and then send motor comands based on that data.
-async def controller(odrive1, encoder, pid):
+async def controller(odrive1, encoder, pid, telemetry):
         odrive1.clear_errors(identify=False)
         await asyncio.sleep(0.2)
         odrive1.setAxisState("closed_loop_control")
@@ -70,7 +71,7 @@ async def controller(odrive1, encoder, pid):
 
             #Input the current encoder angle into the PID Controller and get its pid_output
             pid_output = pid.update(current_value=current_angle)
-            print(f"PID Output: {pid_output}, Current Angle: {current_angle}")
+            telemetry.log(pid_output, current_angle)
 
             #Send pid_output to control motor Torque
             odrive1.set_torque(- pid_output)
@@ -78,6 +79,7 @@ async def controller(odrive1, encoder, pid):
             
         #await asyncio.sleep(15) #no longer need this the timedelta =15 runs the program for 15 seconds.
         odrive1.running = False
+        telemetry.running = False
         odrive1.estop()
 
 
@@ -122,15 +124,21 @@ async def main():
     #Upload PID parameters and notes to database
     upload_pid_parameters(database, pid_table_name, pid_data)
 
+    #Console output at 5 lines per second instead of every cycle
+    telemetry = TelemetryLogger(("PID Output", "Current Angle"), display_rate=5)
+
     try:
         #add each odrive to the async loop so they will run.
         await asyncio.gather(
             odrive1.loop(),
-            controller(odrive1, encoder, my_pid), 
+            controller(odrive1, encoder, my_pid, telemetry), 
             encoder.loop(), #This runs the external encoder code
+            telemetry.loop(), #This prints the controller telemetry
         )
     except KeyboardInterrupt:
          odrive1.estop()
+    finally:
+        print(telemetry.summary())
 
 
 
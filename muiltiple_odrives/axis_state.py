@@ -0,0 +1,274 @@
+import argparse
+import asyncio
+import random
+import struct
+import time
+
+import can
+
+
+"""
+Concurrent axis state transitions for several O-Drives.
+
+set_control_state() in the scripts sends Set_Axis_State to one node, then iterates `for msg in bus` until that node's
+heartbeat reports CLOSED_LOOP_CONTROL - with no timeout, and one node after the other. AxisStateManager sends
+Set_Axis_State to every node back to back, then waits for all the heartbeats at once, each with a deadline, so
+bringing up N axes takes about one heartbeat period (100 ms by default) instead of N, and an absent or faulted node
+is reported instead of hanging the script.
+"""
+
+
+SET_AXIS_STATE_CMD = 0x07
+HEARTBEAT_CMD = 0x01
+CLEAR_ERRORS_CMD = 0x18
+
+# AxisState
+IDLE = 1
+FULL_CALIBRATION_SEQUENCE = 3
+CLOSED_LOOP_CONTROL = 8
+
+_HEARTBEAT = struct.Struct('<IBBB')
+_STATE = struct.Struct('<I')
+
+
+
+class AxisStateResult:
+    """
+    Outcome of one node's transition.
+
+    Attributes:
+    - node_id (int): CAN node ID.
+    - ok (bool): The heartbeat reported the requested state before the deadline.
+    - state (int or None): Last reported axis state, None if no heartbeat arrived.
+    - axis_error, procedure_result (int or None): From the last heartbeat.
+    - seconds (float): Time from sending the request to the result.
+    - reason (str): "ok", "timeout", "no heartbeat" or "error 0x...".
+    """
+    __slots__ = ("node_id", "ok", "state", "axis_error", "procedure_result", "seconds", "reason")
+
+    def __init__(self, node_id, ok, state, axis_error, procedure_result, seconds, reason):
+        self.node_id = node_id
+        self.ok = ok
+        self.state = state
+        self.axis_error = axis_error
+        self.procedure_result = procedure_result
+        self.seconds = seconds
+        self.reason = reason
+
+
+    def __repr__(self):
+        return f"AxisStateResult(node_id={self.node_id}, ok={self.ok}, state={self.state}, reason={self.reason!r}, seconds={self.seconds:.3f})"
+
+
+
+class AxisStateManager(can.Listener):
+    """
+    Sends Set_Axis_State to several nodes and awaits their heartbeat transitions concurrently.
+
+    Use as an async context manager (it listens to heartbeats on a can.Notifier, its own or an existing one).
+
+    Example:
+        >>> async with AxisStateManager(bus) as manager:
+        ...     results = await manager.set_state([0, 1, 2], CLOSED_LOOP_CONTROL, timeout=1.0)
+        ...     failed = [r for r in results.values() if not r.ok]
+    """
+
+    def __init__(self, bus, notifier=None):
+        """
+        Parameters:
+        - bus: python-can bus.
+        - notifier: Existing can.Notifier to listen on, default a new one.
+        """
+        self.bus = bus
+        self.heartbeats = {}  # node_id -> (axis_error, state, procedure_result, trajectory_done)
+        self._notifier = notifier
+        self._own_notifier = notifier is None
+        self._loop = None
+        self._waiters = {}    # node_id -> callback(heartbeat), set while a transition is pending
+
+
+    async def __aenter__(self):
+        self._loop = asyncio.get_running_loop()
+        if self._own_notifier:
+            self._notifier = can.Notifier(self.bus, [self])
+        else:
+            self._notifier.add_listener(self)
+        return self
+
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        if self._own_notifier:
+            self._notifier.stop()
+        else:
+            self._notifier.remove_listener(self)
+
+
+    def on_message_received(self, msg):
+        """Runs in the notifier thread."""
+        if msg.arbitration_id & 0x1F == HEARTBEAT_CMD and not msg.is_remote_frame and len(msg.data) >= 7:
+            self._loop.call_soon_threadsafe(self._on_heartbeat, msg.arbitration_id >> 5, _HEARTBEAT.unpack_from(msg.data))
+
+
+    def _on_heartbeat(self, node_id, heartbeat):
+        self.heartbeats[node_id] = heartbeat
+        waiter = self._waiters.get(node_id)
+        if waiter is not None:
+            waiter(heartbeat)
+
+
+    def send_state(self, node_id, state):
+        self.bus.send(can.Message(arbitration_id=(node_id << 5 | SET_AXIS_STATE_CMD), data=_STATE.pack(state),
+                                  is_extended_id=False))
+
+
+    def clear_errors(self, node_id):
+        self.bus.send(can.Message(arbitration_id=(node_id << 5 | CLEAR_ERRORS_CMD), data=b'\x00', is_extended_id=False))
+
+
+    async def _await_state(self, node_id, state, sent_at, deadline):
+        future = self._loop.create_future()
+        heartbeats = 0
+
+        def on_heartbeat(heartbeat):
+            nonlocal heartbeats
+            heartbeats += 1
+            axis_error, axis_state, procedure_result, _ = heartbeat
+            if future.done():
+                return
+            if axis_state == state:
+                future.set_result("ok")
+            # The first heartbeat may predate the request, only later ones can report it failed
+            elif heartbeats > 1 and axis_error:
+                future.set_result(f"error 0x{axis_error:08X}")
+
+        self._waiters[node_id] = on_heartbeat
+        try:
+            reason = await asyncio.wait_for(future, max(0.0, deadline - time.perf_counter()))
+        except asyncio.TimeoutError:
+            reason = "timeout" if heartbeats else "no heartbeat"
+        finally:
+            del self._waiters[node_id]
+
+        heartbeat = self.heartbeats.get(node_id) if heartbeats else None
+        axis_error, axis_state, procedure_result, _ = heartbeat if heartbeat is not None else (None, None, None, None)
+        return AxisStateResult(node_id, reason == "ok", axis_state, axis_error, procedure_result,
+                               time.perf_counter() - sent_at, reason)
+
+
+    async def set_state(self, node_ids, state=CLOSED_LOOP_CONTROL, timeout=1.0, clear_errors=False):
+        """
+        Requests `state` on every node at once and waits for all their heartbeats to report it.
+
+        Parameters:
+        - node_ids: Nodes to transition.
+        - state: Requested AxisState, default CLOSED_LOOP_CONTROL (8).
+        - timeout: Seconds every node gets (they wait concurrently, so this is also the worst case total).
+        - clear_errors: Send Clear_Errors to every node first.
+
+        Returns:
+        - {node_id: AxisStateResult}
+        """
+        node_ids = list(node_ids)
+        if clear_errors:
+            for node_id in node_ids:
+                self.clear_errors(node_id)
+        sent_at = time.perf_counter()
+        deadline = sent_at + timeout
+        # Register the waiters before sending, a fast node may answer before the last request is out
+        waits = [asyncio.ensure_future(self._await_state(node_id, state, sent_at, deadline)) for node_id in node_ids]
+        await asyncio.sleep(0)
+        for node_id in node_ids:
+            self.send_state(node_id, state)
+        return {result.node_id: result for result in await asyncio.gather(*waits)}
+
+
+    async def idle_all(self, node_ids, timeout=1.0):
+        """set_state(node_ids, IDLE): the shutdown counterpart of a closed loop bring up."""
+        return await self.set_state(node_ids, IDLE, timeout)
+
+
+
+def set_state_blocking(bus, node_ids, state=CLOSED_LOOP_CONTROL, timeout=1.0, clear_errors=False):
+    """
+    AxisStateManager.set_state() for the non async scripts (replaces looping set_control_state(node_id)).
+
+    Example:
+        >>> results = set_state_blocking(bus, odrive_node_ids)
+        >>> for result in results.values():
+        ...     print(result)
+    """
+    async def run():
+        async with AxisStateManager(bus) as manager:
+            return await manager.set_state(node_ids, state, timeout, clear_errors)
+    return asyncio.run(run())
+
+
+
+#---------------------------------------- Simulated Nodes START -------------------------------------------------
+
+async def _simulated_node(bus, node_id, duration, fault=False, rate=0.1):
+    """Heartbeats every `rate` s (at a random phase), enters a requested state after 5 - 30 ms (or faults)."""
+    state, error = IDLE, 0
+    stop_at = time.perf_counter() + duration
+    next_heartbeat = time.perf_counter() + random.uniform(0, rate)
+    while time.perf_counter() < stop_at:
+        await asyncio.sleep(0.001)
+        message = bus.recv(timeout=0)
+        while message is not None:
+            if message.arbitration_id == (node_id << 5 | SET_AXIS_STATE_CMD):
+                requested = _STATE.unpack(message.data)[0]
+                await asyncio.sleep(random.uniform(0.005, 0.03))
+                state, error = (IDLE, 0x800) if fault and requested == CLOSED_LOOP_CONTROL else (requested, 0)
+            message = bus.recv(timeout=0)
+        if time.perf_counter() >= next_heartbeat:
+            next_heartbeat += rate
+            bus.send(can.Message(arbitration_id=(node_id << 5 | HEARTBEAT_CMD),
+                                 data=_HEARTBEAT.pack(error, state, 0, 1) + b'\x00', is_extended_id=False))
+
+#---------------------------------------- Simulated Nodes END -------------------------------------------------
+
+
+
+async def main(nodes):
+    bus = can.interface.Bus("axis_state_sim", interface="virtual")
+    # Nodes 0..nodes-1 are healthy, one more faults on entry and one more is missing
+    node_buses = [can.interface.Bus("axis_state_sim", interface="virtual") for _ in range(nodes + 1)]
+    simulated = [_simulated_node(node_buses[k], k, 2.0, fault=(k == nodes)) for k in range(nodes + 1)]
+
+    async def bring_up():
+        await asyncio.sleep(0.3)
+        async with AxisStateManager(bus) as manager:
+            start = time.perf_counter()
+            results = await manager.set_state(range(nodes + 2), CLOSED_LOOP_CONTROL, timeout=0.5)
+            print(f"{nodes + 2} nodes requested, done in {(time.perf_counter() - start) * 1e3:.0f} ms:")
+            for result in results.values():
+                print(f"  {result}")
+
+    await asyncio.gather(bring_up(), *simulated)
+    for b in [bus] + node_buses:
+        b.shutdown()
+
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Concurrent closed loop bring up against simulated O-Drives.')
+    parser.add_argument('--nodes', type=int, default=8, help='Healthy simulated nodes. Default is 8.')
+    args = parser.parse_args()
+    asyncio.run(main(args.nodes))
+
+
+
+"""
+Example
+
+import can
+import axis_state
+
+bus = can.interface.Bus("can0", bustype="socketcan")
+odrive_node_ids = [0, 1, 2]
+
+results = axis_state.set_state_blocking(bus, odrive_node_ids, axis_state.CLOSED_LOOP_CONTROL, timeout=1.0)
+missing = [node_id for node_id, result in results.items() if not result.ok]
+if missing:
+    print(f"Not in closed loop: {[results[node_id] for node_id in missing]}")
+"""
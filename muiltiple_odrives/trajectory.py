@@ -0,0 +1,472 @@
+import argparse
+import asyncio
+import math
+import time
+
+import can
+import numpy as np
+
+
+"""
+Trajectory generator and fixed rate setpoint streamer for several O-Drives.
+
+Profiles (trapezoidal, S-curve, sine, cubic spline) are computed once as NumPy arrays of position, velocity and
+acceleration for every axis. TrajectoryStreamer then packs every CAN frame of the whole move up front (Set_Input_Pos with
+velocity / torque feedforward, or Set_Input_Vel with torque feedforward) so streaming at a few hundred Hz is only
+bus.send() calls on an absolute deadline, no per-step math.
+
+Units follow the O-Drive: positions in turns, velocities in turns/s, accelerations in turns/s^2, torques in Nm.
+Multi axis moves are synchronised: every axis starts and finishes together, each within its own limits.
+"""
+
+
+# CAN command ids (node_id << 5 | cmd)
+SET_INPUT_POS = 0x0C
+SET_INPUT_VEL = 0x0D
+
+# Set_Input_Pos carries the feedforward terms as int16 in units of 0.001 turns/s and 0.001 Nm
+FEEDFORWARD_SCALE = 1000
+INT16_MAX = 32767
+
+
+#---------------------------------------- Trajectory START -------------------------------------------------
+
+class Trajectory:
+    """
+    A sampled multi axis trajectory.
+
+    Attributes:
+    - time (np.ndarray): (N,) sample times in seconds, starting at 0.
+    - position, velocity, acceleration (np.ndarray): (N x axes) arrays.
+    - rate (float): Sample rate in Hz.
+    """
+    __slots__ = ("time", "position", "velocity", "acceleration", "rate")
+
+    def __init__(self, position, velocity, acceleration, rate):
+        self.position = np.atleast_2d(np.asarray(position, dtype=np.float64).T).T
+        self.velocity = np.atleast_2d(np.asarray(velocity, dtype=np.float64).T).T
+        self.acceleration = np.atleast_2d(np.asarray(acceleration, dtype=np.float64).T).T
+        self.rate = float(rate)
+        self.time = np.arange(len(self.position)) / self.rate
+
+
+    def __len__(self):
+        return len(self.position)
+
+
+    @property
+    def axes(self):
+        return self.position.shape[1]
+
+
+    @property
+    def duration(self):
+        return (len(self) - 1) / self.rate
+
+
+    def then(self, other):
+        """This trajectory followed by `other` (same rate and axes), `other` is offset to start where this one ends."""
+        if other.rate != self.rate or other.axes != self.axes:
+            raise ValueError("Trajectories must have the same rate and number of axes to be joined")
+        offset = self.position[-1] - other.position[0]
+        return Trajectory(np.vstack((self.position, other.position[1:] + offset)),
+                          np.vstack((self.velocity, other.velocity[1:])),
+                          np.vstack((self.acceleration, other.acceleration[1:])), self.rate)
+
+
+    def torque_feedforward(self, inertia, friction=0.0):
+        """
+        Feedforward torque of every sample: inertia * acceleration + friction * sign(velocity).
+
+        Parameters:
+        - inertia: Reflected inertia per axis in Nm / (turns/s^2) (scalar or per axis).
+        - friction: Coulomb friction torque per axis in Nm.
+
+        Returns:
+        - (N x axes) array in Nm.
+        """
+        return np.asarray(inertia) * self.acceleration + np.asarray(friction) * np.sign(self.velocity)
+
+
+
+def _axes(start, end):
+    start = np.atleast_1d(np.asarray(start, dtype=np.float64))
+    end = np.atleast_1d(np.asarray(end, dtype=np.float64))
+    start, end = np.broadcast_arrays(start, end)
+    return start, end, end - start
+
+
+def _normalised_limit(limit, distance):
+    """Smallest per unit distance limit over the moving axes, so one shared profile keeps every axis in its limits."""
+    limit = np.broadcast_to(np.asarray(limit, dtype=np.float64), distance.shape)
+    moving = np.abs(distance) > 0
+    if not moving.any():
+        return math.inf
+    return float(np.min(limit[moving] / np.abs(distance[moving])))
+
+
+def _scale(profile_s, profile_v, profile_a, start, distance, rate):
+    """Maps a unit profile s(t) in [0, 1] onto every axis."""
+    return Trajectory(start + np.outer(profile_s, distance), np.outer(profile_v, distance), np.outer(profile_a, distance), rate)
+
+
+def trapezoidal(start, end, max_velocity, max_acceleration, rate=200.0):
+    """
+    Rest to rest trapezoidal (or triangular, if max_velocity is never reached) velocity profile.
+
+    Parameters:
+    - start, end: Start and end positions per axis in turns (scalars or one per axis).
+    - max_velocity, max_acceleration: Limits per axis (scalars or one per axis).
+    - rate: Sample rate in Hz.
+
+    Returns:
+    - Trajectory.
+
+    Example:
+        >>> traj = trapezoidal([0, 0, 0], [10, 5, -2], max_velocity=5, max_acceleration=20)
+    """
+    start, end, distance = _axes(start, end)
+    v = _normalised_limit(max_velocity, distance)
+    a = _normalised_limit(max_acceleration, distance)
+    if math.isinf(v):
+        return _scale(np.zeros(1), np.zeros(1), np.zeros(1), start, distance, rate)
+
+    # Unit distance: accelerate for t_a, cruise for t_c
+    t_a = v / a
+    if v * t_a > 1.0:
+        t_a = math.sqrt(1.0 / a)
+        v = a * t_a
+    t_c = (1.0 - v * t_a) / v
+    total = 2 * t_a + t_c
+
+    t = np.arange(int(math.ceil(total * rate)) + 1) / rate
+    t = np.minimum(t, total)
+    t_d = np.maximum(t - t_a - t_c, 0.0)  # time into deceleration
+    s = np.where(t < t_a, 0.5 * a * t ** 2,
+                 np.where(t < t_a + t_c, 0.5 * a * t_a ** 2 + v * (t - t_a), 0.5 * a * t_a ** 2 + v * t_c + v * t_d - 0.5 * a * t_d ** 2))
+    sv = np.where(t < t_a, a * t, np.where(t < t_a + t_c, v, v - a * t_d))
+    sa = np.where(t < t_a, a, np.where(t < t_a + t_c, 0.0, -a))
+    s[-1], sv[-1], sa[-1] = 1.0, 0.0, 0.0
+    return _scale(s, sv, sa, start, distance, rate)
+
+
+def _s_curve_accel_phase(v, a, j):
+    """Duration of a jerk limited 0 -> v ramp and its jerk time (a is reduced if it is never reached)."""
+    if v * j >= a * a:
+        t_j = a / j
+        return t_j + v / a, t_j
+    t_j = math.sqrt(v / j)
+    return 2 * t_j, t_j
+
+
+def s_curve(start, end, max_velocity, max_acceleration, max_jerk, rate=200.0):
+    """
+    Rest to rest jerk limited (7 segment S-curve) profile, smooth acceleration so no torque steps.
+
+    Parameters:
+    - start, end: Start and end positions per axis in turns.
+    - max_velocity, max_acceleration, max_jerk: Limits per axis.
+    - rate: Sample rate in Hz.
+
+    Returns:
+    - Trajectory.
+    """
+    start, end, distance = _axes(start, end)
+    v = _normalised_limit(max_velocity, distance)
+    a = _normalised_limit(max_acceleration, distance)
+    j = _normalised_limit(max_jerk, distance)
+    if math.isinf(v):
+        return _scale(np.zeros(1), np.zeros(1), np.zeros(1), start, distance, rate)
+
+    # The ramp to v covers v * t_acc / 2 (it is symmetric); lower v until both ramps fit in the unit distance
+    t_acc, t_j = _s_curve_accel_phase(v, a, j)
+    if v * t_acc > 1.0:
+        low, high = 0.0, v
+        for _ in range(60):
+            v = 0.5 * (low + high)
+            t_acc, t_j = _s_curve_accel_phase(v, a, j)
+            low, high = (v, high) if v * t_acc <= 1.0 else (low, v)
+        v = low
+        t_acc, t_j = _s_curve_accel_phase(v, a, j)
+    a_peak = j * t_j
+    t_cruise = (1.0 - v * t_acc) / v
+    total = 2 * t_acc + t_cruise
+
+    # Acceleration is piecewise linear: build it on a fine grid and integrate
+    oversample = 10
+    fine = np.linspace(0.0, total, int(math.ceil(total * rate)) * oversample + 1)
+    tau = np.where(fine < t_acc, fine, np.where(fine < t_acc + t_cruise, -1.0, total - fine))
+    ramp = np.minimum(np.minimum(tau, t_acc - tau), t_j) * j
+    ramp = np.minimum(ramp, a_peak)
+    acc = np.where(tau < 0, 0.0, np.where(fine < t_acc, ramp, -ramp))
+    dt = fine[1] - fine[0]
+    vel = np.concatenate(([0.0], np.cumsum(0.5 * (acc[1:] + acc[:-1]) * dt)))
+    pos = np.concatenate(([0.0], np.cumsum(0.5 * (vel[1:] + vel[:-1]) * dt)))
+    pos /= pos[-1]  # remove the integration error so the move ends exactly on target
+
+    t = np.minimum(np.arange(int(math.ceil(total * rate)) + 1) / rate, total)
+    s, sv, sa = (np.interp(t, fine, x) for x in (pos, vel, acc))
+    s[-1], sv[-1], sa[-1] = 1.0, 0.0, 0.0
+    return _scale(s, sv, sa, start, distance, rate)
+
+
+def sine(amplitude, frequency, duration, offset=0.0, phase=0.0, rate=200.0):
+    """
+    offset + amplitude * sin(2 pi f t + phase) per axis (like random_testing/all_sin_wave_test.py, but exact).
+
+    Parameters:
+    - amplitude, frequency, offset, phase: Per axis (scalars or one per axis), frequency in Hz, phase in radians.
+    - duration: Seconds.
+    - rate: Sample rate in Hz.
+
+    Returns:
+    - Trajectory.
+    """
+    amplitude, frequency, offset, phase = np.broadcast_arrays(*(np.atleast_1d(np.asarray(x, dtype=np.float64))
+                                                                for x in (amplitude, frequency, offset, phase)))
+    t = (np.arange(int(math.ceil(duration * rate)) + 1) / rate)[:, None]
+    w = 2 * math.pi * frequency
+    angle = w * t + phase
+    return Trajectory(offset + amplitude * np.sin(angle), amplitude * w * np.cos(angle), -amplitude * w * w * np.sin(angle), rate)
+
+
+def spline(times, waypoints, rate=200.0, end_velocity=0.0):
+    """
+    Clamped cubic spline through waypoints (zero velocity at both ends by default).
+
+    Parameters:
+    - times: (M,) increasing waypoint times in seconds, starting at 0.
+    - waypoints: (M,) or (M x axes) positions in turns.
+    - rate: Sample rate in Hz.
+    - end_velocity: Velocity at the first and last waypoint.
+
+    Returns:
+    - Trajectory.
+    """
+    times = np.asarray(times, dtype=np.float64)
+    y = np.asarray(waypoints, dtype=np.float64)
+    y = y[:, None] if y.ndim == 1 else y
+    m = len(times)
+    h = np.diff(times)
+    slope = np.diff(y, axis=0) / h[:, None]
+
+    # Tridiagonal system for the second derivatives (clamped ends), solved for all axes at once
+    system = np.zeros((m, m))
+    rhs = np.zeros((m, y.shape[1]))
+    system[0, 0], system[0, 1] = 2 * h[0], h[0]
+    rhs[0] = 6 * (slope[0] - end_velocity)
+    system[-1, -2], system[-1, -1] = h[-1], 2 * h[-1]
+    rhs[-1] = 6 * (end_velocity - slope[-1])
+    for i in range(1, m - 1):
+        system[i, i - 1], system[i, i], system[i, i + 1] = h[i - 1], 2 * (h[i - 1] + h[i]), h[i]
+        rhs[i] = 6 * (slope[i] - slope[i - 1])
+    second = np.linalg.solve(system, rhs)
+
+    t = np.minimum(np.arange(int(math.ceil(times[-1] * rate)) + 1) / rate, times[-1])
+    k = np.clip(np.searchsorted(times, t, side="right") - 1, 0, m - 2)
+    dt = (t - times[k])[:, None]
+    hk = h[k][:, None]
+    m0, m1 = second[k], second[k + 1]
+    b = slope[k] - hk * (2 * m0 + m1) / 6
+    position = y[k] + b * dt + m0 / 2 * dt ** 2 + (m1 - m0) / (6 * hk) * dt ** 3
+    velocity = b + m0 * dt + (m1 - m0) / (2 * hk) * dt ** 2
+    acceleration = m0 + (m1 - m0) / hk * dt
+    return Trajectory(position, velocity, acceleration, rate)
+
+#---------------------------------------- Trajectory END -------------------------------------------------
+
+
+
+#---------------------------------------- Streaming START -------------------------------------------------
+
+def _feedforward_counts(values, name, unit):
+    """Scales a feedforward array to Set_Input_Pos's int16 0.001 units, raises ValueError if it does not fit."""
+    counts = np.round(values * FEEDFORWARD_SCALE)
+    peak = np.abs(counts).max(initial=0.0)
+    if peak > INT16_MAX:
+        raise ValueError(f"Peak {name} feedforward {peak / FEEDFORWARD_SCALE:.3f} {unit} does not fit Set_Input_Pos "
+                         f"(max {INT16_MAX / FEEDFORWARD_SCALE:.3f} {unit}), slow the trajectory down or use velocity mode")
+    return counts
+
+
+class TrajectoryStreamer:
+    """
+    Streams a Trajectory to several O-Drives at its sample rate, one frame per axis per tick.
+
+    Every frame is built in __init__, so a tick is only bus.send() for each axis.
+
+    Attributes:
+    - running (bool): Set to False to stop streaming early.
+    - sent (int): Ticks sent so far.
+    - late (int): Ticks that started more than one period late.
+    - max_lateness (float): Worst tick start lateness in seconds.
+    """
+    __slots__ = ("bus", "node_ids", "mode", "rate", "frames", "running", "sent", "late", "max_lateness")
+
+    def __init__(self, bus, node_ids, trajectory, mode="position", torque_feedforward=None, velocity_feedforward=True):
+        """
+        Parameters:
+        - bus: python-can bus (e.g. ODriveCAN.canBus).
+        - node_ids: One node id per trajectory axis.
+        - trajectory: Trajectory to stream.
+        - mode: "position" (Set_Input_Pos, O-Drive in position control with input mode passthrough) or "velocity"
+          (Set_Input_Vel, velocity control).
+        - torque_feedforward: (N x axes) torques in Nm, e.g. trajectory.torque_feedforward(inertia), None for none.
+        - velocity_feedforward: Send the trajectory velocity as feedforward in position mode.
+
+        In position mode the feedforward terms must fit Set_Input_Pos's int16 fields (+-32.767 turns/s and +-32.767 Nm),
+        a ValueError is raised instead of clipping them.
+        """
+        if len(node_ids) != trajectory.axes:
+            raise ValueError(f"{len(node_ids)} node ids for a {trajectory.axes} axis trajectory")
+        self.bus = bus
+        self.node_ids = list(node_ids)
+        self.mode = mode
+        self.rate = trajectory.rate
+        n = len(trajectory)
+        torque = np.zeros((n, trajectory.axes)) if torque_feedforward is None else np.asarray(torque_feedforward, dtype=np.float64)
+
+        if mode == "position":
+            # '<fhh' like ODriveCAN.set_position, with the feedforward terms scaled to the protocol's int16 units
+            payload = np.zeros((n, trajectory.axes), dtype=[("position", "<f4"), ("velocity", "<i2"), ("torque", "<i2")])
+            payload["position"] = trajectory.position
+            if velocity_feedforward:
+                payload["velocity"] = _feedforward_counts(trajectory.velocity, "velocity", "turns/s")
+            payload["torque"] = _feedforward_counts(torque, "torque", "Nm")
+            command = SET_INPUT_POS
+        elif mode == "velocity":
+            # '<ff' like ODriveCAN.set_velocity
+            payload = np.zeros((n, trajectory.axes), dtype=[("velocity", "<f4"), ("torque", "<f4")])
+            payload["velocity"] = trajectory.velocity
+            payload["torque"] = torque
+            command = SET_INPUT_VEL
+        else:
+            raise ValueError(f"Unknown mode '{mode}', use 'position' or 'velocity'")
+
+        raw = payload.tobytes()
+        size = payload.dtype.itemsize
+        self.frames = [
+            [can.Message(arbitration_id=(node_id << 5 | command), data=raw[(k * len(self.node_ids) + axis) * size:
+                                                                         (k * len(self.node_ids) + axis + 1) * size],
+                         is_extended_id=False)
+             for axis, node_id in enumerate(self.node_ids)]
+            for k in range(n)
+        ]
+        self.running = True
+        self.sent = 0
+        self.late = 0
+        self.max_lateness = 0.0
+
+
+    def _send(self, k, lateness):
+        for message in self.frames[k]:
+            self.bus.send(message)
+        self.sent += 1
+        if lateness > self.max_lateness:
+            self.max_lateness = lateness
+        if lateness > 1.0 / self.rate:
+            self.late += 1
+
+
+    def run(self, spin=0.0005):
+        """Streams the whole trajectory, blocking. The last setpoint stays active on the O-Drives afterwards."""
+        period = 1.0 / self.rate
+        start = time.perf_counter()
+        for k in range(len(self.frames)):
+            if not self.running:
+                break
+            deadline = start + k * period
+            remaining = deadline - time.perf_counter()
+            if remaining > spin:
+                time.sleep(remaining - spin)
+            while time.perf_counter() < deadline:
+                pass
+            self._send(k, time.perf_counter() - deadline)
+
+
+    async def loop(self):
+        """Streams the whole trajectory inside an asyncio loop (e.g. next to ODriveCAN.loop())."""
+        period = 1.0 / self.rate
+        start = time.perf_counter()
+        for k in range(len(self.frames)):
+            if not self.running:
+                break
+            deadline = start + k * period
+            remaining = deadline - time.perf_counter()
+            await asyncio.sleep(remaining if remaining > 0 else 0)
+            self._send(k, time.perf_counter() - deadline)
+
+
+    def summary(self):
+        return (f"Streamed {self.sent} ticks x {len(self.node_ids)} axes at {self.rate:g} Hz, {self.late} late ticks, "
+                f"max lateness {self.max_lateness * 1e3:.2f} ms")
+
+#---------------------------------------- Streaming END -------------------------------------------------
+
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Generate a trajectory and stream it to O-Drives.')
+    parser.add_argument('--nodes', type=int, nargs='+', default=[0, 1, 2], help='O-Drive node ids, one per axis.')
+    parser.add_argument('--profile', choices=['trapezoidal', 's_curve', 'sine', 'spline'], default='s_curve')
+    parser.add_argument('--mode', choices=['position', 'velocity'], default='position')
+    parser.add_argument('--distance', type=float, default=10.0, help='Move distance in turns (trapezoidal / s_curve).')
+    parser.add_argument('--rate', type=float, default=200.0, help='Stream rate in Hz.')
+    parser.add_argument('--inertia', type=float, default=0.0, help='Reflected inertia for the torque feedforward.')
+    parser.add_argument('--interface', type=str, default='socketcan', help="python-can interface, 'virtual' to dry run.")
+    parser.add_argument('--channel', type=str, default='can0')
+    args = parser.parse_args()
+
+    axes = len(args.nodes)
+    scale = np.linspace(1.0, 0.5, axes)  # different distances per axis to show the synchronisation
+    if args.profile == 'trapezoidal':
+        traj = trapezoidal(np.zeros(axes), args.distance * scale, max_velocity=5.0, max_acceleration=20.0, rate=args.rate)
+    elif args.profile == 's_curve':
+        traj = s_curve(np.zeros(axes), args.distance * scale, max_velocity=5.0, max_acceleration=20.0, max_jerk=200.0, rate=args.rate)
+    elif args.profile == 'sine':
+        traj = sine(amplitude=10 * scale / (2 * math.pi * 0.2), frequency=0.2, duration=10.0, rate=args.rate)
+    else:
+        traj = spline([0, 1, 2.5, 4], np.outer([0, 3, -2, 0], scale), rate=args.rate)
+
+    peak = np.abs(traj.velocity).max(axis=0)
+    print(f"{args.profile}: {len(traj)} samples, {traj.duration:.3f} s, end {np.round(traj.position[-1], 4)} turns, "
+          f"peak velocity {np.round(peak, 3)} turns/s, peak acceleration {np.round(np.abs(traj.acceleration).max(axis=0), 2)} turns/s^2")
+
+    bus = can.interface.Bus(args.channel, interface=args.interface)
+    start = time.perf_counter()
+    streamer = TrajectoryStreamer(bus, args.nodes, traj, mode=args.mode,
+                                  torque_feedforward=traj.torque_feedforward(args.inertia) if args.inertia else None)
+    print(f"Packed {len(traj) * axes} frames in {(time.perf_counter() - start) * 1e3:.1f} ms")
+    try:
+        streamer.run()
+    except KeyboardInterrupt:
+        streamer.running = False
+    finally:
+        print(streamer.summary())
+        bus.shutdown()
+
+
+
+"""
+Example
+
+import pyodrivecan
+import trajectory
+
+odrive1 = pyodrivecan.ODriveCAN(0)
+odrive1.initCanBus()
+odrive2 = pyodrivecan.ODriveCAN(1)
+odrive2.initCanBus()
+
+# Both axes in position control, passthrough input mode, closed loop
+for odrive in (odrive1, odrive2):
+    odrive.set_controller_mode("position_control", "pass_through")
+    odrive.setAxisState("closed_loop_control")
+
+move = trajectory.s_curve([0, 0], [10, 4], max_velocity=5, max_acceleration=20, max_jerk=200, rate=250)
+back = trajectory.s_curve([10, 4], [0, 0], max_velocity=5, max_acceleration=20, max_jerk=200, rate=250)
+streamer = trajectory.TrajectoryStreamer(odrive1.canBus, [0, 1], move.then(back), mode="position",
+                                         torque_feedforward=move.then(back).torque_feedforward(inertia=0.002))
+streamer.run()
+print(streamer.summary())
+"""
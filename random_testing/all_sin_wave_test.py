@@ -7,6 +7,9 @@ import board
 import busio
 import adafruit_lsm9ds1
 
+# trajectory.py lives in muiltiple_odrives/, run from the repository root with PYTHONPATH=muiltiple_odrives
+from trajectory import TrajectoryStreamer, sine
+
 
 """
 This program is to test collecting IMU data, IMU collection speed, Encoder data, and setting the O-Drive motor to velocities in a sin wave with an amplitude of 10. 
@@ -64,28 +67,24 @@ alpha = 0.98
 
 # Global flag to manage threads
 running = True
-# Shared variable to store current set motor velocity
-current_set_velocity = 0.0
+# Motor velocity sin wave: 10 * sin(0.25 t) turns/s, the same wave the old loop stepped through at 5 Hz
+# (t += 0.05 every 0.2 s). One period is precomputed and streamed as Set_Input_Vel frames at stream_rate.
+amplitude = 10  # turns/s
+angular_frequency = 0.25  # rad/s, larger value = faster sine wave
+stream_rate = 50  # Hz
+period = 2 * math.pi / angular_frequency
+velocity_wave = sine(amplitude=amplitude / angular_frequency, frequency=1 / period, duration=period - 1 / stream_rate,
+                     phase=-math.pi / 2, rate=stream_rate)
+streamer = TrajectoryStreamer(bus, [node_id], velocity_wave, mode="velocity")
+
+# Current set motor velocity, the last frame the streamer sent
+def current_set_velocity():
+    return velocity_wave.velocity[(streamer.sent - 1) % len(velocity_wave), 0]
 
 # Set motor velocity to sin wave
 def set_vel():
-    global current_set_velocity
-    t = 0
-    while running:
-        velocity = 10 * math.sin(t)  # Multiply by 10 for amplitude
-        current_set_velocity = velocity
-        bus.send(can.Message(
-            arbitration_id=(node_id << 5 | 0x0d),
-            data=struct.pack('<ff', float(velocity), 0.0),
-            is_extended_id=False
-        ))
-        t += 0.05  # Adjust this value to change the step of the sine wave. Smaller value = slower sine wave.
-        time.sleep(0.2)  # Adjust sleep time to make the loop run slower
-
-# Print encoder feedback and IMU roll angle
-def get_pos_vel_and_imu_roll():
-    global previous_time, current_set_velocity  # Add current_set_velocity here
-
+    while running and streamer.running:
+        streamer.run()
 
 # Print encoder feedback and IMU roll angle
 def get_pos_vel_and_imu_roll():
@@ -112,7 +111,7 @@ def get_pos_vel_and_imu_roll():
         msg = bus.recv(timeout=0.01)
         if msg and msg.arbitration_id == (node_id << 5 | 0x09):
             pos, vel = struct.unpack('<ff', bytes(msg.data))
-            print(f"Roll: {angle_roll:.2f} degrees, IMU Speed: {read_count/10:.2f} Hz, Set Vel: {current_set_velocity:.3f} [turns/s], pos: {pos:.3f} [turns], vel: {vel:.3f} [turns/s]")
+            print(f"Roll: {angle_roll:.2f} degrees, IMU Speed: {read_count/10:.2f} Hz, Set Vel: {current_set_velocity():.3f} [turns/s], pos: {pos:.3f} [turns], vel: {vel:.3f} [turns/s]")
 
 
             read_count += 1
@@ -136,6 +135,7 @@ try:
 
 except KeyboardInterrupt:
     running = False
+    streamer.running = False
     vel_thread.join()
     data_thread.join()
     
@@ -7,6 +7,9 @@ import threading
 import can
 import struct
 
+# imu_calibration.py lives in LSM9DS1/, run from the repository root with PYTHONPATH=LSM9DS1
+from imu_calibration import GyroBiasEstimator
+
 # IMU initialization
 i2c = board.I2C()
 sensor = adafruit_lsm9ds1.LSM9DS1_I2C(i2c)
@@ -33,19 +36,11 @@ imu_read_count = 0
 imu_read_rate = 0
 running = True
 
-# IMU Calibration
-print("Calibrating LSM9DS1. Please keep the sensor stable...")
-calibration_duration = 15
-calibration_data = {"gyro_total": [0, 0, 0], "sample_count": 0}
-start_time = time.monotonic()
-while time.monotonic() - start_time < calibration_duration:
-    gyro_x, gyro_y, gyro_z = sensor.gyro
-    calibration_data["gyro_total"][0] += gyro_x
-    calibration_data["gyro_total"][1] += gyro_y
-    calibration_data["gyro_total"][2] += gyro_z
-    calibration_data["sample_count"] += 1
-for i in range(3):
-    calibration_data["gyro_total"][i] /= calibration_data["sample_count"]
+# Gyro calibration: reuse the saved bias and keep refining it while running (see LSM9DS1/imu_calibration.py)
+calibration = GyroBiasEstimator('imu_calibration.json')
+if not calibration.load():
+    print("No saved IMU calibration found. Keep the sensor stable for half a second...")
+    calibration.quick_start(sensor, duration=0.5)
 
 print("Calibration complete. Begin reading angles...")
 
@@ -56,13 +51,11 @@ def read_and_print_roll():
         current_time = time.monotonic()
         elapsed_time = current_time - previous_time
 
-        accel_x, accel_y, accel_z = sensor.acceleration
-        gyro_x, gyro_y, gyro_z = sensor.gyro
+        accel = sensor.acceleration
 
-        # Subtract the calibration offset from gyro readings
-        gyro_x -= calibration_data["gyro_total"][0]
-        gyro_y -= calibration_data["gyro_total"][1]
-        gyro_z -= calibration_data["gyro_total"][2]
+        # Bias corrected gyro, the bias is refined whenever the sensor is stationary
+        gyro_x, gyro_y, gyro_z = calibration.update(sensor.gyro, accel)
+        accel_x, accel_y, accel_z = calibration.correct_accel(accel)
 
         # Calculate pitch and roll from accelerometer
         pitch_acc = math.atan2(accel_x, math.sqrt(accel_y * accel_y + accel_z * accel_z)) * (180 / math.pi)
@@ -117,4 +110,5 @@ try:
 except KeyboardInterrupt:
     running = False
     bus.shutdown()
+    calibration.save()
     print("\nProgram terminated gracefully.")
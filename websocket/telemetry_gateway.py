@@ -0,0 +1,465 @@
+import argparse
+import asyncio
+import json
+import struct
+import time
+
+import numpy as np
+
+
+"""
+Batched binary telemetry gateway for the web dashboard.
+
+basic.py emits one JSON dict per IMU sample and CustomDataStreamer json.dumps every point, which at control rates
+(hundreds of samples per second per signal) floods the socket and the browser. TelemetryGateway instead:
+
+    - takes samples in process from the control loops: publish(stream, t, values) only appends to a list
+    - every `flush_interval` (default 50 ms) packs what each stream collected into one binary frame of typed arrays
+      (float64 start time, float32 time offsets, one float32 array per field) - 4 bytes per value instead of ~20 as JSON
+    - decimates per client: each client asks for a max sample rate per stream when it subscribes
+    - never queues behind a slow client: every client has a small outbox, when it is full the oldest frame is dropped
+      (the dashboard wants the latest data, not a backlog)
+
+Frame layout (little endian), decodable in the browser with DataView / Float32Array:
+
+    uint8 version, uint8 stream id, uint16 count, uint32 sequence, float64 t0,
+    float32[count] t - t0, then float32[count] for each field of the stream
+
+The stream ids and field names are sent once as the JSON "schema" event when a client subscribes. The transport is
+anything with an async send(event, data) per client: attach_socketio() wires it to a python-socketio AsyncServer,
+LocalServer is an in process stand-in for testing.
+"""
+
+
+FRAME_VERSION = 1
+_FRAME_HEADER = struct.Struct('<BBHId')
+_SEQUENCE = struct.Struct('<I')
+_SEQUENCE_OFFSET = 4  # after version, stream id and count
+MAX_BATCH = 65535
+
+
+
+#---------------------------------------- Encoding START -------------------------------------------------
+
+def encode_frame(stream_id, sequence, times, values):
+    """
+    Packs one batch of a stream.
+
+    Parameters:
+    - stream_id: Index of the stream in the schema.
+    - sequence: The client's frame counter of the stream (a gap means frames were dropped for that client).
+    - times: (count,) sample times in seconds.
+    - values: (count x fields) samples.
+
+    Returns:
+    - bytes
+    """
+    times = np.asarray(times, dtype=np.float64)
+    t0 = float(times[0])
+    columns = np.asarray(values, dtype=np.float32).T
+    return b''.join((_FRAME_HEADER.pack(FRAME_VERSION, stream_id, len(times), sequence & 0xFFFFFFFF, t0),
+                     (times - t0).astype('<f4').tobytes(),
+                     np.ascontiguousarray(columns, dtype='<f4').tobytes()))
+
+
+def decode_frame(frame, fields):
+    """
+    Inverse of encode_frame() (what the browser does).
+
+    Returns:
+    - (stream_id, sequence, times (count,), values (count x fields))
+    """
+    version, stream_id, count, sequence, t0 = _FRAME_HEADER.unpack_from(frame)
+    if version != FRAME_VERSION:
+        raise ValueError(f"unknown telemetry frame version {version}")
+    data = np.frombuffer(frame, dtype='<f4', offset=_FRAME_HEADER.size)
+    times = t0 + data[:count].astype(np.float64)
+    values = data[count:count * (fields + 1)].reshape(fields, count).T
+    return stream_id, sequence, times, values
+
+#---------------------------------------- Encoding END -------------------------------------------------
+
+
+
+class _Client:
+    __slots__ = ("sid", "send", "periods", "next_time", "sequence", "outbox", "sent", "dropped", "task")
+
+    def __init__(self, sid, send, periods, outbox_size):
+        self.sid = sid
+        self.send = send
+        self.periods = periods           # stream id -> min seconds between samples (0 = every sample)
+        self.next_time = {}              # stream id -> time of the next sample to forward
+        self.sequence = {}               # stream id -> sequence number of the next frame offered to this client
+        self.outbox = asyncio.Queue(outbox_size)
+        self.sent = 0
+        self.dropped = 0
+        self.task = None
+
+
+
+class TelemetryGateway:
+    """
+    Collects telemetry in process and streams it to dashboard clients as batched binary frames.
+
+    Attributes:
+    - streams (dict): name -> field names, in stream id order.
+    - published (int): Samples published.
+
+    Example:
+        >>> gateway = TelemetryGateway({"imu": ("pitch", "roll"), "odrive": ("position", "velocity", "torque")})
+        >>> gateway.publish("imu", time.monotonic(), (pitch, roll))
+        >>> await gateway.run()
+    """
+
+    def __init__(self, streams, flush_interval=0.05, outbox_size=4, default_rate=None):
+        """
+        Parameters:
+        - streams: {name: (field, ...)}.
+        - flush_interval: Seconds between frames (one frame per stream per client at most).
+        - outbox_size: Frames queued per client before the oldest is dropped.
+        - default_rate: Max samples per second per stream for clients that do not ask, None for every sample.
+        """
+        self.streams = {name: tuple(fields) for name, fields in streams.items()}
+        self.flush_interval = flush_interval
+        self.outbox_size = outbox_size
+        self.default_rate = default_rate
+        self.published = 0
+        self._ids = {name: k for k, name in enumerate(self.streams)}
+        self._widths = [len(fields) for fields in self.streams.values()]
+        self._pending = [[] for _ in self.streams]   # per stream list of (t, values), swapped out on every flush
+        self._clients = {}
+        self._running = False
+
+
+    def schema(self):
+        """The "schema" event payload: stream ids, field names and the frame layout version."""
+        return json.dumps({"version": FRAME_VERSION, "flush_interval": self.flush_interval,
+                           "streams": [{"id": k, "name": name, "fields": list(fields)}
+                                       for k, (name, fields) in enumerate(self.streams.items())]})
+
+
+    def publish(self, stream, t, values):
+        """
+        Adds one sample. Cheap enough for a control loop (one list append). Call it from the event loop's thread.
+
+        Parameters:
+        - stream: Stream name.
+        - t: Sample time in seconds (e.g. time.monotonic()).
+        - values: One value per field of the stream, a ValueError is raised for any other count.
+        """
+        stream_id = self._ids[stream]
+        if len(values) != self._widths[stream_id]:
+            raise ValueError(f"{len(values)} values published to '{stream}', which has {self._widths[stream_id]} fields")
+        self._pending[stream_id].append((t, values))
+        self.published += 1
+
+
+    #---------------------------------------- Clients START -------------------------------------------------
+
+    async def add_client(self, sid, send, rates=None):
+        """
+        Registers a client and sends it the schema.
+
+        Parameters:
+        - sid: Client id.
+        - send: Coroutine function send(event, data) for this client.
+        - rates: {stream name: max samples per second}, negotiated by the client; missing streams use default_rate,
+          a rate of 0 unsubscribes the stream.
+        """
+        # A repeated subscribe replaces the client, its old sender must not keep running
+        await self.remove_client(sid)
+        rates = rates or {}
+        periods = {}
+        for name, stream_id in self._ids.items():
+            rate = rates.get(name, self.default_rate)
+            if rate is None:
+                periods[stream_id] = 0.0
+            elif rate > 0:
+                periods[stream_id] = 1.0 / rate
+        client = self._clients[sid] = _Client(sid, send, periods, self.outbox_size)
+        await send("schema", self.schema())
+        client.task = asyncio.create_task(self._sender(client))
+        return client
+
+
+    async def remove_client(self, sid):
+        client = self._clients.pop(sid, None)
+        if client is not None and client.task is not None:
+            client.task.cancel()
+
+
+    async def _sender(self, client):
+        while True:
+            frame = await client.outbox.get()
+            try:
+                await client.send("telemetry", frame)
+                client.sent += 1
+            except Exception as e:
+                print(f"Error sending telemetry to {client.sid}: {e}")
+
+
+    def _offer(self, client, frame):
+        """Queues a frame for a client, dropping its oldest queued frame if it is not keeping up."""
+        if client.outbox.full():
+            client.outbox.get_nowait()
+            client.dropped += 1
+        client.outbox.put_nowait(frame)
+
+    #---------------------------------------- Clients END -------------------------------------------------
+
+
+    def flush(self):
+        """Packs everything published since the last flush and offers it to every client (decimated per client)."""
+        for stream_id, fields in enumerate(self.streams.values()):
+            batch = self._pending[stream_id]
+            if not batch:
+                continue
+            self._pending[stream_id] = []
+            if len(batch) > MAX_BATCH:
+                batch = batch[-MAX_BATCH:]  # count is a uint16, keep the newest
+            times = np.fromiter((t for t, _ in batch), dtype=np.float64, count=len(batch))
+            values = np.array([v for _, v in batch], dtype=np.float32).reshape(len(batch), len(fields))
+
+            full_frame = None
+            for client in self._clients.values():
+                period = client.periods.get(stream_id)
+                if period is None:
+                    continue
+                if period == 0.0:
+                    # Every full rate client gets the same frame, only the sequence number differs
+                    if full_frame is None:
+                        full_frame = encode_frame(stream_id, 0, times, values)
+                    self._offer(client, self._with_sequence(client, stream_id, full_frame))
+                    continue
+                keep = self._decimate(client, stream_id, times, period)
+                if len(keep):
+                    sequence = self._next_sequence(client, stream_id)
+                    self._offer(client, encode_frame(stream_id, sequence, times[keep], values[keep]))
+
+
+    def _decimate(self, client, stream_id, times, period):
+        """Indices of the samples at least `period` apart, continuing from the client's previous frame."""
+        next_time = client.next_time.get(stream_id, times[0])
+        keep = []
+        for k, t in enumerate(times.tolist()):
+            if t >= next_time:
+                keep.append(k)
+                # Stay on the period grid, but do not try to catch up after a gap
+                next_time = max(next_time + period, t + period / 2)
+        client.next_time[stream_id] = next_time
+        return np.asarray(keep, dtype=np.intp)
+
+
+    @staticmethod
+    def _next_sequence(client, stream_id):
+        sequence = client.sequence.get(stream_id, 0)
+        client.sequence[stream_id] = sequence + 1
+        return sequence
+
+
+    def _with_sequence(self, client, stream_id, frame):
+        frame = bytearray(frame)
+        _SEQUENCE.pack_into(frame, _SEQUENCE_OFFSET, self._next_sequence(client, stream_id) & 0xFFFFFFFF)
+        return bytes(frame)
+
+
+    async def run(self):
+        """Flushes every flush_interval until stop(). A failed flush is printed and streaming carries on."""
+        self._running = True
+        next_flush = time.perf_counter()
+        while self._running:
+            next_flush += self.flush_interval
+            await asyncio.sleep(max(0.0, next_flush - time.perf_counter()))
+            try:
+                self.flush()
+            except Exception as e:
+                print(f"Error flushing telemetry: {e}")
+
+
+    def stop(self):
+        self._running = False
+
+
+    def stats(self):
+        return {client.sid: {"sent": client.sent, "dropped": client.dropped} for client in self._clients.values()}
+
+
+
+#---------------------------------------- Sources START -------------------------------------------------
+
+async def sample_attributes(gateway, stream, source, attributes, rate):
+    """
+    Publishes attributes of an object at a fixed rate, e.g. an ODriveCAN's position / velocity / torque_estimate
+    or the encoder's angle, for sources that are not instrumented to call publish() themselves.
+
+    Example:
+        >>> asyncio.create_task(sample_attributes(gateway, "odrive0", odrive, ("position", "velocity", "torque_estimate"), 100))
+    """
+    period = 1.0 / rate
+    next_sample = time.perf_counter()
+    while True:
+        values = tuple(getattr(source, name) for name in attributes)
+        if all(value is not None for value in values):
+            gateway.publish(stream, time.monotonic(), values)
+        next_sample += period
+        await asyncio.sleep(max(0.0, next_sample - time.perf_counter()))
+
+#---------------------------------------- Sources END -------------------------------------------------
+
+
+
+#---------------------------------------- Transports START -------------------------------------------------
+
+def attach_socketio(gateway, sio):
+    """
+    Serves the gateway on a python-socketio AsyncServer (pip3 install python-socketio).
+
+    Clients emit "subscribe" with {"rates": {stream: max Hz}} and receive "schema" (JSON) and "telemetry" (binary)
+    events.
+
+    Example:
+        >>> sio = socketio.AsyncServer(async_mode="aiohttp")
+        >>> attach_socketio(gateway, sio)
+    """
+    @sio.on("subscribe")
+    async def subscribe(sid, data=None):
+        async def send(event, payload):
+            await sio.emit(event, payload, to=sid)
+        await gateway.add_client(sid, send, (data or {}).get("rates"))
+
+    @sio.on("disconnect")
+    async def disconnect(sid):
+        await gateway.remove_client(sid)
+
+
+class LocalServer:
+    """
+    In process stand-in for the socket.io server: each connected client is a receive callback with an optional
+    per frame delay (to play a slow browser), so the gateway can be tested without a network or browser.
+    """
+
+    def __init__(self, gateway):
+        self.gateway = gateway
+        self.received = {}   # sid -> list of (event, data)
+
+
+    async def connect(self, sid, rates=None, delay=0.0):
+        self.received[sid] = []
+
+        async def send(event, data):
+            if delay:
+                await asyncio.sleep(delay)
+            self.received[sid].append((event, data))
+        await self.gateway.add_client(sid, send, rates)
+
+
+    async def disconnect(self, sid):
+        await self.gateway.remove_client(sid)
+
+#---------------------------------------- Transports END -------------------------------------------------
+
+
+
+async def main(rate, duration):
+    streams = {"imu": ("pitch", "roll"), "odrive0": ("position", "velocity", "torque_estimate"),
+               "controller": ("angle", "omega", "torque")}
+    gateway = TelemetryGateway(streams, flush_interval=0.05)
+    server = LocalServer(gateway)
+    await server.connect("fast", rates=None)                                         # every sample
+    await server.connect("dashboard", rates={"imu": 50, "odrive0": 50, "controller": 20})
+    await server.connect("slow", rates=None, delay=0.2)                              # browser that cannot keep up
+    runner = asyncio.create_task(gateway.run())
+
+    # Control loop stand-in publishing every stream at `rate`
+    period = 1.0 / rate
+    start = time.perf_counter()
+    next_sample = start
+    publish_time = 0.0
+    samples = 0
+    while time.perf_counter() - start < duration:
+        t = time.monotonic()
+        begin = time.perf_counter()
+        gateway.publish("imu", t, (np.sin(t), np.cos(t)))
+        gateway.publish("odrive0", t, (t, 1.0, 0.01))
+        gateway.publish("controller", t, (np.sin(t), 0.5, -0.02))
+        publish_time += time.perf_counter() - begin
+        samples += 3
+        next_sample += period
+        await asyncio.sleep(max(0.0, next_sample - time.perf_counter()))
+    await asyncio.sleep(0.3)
+    gateway.stop()
+    await runner
+
+    json_bytes = len(json.dumps({"t": time.monotonic(), "position": 1.2345678, "velocity": 0.1234567, "torque_estimate": 0.0123456}))
+    print(f"published {gateway.published} samples, {publish_time / samples * 1e6:.2f} us per publish()")
+    for sid, received in server.received.items():
+        frames = [data for event, data in received if event == "telemetry"]
+        values = 0
+        for frame in frames:
+            stream_id = frame[1]
+            for name_id, fields in enumerate(streams.values()):
+                if name_id == stream_id:
+                    values += decode_frame(frame, len(fields))[2].shape[0]
+        size = sum(len(frame) for frame in frames)
+        print(f"  {sid:<10} {len(frames):4d} frames, {values:6d} samples, {size / 1e3:7.1f} kB "
+              f"({size / max(values, 1):.1f} B/sample, one JSON odrive sample is {json_bytes} B), "
+              f"dropped {gateway.stats()[sid]['dropped']}")
+
+    # Every client sees its own gap free sequence per stream unless its outbox dropped frames
+    for sid, received in server.received.items():
+        sequences = {}
+        for event, data in received:
+            if event == "telemetry":
+                _, stream_id, _, sequence, _ = _FRAME_HEADER.unpack_from(data)
+                sequences.setdefault(stream_id, []).append(sequence)
+        gaps = sum(int(np.sum(np.diff(seq) - 1)) for seq in sequences.values())
+        dropped = gateway.stats()[sid]["dropped"]
+        assert gaps <= dropped, (sid, gaps, dropped)  # frames still queued at the end are not gaps
+
+    # A second subscribe from the same sid replaces the client and cancels its sender
+    old_task = gateway._clients["dashboard"].task
+    await server.connect("dashboard", rates={"imu": 10})
+    await asyncio.sleep(0)
+    assert old_task.cancelled() and len(gateway._clients) == 3
+
+    # Round trip check
+    times = np.linspace(100.0, 100.05, 7)
+    values = np.random.rand(7, 3)
+    _, _, decoded_times, decoded = decode_frame(encode_frame(1, 5, times, values), 3)
+    assert np.allclose(decoded_times, times, atol=1e-6) and np.allclose(decoded, values, atol=1e-6)
+
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Telemetry gateway dry run with in process clients.')
+    parser.add_argument('--rate', type=float, default=500.0, help='Samples per second per stream. Default is 500.')
+    parser.add_argument('--duration', type=float, default=3.0)
+    args = parser.parse_args()
+    asyncio.run(main(args.rate, args.duration))
+
+
+
+"""
+Example
+
+import asyncio
+import socketio
+from aiohttp import web
+import telemetry_gateway
+
+gateway = telemetry_gateway.TelemetryGateway({"imu": ("pitch", "roll")}, default_rate=100)
+sio = socketio.AsyncServer(async_mode="aiohttp", cors_allowed_origins="*")
+app = web.Application()
+sio.attach(app)
+telemetry_gateway.attach_socketio(gateway, sio)
+
+async def imu_loop():
+    while True:
+        pitch, roll = get_imu_angles(imu_sensor, imu_calibration_data)
+        gateway.publish("imu", time.monotonic(), (pitch, roll))
+        await asyncio.sleep(0.002)
+
+# Browser side:
+#   socket.emit("subscribe", {rates: {imu: 60}})
+#   socket.on("telemetry", buf => { const v = new DataView(buf); const count = v.getUint16(2, true); ... })
+"""